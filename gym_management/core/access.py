@@ -0,0 +1,94 @@
+from django.conf import settings
+from django.contrib import messages
+from django.db.models import F
+from django.http import Http404
+from django.shortcuts import redirect
+from functools import wraps
+from .gym_cache import get_gym_by_slug
+import time
+
+ALL_ROLES = ('primary', 'manager')
+# Session key holding the user's {gym id: role} map, the version it was loaded at and when
+SESSION_KEY = 'gym_roles'
+
+
+def invalidate_gym_roles(user_id):
+    """Make every session of this user, in any process, reload its gym roles on the next request."""
+    from .models import GymRolesVersion
+
+    if GymRolesVersion.objects.filter(user_id=user_id).update(version=F('version') + 1):
+        return
+    _, created = GymRolesVersion.objects.get_or_create(user_id=user_id, defaults={'version': 1})
+    if not created:
+        # Someone else created the row first, still count this change
+        GymRolesVersion.objects.filter(user_id=user_id).update(version=F('version') + 1)
+
+
+def get_gym_roles(request):
+    """
+    Return {gym id: role} for every gym the logged-in user owns or manages.
+
+    The map is kept in the session for GYM_ROLES_SESSION_TTL seconds at most, and is loaded again
+    as soon as the user's roles version (read with their GymOwner profile, see core.profiles)
+    moves on. Either way it costs one query.
+    """
+    from .models import GymOwnership
+    from .profiles import OWNER
+
+    # Loading the profile first, it can still turn a member into an owner (see load_profile)
+    if not request.user.is_authenticated or not request.profile or request.gym_role != OWNER:
+        return {}
+    owner = request.profile
+    version = owner.roles_version or 0
+    stored = request.session.get(SESSION_KEY)
+    if (
+        stored
+        and stored.get('owner_id') == owner.pk
+        and stored.get('version') == version
+        and time.time() - stored.get('loaded_at', 0) < getattr(settings, 'GYM_ROLES_SESSION_TTL', 60)
+    ):
+        return {int(gym_id): role for gym_id, role in stored['roles'].items()}
+
+    roles = dict(GymOwnership.objects.filter(owner=owner).values_list('gym_id', 'role'))
+    # Session data is JSON, so the gym ids are stored as strings
+    request.session[SESSION_KEY] = {
+        'owner_id': owner.pk,
+        'version': version,
+        'loaded_at': time.time(),
+        'roles': {str(gym_id): role for gym_id, role in roles.items()},
+    }
+    return roles
+
+
+def get_user_gym(request, slug):
+    """Return (gym, role) for a gym the logged-in user owns or manages, or (None, None)."""
+    gym = get_gym_by_slug(slug)
+    role = get_gym_roles(request).get(gym.gym_id) if gym else None
+    return (gym, role) if role else (None, None)
+
+
+def gym_role_required(*roles, message="You are not authorized to access this gym."):
+    """
+    Decorator for views taking a gym `slug`: resolves the gym once, checks the user's role on it
+    and calls the view with `gym` and `role` keyword arguments.
+
+    `roles` defaults to any role. Users with another role on the gym are sent to its dashboard,
+    everyone else to the login page.
+    """
+    allowed = roles or ALL_ROLES
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, slug, *args, **kwargs):
+            gym = get_gym_by_slug(slug)
+            if gym is None:
+                raise Http404("No gym matches the given slug.")
+            role = get_gym_roles(request).get(gym.gym_id)
+            if role not in allowed:
+                messages.error(request, message)
+                if role:
+                    return redirect('gym_dashboard', slug=gym.slug)
+                return redirect('login')
+            return view(request, slug, *args, gym=gym, role=role, **kwargs)
+        return wrapper
+    return decorator
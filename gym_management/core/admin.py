@@ -1,6 +1,6 @@
 from django.contrib import admin
 from .models import GymOwner, GymOwnership, Gym, Member, Visit
-from .models import SubscriptionTier
+from .models import SubscriptionTier, GymDailyVisitStats, MemberVisitStats
 
 @admin.register(SubscriptionTier)
 class SubscriptionTierAdmin(admin.ModelAdmin):
@@ -65,7 +65,26 @@ class MemberAdmin(admin.ModelAdmin):
 # Admin configuration for Visit
 @admin.register(Visit)
 class VisitAdmin(admin.ModelAdmin):
-    list_display = ('member', 'gym_code', 'entry_time', 'exit_time', 'has_exit')
+    list_display = ('member', 'gym', 'gym_code', 'entry_time', 'exit_time', 'has_exit')
     search_fields = ('member__user__username', 'gym_code')
     list_filter = ('entry_time', 'has_exit')
-    ordering = ('entry_time',)
+    ordering = ('-entry_time',)
+    list_select_related = ('member__user', 'gym')
+    raw_id_fields = ('member',)
+    # Skip the extra COUNT over the whole table, gyms browse history through gym_visit_history
+    show_full_result_count = False
+
+# Admin configuration for the daily visit rollups (read mostly, rebuilt via rebuild_visit_rollups)
+@admin.register(GymDailyVisitStats)
+class GymDailyVisitStatsAdmin(admin.ModelAdmin):
+    list_display = ('gym', 'date', 'visit_count', 'total_session_seconds', 'unique_members')
+    list_filter = ('gym',)
+    ordering = ('-date',)
+
+
+# Admin configuration for the per member visit stats (kept up to date on visit close, rebuilt via rebuild_member_stats)
+@admin.register(MemberVisitStats)
+class MemberVisitStatsAdmin(admin.ModelAdmin):
+    list_display = ('member', 'visit_count', 'total_session_seconds', 'last_visit', 'streak_days', 'streak_last_day')
+    list_select_related = ('member__user',)
+    raw_id_fields = ('member',)
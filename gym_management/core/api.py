@@ -0,0 +1,189 @@
+from django.db import IntegrityError
+from django.http import JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+from .access import get_user_gym
+from .db_router import analytics_reads
+from .models import Gym
+from .profiles import OWNER
+from .checkin import toggle_visit, apply_kiosk_events, CheckInError, MAX_SYNC_EVENTS
+from .occupancy import get_occupancy
+from .portfolio import portfolio_metrics, DEFAULT_DAYS as PORTFOLIO_DEFAULT_DAYS, MAX_DAYS as PORTFOLIO_MAX_DAYS
+from .series import visit_series, parse_series_params, InvalidSeriesQuery
+from .visit_history import visit_history_page, parse_history_filters, serialize_visit, InvalidHistoryQuery
+import hmac
+import json
+
+# HTTP status returned for each check-in error code
+CHECKIN_ERROR_STATUS = {
+    'unknown_code': 404,
+    'inactive': 403,
+    'duplicate_scan': 409,
+    'at_capacity': 409,
+}
+
+
+def get_kiosk_gym(request, slug):
+    """
+    Return the gym if the request carries its kiosk token, otherwise None.
+
+    Read from the database rather than the slug cache, so a rotated token or a deleted gym stops
+    working straight away in every process.
+    """
+    token = request.headers.get('X-Kiosk-Token', '')
+    if not token:
+        return None
+    gym = Gym.objects.filter(slug=slug).first()
+    if gym is None or not gym.kiosk_token or not hmac.compare_digest(gym.kiosk_token, token):
+        return None
+    return gym
+
+
+def parse_json_body(request):
+    try:
+        return json.loads(request.body or b'{}')
+    except ValueError:
+        return None
+
+
+# Kiosk check-in: toggles the member between entered and exited in one transaction
+@csrf_exempt
+@require_POST
+def api_check_in(request, slug):
+    gym = get_kiosk_gym(request, slug)
+    if gym is None:
+        return JsonResponse({'status': 'error', 'error': 'unauthorized'}, status=401)
+
+    payload = parse_json_body(request)
+    gym_code = str(payload.get('gym_code', '')).strip() if isinstance(payload, dict) else ''
+    if not gym_code:
+        return JsonResponse({'status': 'error', 'error': 'gym_code_required'}, status=400)
+
+    try:
+        member, action, visit = toggle_visit(gym, gym_code)
+    except CheckInError as error:
+        return JsonResponse(
+            {'status': 'error', 'error': error.code, 'message': error.message},
+            status=CHECKIN_ERROR_STATUS.get(error.code, 400),
+        )
+
+    return JsonResponse({
+        'status': 'ok',
+        'action': action,
+        'member': member.user.first_name,
+        'visit_id': visit.id,
+        'entry_time': visit.entry_time.isoformat(),
+        'exit_time': visit.exit_time.isoformat() if visit.exit_time else None,
+    })
+
+
+# Batch sync for kiosks that queued scans while offline
+@csrf_exempt
+@require_POST
+def api_check_in_batch(request, slug):
+    gym = get_kiosk_gym(request, slug)
+    if gym is None:
+        return JsonResponse({'status': 'error', 'error': 'unauthorized'}, status=401)
+
+    payload = parse_json_body(request)
+    events = payload.get('events') if isinstance(payload, dict) else None
+    if not isinstance(events, list):
+        return JsonResponse({'status': 'error', 'error': 'events_required'}, status=400)
+    if len(events) > MAX_SYNC_EVENTS:
+        return JsonResponse(
+            {'status': 'error', 'error': 'too_many_events', 'message': f"Send at most {MAX_SYNC_EVENTS} events per batch."},
+            status=400,
+        )
+
+    try:
+        results = apply_kiosk_events(gym, events)
+    except IntegrityError:
+        # Another batch from this gym touched the same members or events, nothing was applied
+        return JsonResponse({'status': 'error', 'error': 'conflict', 'message': "Please resend this batch."}, status=409)
+
+    return JsonResponse({'status': 'ok', 'results': results})
+
+
+# Cheap polling endpoint for "people currently in the gym" displays
+def api_occupancy(request, slug):
+    gym = get_kiosk_gym(request, slug)
+    if gym is None and request.user.is_authenticated:
+        gym, role = get_user_gym(request, slug)
+    if gym is None:
+        return JsonResponse({'status': 'error', 'error': 'unauthorized'}, status=401)
+
+    occupancy = get_occupancy(gym.gym_id)
+    return JsonResponse({
+        'status': 'ok',
+        'occupancy': occupancy['current_occupancy'],
+        'max_capacity': occupancy['max_capacity'],
+    })
+
+
+# Visit history for a gym as JSON, paged with the cursor returned as next_cursor
+@analytics_reads()
+def api_visit_history(request, slug):
+    if not request.user.is_authenticated:
+        return JsonResponse({'status': 'error', 'error': 'unauthorized'}, status=401)
+    gym, role = get_user_gym(request, slug)
+    if gym is None:
+        return JsonResponse({'status': 'error', 'error': 'not_found'}, status=404)
+
+    try:
+        filters = parse_history_filters(request.GET)
+        visits, next_cursor = visit_history_page(
+            gym,
+            member=filters['member'],
+            status=filters['status'],
+            start=filters['start'],
+            end=filters['end'],
+            cursor=filters['cursor'],
+            limit=filters['limit'],
+        )
+    except InvalidHistoryQuery as error:
+        return JsonResponse({'status': 'error', 'error': 'invalid_query', 'message': str(error)}, status=400)
+
+    return JsonResponse({
+        'status': 'ok',
+        'visits': [serialize_visit(visit) for visit in visits],
+        'next_cursor': next_cursor,
+    })
+
+
+# Visits per hour, day or week for the dashboard charts
+@analytics_reads()
+def api_visit_series(request, slug):
+    if not request.user.is_authenticated:
+        return JsonResponse({'status': 'error', 'error': 'unauthorized'}, status=401)
+    gym, role = get_user_gym(request, slug)
+    if gym is None:
+        return JsonResponse({'status': 'error', 'error': 'not_found'}, status=404)
+
+    try:
+        params = parse_series_params(request.GET)
+    except InvalidSeriesQuery as error:
+        return JsonResponse({'status': 'error', 'error': 'invalid_query', 'message': str(error)}, status=400)
+
+    bucket, points = visit_series(gym, **params)
+    return JsonResponse({'status': 'ok', 'bucket': bucket, 'points': points})
+
+
+# Metrics for every gym the owner is the primary owner of, for the portfolio page
+@analytics_reads()
+def api_portfolio(request):
+    if not request.user.is_authenticated:
+        return JsonResponse({'status': 'error', 'error': 'unauthorized'}, status=401)
+    if not request.profile or request.gym_role != OWNER:
+        return JsonResponse({'status': 'error', 'error': 'not_found'}, status=404)
+
+    try:
+        days = min(max(int(request.GET.get('days', PORTFOLIO_DEFAULT_DAYS)), 1), PORTFOLIO_MAX_DAYS)
+    except ValueError:
+        return JsonResponse({'status': 'error', 'error': 'invalid_query', 'message': "'days' must be a number."}, status=400)
+
+    rows, totals = portfolio_metrics(request.profile_id, days=days)
+    # Money is sent as a string so no precision is lost
+    for row in [*rows, totals]:
+        row['revenue'] = str(row['revenue'])
+        row.pop('session_seconds', None)
+    return JsonResponse({'status': 'ok', 'days': days, 'gyms': rows, 'totals': totals})
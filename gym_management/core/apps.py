@@ -1,6 +1,4 @@
 from django.apps import AppConfig
-import threading
-from .crons import auto_exit_cron_job
 
 
 class CoreConfig(AppConfig):
@@ -8,6 +6,7 @@ class CoreConfig(AppConfig):
     name = "core"
 
     def ready(self):
-        # Start the auto_exit_cron_job in a background thread
-        thread = threading.Thread(target=auto_exit_cron_job, daemon=True)
-        thread.start()
\ No newline at end of file
+        # Connect the signal handlers that keep usage counters up to date
+        from . import signals  # noqa: F401
+        # And the deploy checks
+        from . import checks  # noqa: F401
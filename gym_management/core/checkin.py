@@ -0,0 +1,176 @@
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from .metrics import invalidate_gym_metrics
+from .models import KioskEvent, Member, Visit
+from .occupancy import reconcile_occupancy, try_enter
+from .rollups import record_closed_visits
+from .series import invalidate_visit_series
+
+
+class CheckInError(Exception):
+    """Raised when a scan can't be turned into an entry or exit."""
+
+    def __init__(self, code, message, member=None):
+        super().__init__(message)
+        self.code = code
+        self.message = message
+        self.member = member
+
+
+def toggle_visit(gym, gym_code):
+    """
+    Check a member in or out of `gym` by their gym code, returns (member, action, visit).
+
+    The member row is locked for the length of the transaction so two fast scans of the same
+    code are applied one after the other, and the one_open_visit_per_member constraint backs
+    that up on databases without row locks (SQLite).
+    """
+    try:
+        with transaction.atomic():
+            try:
+                member = (
+                    Member.objects.select_for_update()
+                    .select_related('user')
+                    .get(gym_code=gym_code, gym=gym)
+                )
+            except Member.DoesNotExist:
+                raise CheckInError('unknown_code', "Invalid gym code or you are not associated with this gym.")
+
+            # Check if the member's subscription is active
+            if not member.active:
+                raise CheckInError(
+                    'inactive',
+                    f"Your subscription is inactive {member.user.first_name}, you cant Check-in right now.",
+                    member=member,
+                )
+
+            # Check if the member already has an active visit
+            visit = Visit.objects.filter(member=member, exit_time__isnull=True).first()
+            if visit:
+                visit.close()
+                return member, 'exit', visit
+
+            if not try_enter(gym.gym_id):
+                raise CheckInError(
+                    'at_capacity',
+                    f"Sorry {member.user.first_name}, the gym is at capacity right now.",
+                    member=member,
+                )
+            visit = Visit.objects.create(member=member, gym=gym, gym_code=gym_code)
+            return member, 'enter', visit
+    except IntegrityError:
+        # A concurrent scan opened a visit between our lookup and insert
+        raise CheckInError('duplicate_scan', "This code was just scanned, please try again.")
+
+
+# Largest batch a kiosk may sync in one request
+MAX_SYNC_EVENTS = 1000
+
+
+def _parse_event(event):
+    """Validate one raw kiosk event, returns (event_id, gym_code, action, occurred_at) or None."""
+    if not isinstance(event, dict):
+        return None
+    event_id = str(event.get('event_id') or '').strip()
+    gym_code = str(event.get('gym_code') or '').strip()
+    action = event.get('action')
+    try:
+        occurred_at = parse_datetime(str(event.get('timestamp') or ''))
+    except ValueError:
+        # Well formed but not a real date or time, such as February 30th
+        occurred_at = None
+    if not event_id or len(event_id) > 64 or not gym_code or action not in ('enter', 'exit') or occurred_at is None:
+        return None
+    if timezone.is_naive(occurred_at):
+        occurred_at = timezone.make_aware(occurred_at)
+    return event_id, gym_code, action, occurred_at
+
+
+def apply_kiosk_events(gym, events):
+    """
+    Apply a batch of timestamped enter/exit events from a kiosk, in the order given.
+
+    Events already applied (same client event_id) are reported again with their original result,
+    so a kiosk can safely resend a batch it never got an answer for. Returns one
+    {'event_id', 'result'} dict per event. The members, their open visits and the previously
+    seen events are each loaded with one query, and the changes are written with bulk inserts
+    and updates. Capacity is not enforced here as the people have already walked in.
+    """
+    parsed = [_parse_event(event) for event in events]
+    event_ids = [event[0] for event in parsed if event]
+    gym_codes = {event[1] for event in parsed if event}
+
+    with transaction.atomic():
+        seen = dict(
+            KioskEvent.objects.filter(gym=gym, client_event_id__in=event_ids).values_list('client_event_id', 'result')
+        )
+        members = {member.gym_code: member for member in Member.objects.filter(gym=gym, gym_code__in=gym_codes)}
+        open_visits = {
+            visit.member_id: visit
+            for visit in Visit.objects.filter(member__in=members.values(), exit_time__isnull=True)
+        }
+
+        results = []
+        new_visits = []
+        closed_visits = []
+        new_events = []
+        for raw, event in zip(events, parsed):
+            if event is None:
+                raw_id = raw.get('event_id') if isinstance(raw, dict) else None
+                results.append({'event_id': raw_id, 'result': 'invalid'})
+                continue
+
+            event_id, gym_code, action, occurred_at = event
+            if event_id in seen:
+                results.append({'event_id': event_id, 'result': seen[event_id], 'duplicate': True})
+                continue
+
+            member = members.get(gym_code)
+            visit = open_visits.get(member.id) if member else None
+            if member is None:
+                result = 'unknown_code'
+            elif not member.active:
+                result = 'inactive'
+            elif action == 'enter':
+                if visit:
+                    result = 'already_in'
+                else:
+                    visit = Visit(member=member, gym=gym, gym_code=gym_code, entry_time=occurred_at)
+                    new_visits.append(visit)
+                    open_visits[member.id] = visit
+                    result = 'entered'
+            elif visit is None:
+                result = 'not_in'
+            elif occurred_at < visit.entry_time:
+                result = 'invalid_time'
+            else:
+                visit.exit_time = occurred_at
+                visit.has_exit = True
+                if visit.pk:
+                    closed_visits.append(visit)
+                del open_visits[member.id]
+                result = 'exited'
+
+            seen[event_id] = result
+            new_events.append(KioskEvent(
+                gym=gym, client_event_id=event_id, gym_code=gym_code,
+                action=action, occurred_at=occurred_at, result=result,
+            ))
+            results.append({'event_id': event_id, 'result': result})
+
+        # Close before inserting so a member who left and came back never has two open visits
+        Visit.objects.bulk_update(closed_visits, ['exit_time', 'has_exit'])
+        Visit.objects.bulk_create(new_visits)
+        KioskEvent.objects.bulk_create(new_events)
+
+        closed_ids = [visit.pk for visit in closed_visits + new_visits if visit.exit_time]
+        if closed_ids:
+            record_closed_visits(closed_ids)
+        if new_visits or closed_visits:
+            reconcile_occupancy(gym_ids=[gym.gym_id])
+            invalidate_gym_metrics(gym.gym_id)
+            # Queued scans can land in series buckets that are already cached
+            invalidate_visit_series(gym.gym_id, [visit.entry_time for visit in closed_visits + new_visits])
+
+    return results
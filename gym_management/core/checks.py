@@ -0,0 +1,20 @@
+from django.conf import settings
+from django.core.checks import Tags, Warning, register
+
+
+@register(Tags.caches, deploy=True)
+def check_shared_cache(app_configs, **kwargs):
+    """The cache invalidations made by one process only reach the others through a shared cache."""
+    from gym_management.caches import SHARED_BACKENDS
+
+    if settings.CACHES['default']['BACKEND'] in SHARED_BACKENDS:
+        return []
+    return [Warning(
+        "The default cache is local to each process.",
+        hint=(
+            "Dashboard metrics, visit series and gym lookups cached by one web worker aren't invalidated by "
+            "writes in other workers, management commands or run_scheduler. Set GYM_CACHE_BACKEND to redis, "
+            "memcached, database or file."
+        ),
+        id='core.W001',
+    )]
@@ -1,20 +1,84 @@
+from django.db import transaction
+from django.db.models import F, Min
 from django.utils.timezone import now
+import logging
 import time
+from .scheduler import periodic_job
 
-def auto_exit_cron_job():
-    """Marks overdue visits as complete."""
+logger = logging.getLogger(__name__)
+
+# Seconds between auto exit sweeps, core.series waits this long past the exit threshold before caching a bucket
+AUTO_EXIT_INTERVAL = 300
+AUTO_EXIT_JITTER = 30
+
+
+@periodic_job(interval=AUTO_EXIT_INTERVAL, jitter=AUTO_EXIT_JITTER)  # Every 5 minutes
+def auto_exit_sweep(chunk_size=500):
+    """
+    Close overdue visits with chunked bulk UPDATEs.
+
+    A visit is overdue once it has been open for longer than Visit.default_exit_threshold,
+    it is then given the default exit duration. Each chunk is its own short transaction so
+    the write lock is never held for the whole sweep.
+    """
     from .models import Visit
+    from .occupancy import leave_visits
+    from .rollups import record_closed_visits
+    from .series import invalidate_visit_series
 
+    cutoff = now() - Visit.default_exit_threshold
+    overdue_visits = Visit.objects.filter(exit_time__isnull=True, has_exit=False, entry_time__lt=cutoff)
+
+    closed = 0
+    chunk_timings = []
     while True:
-        print("Running auto_exit_cron_job...")  # For debugging; remove in production
-        # Fetch all visits that haven't exited and are overdue
-        overdue_visits = Visit.objects.filter(exit_time__isnull=True, has_exit=False)
-        for visit in overdue_visits:
-            elapsed_time = now() - visit.entry_time
-            if elapsed_time > visit.default_exit_threshold:
-                # Mark visit as completed
-                visit.exit_time = visit.entry_time + visit.default_exit_duration
-                visit.has_exit = True
-                visit.save()
-                print("Updated Visit Exit")
-        time.sleep(300)  # Wait for 5 minutes (300 seconds) before running again
\ No newline at end of file
+        started = time.monotonic()
+        with transaction.atomic():
+            visit_ids = list(overdue_visits.select_for_update().order_by('entry_time').values_list('id', flat=True)[:chunk_size])
+            if not visit_ids:
+                break
+            updated = Visit.objects.filter(id__in=visit_ids, exit_time__isnull=True).update(
+                exit_time=F('entry_time') + Visit.default_exit_duration,
+                has_exit=True,
+            )
+            record_closed_visits(visit_ids)
+            leave_visits(visit_ids)
+            # A late sweep closes visits in series buckets that may already be cached
+            oldest = Visit.objects.filter(id__in=visit_ids, gym__isnull=False).values('gym_id').annotate(entry_time=Min('entry_time')).order_by()
+            for row in oldest:
+                invalidate_visit_series(row['gym_id'], [row['entry_time']])
+        elapsed = time.monotonic() - started
+        closed += updated
+        chunk_timings.append(elapsed)
+        logger.info("auto_exit_sweep: closed %d visits in %.3fs", updated, elapsed)
+
+    logger.info("auto_exit_sweep: closed %d overdue visits in %d chunks", closed, len(chunk_timings))
+    return {'closed': closed, 'chunk_timings': chunk_timings}
+
+
+@periodic_job(interval=900, jitter=60)  # Every 15 minutes
+def reconcile_occupancy_job():
+    """Correct any drift between the occupancy counters and the real open visits."""
+    from .occupancy import reconcile_occupancy
+
+    fixed = reconcile_occupancy()
+    if fixed:
+        logger.warning("reconcile_occupancy_job: corrected occupancy for %d gyms", fixed)
+
+
+@periodic_job(interval=3600, jitter=300)  # Every hour
+def reconcile_usage_job():
+    """Recount every owner's subscription usage to correct any drift in the counters."""
+    from .quotas import reconcile_usage
+
+    owners = reconcile_usage()
+    logger.info("reconcile_usage_job: recounted usage for %d owners", owners)
+
+
+@periodic_job(interval=86400, jitter=3600)  # Once a day
+def prune_visit_tallies_job():
+    """Remove day tallies that are too old to count towards the rolling leaderboard."""
+    from .leaderboard import prune_day_tallies
+
+    deleted = prune_day_tallies()
+    logger.info("prune_visit_tallies_job: removed %d day tallies", deleted)
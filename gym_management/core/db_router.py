@@ -0,0 +1,95 @@
+from contextlib import ContextDecorator
+from contextvars import ContextVar
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+# Alias of the read replica in settings.DATABASES, routing is off while it isn't configured
+REPLICA_ALIAS = getattr(settings, 'ANALYTICS_REPLICA_ALIAS', 'replica')
+# Only these apps' models are read from the replica, sessions and users always come from the primary
+REPLICA_APP_LABELS = {'core'}
+# Cookie that keeps a browser on the primary for a few seconds after it wrote, so it reads its own writes
+PIN_COOKIE = 'db_pin_primary'
+
+_analytics = ContextVar('analytics_reads', default=False)
+_pinned = ContextVar('pinned_to_primary', default=False)
+_wrote = ContextVar('wrote_to_primary', default=False)
+
+
+def replica_configured():
+    return REPLICA_ALIAS in settings.DATABASES
+
+
+def is_pinned():
+    return _pinned.get()
+
+
+def has_written():
+    return _wrote.get()
+
+
+def pin_to_primary():
+    """Send every remaining read of this request to the primary."""
+    _pinned.set(True)
+
+
+class analytics_reads(ContextDecorator):
+    """
+    Marks a block or view as read-only analytics, whose queries may be served by the replica.
+
+    Use as `with analytics_reads():` or as a view decorator. Once the code writes anything,
+    the rest of the request reads from the primary again.
+    """
+
+    def __init__(self):
+        self._tokens = []
+
+    def _recreate_cm(self):
+        # A fresh instance per decorated call, so concurrent calls don't share tokens
+        return type(self)()
+
+    def __enter__(self):
+        self._tokens.append(_analytics.set(True))
+        return self
+
+    def __exit__(self, *exc_info):
+        _analytics.reset(self._tokens.pop())
+        return False
+
+
+def analytics_iterator(iterable):
+    """Iterate inside analytics_reads, for streamed responses consumed after the view has returned."""
+    with analytics_reads():
+        yield from iterable
+
+
+class AnalyticsReplicaRouter:
+    """
+    Routes reads made inside analytics_reads to the replica, everything else to the primary.
+
+    Reads stay on the primary inside a transaction and for the rest of a request once it has
+    written (see ReplicaPinningMiddleware).
+    """
+
+    def db_for_read(self, model, **hints):
+        if (
+            _analytics.get()
+            and not _pinned.get()
+            and model._meta.app_label in REPLICA_APP_LABELS
+            and replica_configured()
+            and not connections[DEFAULT_DB_ALIAS].in_atomic_block
+        ):
+            return REPLICA_ALIAS
+        return None
+
+    def db_for_write(self, model, **hints):
+        # Session and login writes don't touch anything read from the replica
+        if model._meta.app_label in REPLICA_APP_LABELS:
+            _wrote.set(True)
+            pin_to_primary()
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # The replica holds the same rows as the primary
+        if {obj1._state.db, obj2._state.db} <= {DEFAULT_DB_ALIAS, REPLICA_ALIAS}:
+            return True
+        return None
@@ -0,0 +1,95 @@
+from django.utils import timezone
+from .rollups import day_bounds
+import csv
+import json
+import zlib
+
+EXPORT_FORMATS = ('csv', 'jsonl')
+EXPORT_COLUMNS = ['id', 'gym', 'member', 'gym_code', 'entry_time', 'exit_time', 'session_minutes']
+CONTENT_TYPES = {'csv': 'text/csv', 'jsonl': 'application/x-ndjson'}
+DEFAULT_CHUNK_SIZE = 2000
+# Lines are joined into blocks of about this many bytes before they are sent or compressed
+BLOCK_SIZE = 64 * 1024
+
+
+class _Echo:
+    """File-like object for csv.writer that hands back each written line instead of storing it."""
+
+    def write(self, value):
+        return value
+
+
+def visit_export_rows(gyms=None, start=None, end=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Yield one tuple per visit (in EXPORT_COLUMNS order), oldest first.
+
+    `start` and `end` are local dates, both included. Rows are read with a server-side cursor
+    where the database has one, `chunk_size` at a time, so memory stays flat for any gym size.
+    """
+    from .models import Visit
+
+    visits = Visit.objects.all()
+    if gyms is not None:
+        visits = visits.filter(gym__in=gyms)
+    if start:
+        visits = visits.filter(entry_time__gte=day_bounds(start)[0])
+    if end:
+        visits = visits.filter(entry_time__lt=day_bounds(end)[1])
+
+    rows = visits.order_by('entry_time', 'id').values_list(
+        'id', 'gym__slug', 'member__user__username', 'member__gym_code', 'entry_time', 'exit_time',
+    )
+    for visit_id, gym, member, gym_code, entry_time, exit_time in rows.iterator(chunk_size=chunk_size):
+        session_minutes = round((exit_time - entry_time).total_seconds() / 60, 2) if exit_time else None
+        yield (
+            visit_id, gym, member, gym_code,
+            timezone.localtime(entry_time).isoformat(),
+            timezone.localtime(exit_time).isoformat() if exit_time else None,
+            session_minutes,
+        )
+
+
+def _lines(rows, export_format):
+    if export_format == 'csv':
+        writer = csv.writer(_Echo())
+        yield writer.writerow(EXPORT_COLUMNS)
+        for row in rows:
+            yield writer.writerow(['' if value is None else value for value in row])
+    else:
+        for row in rows:
+            yield json.dumps(dict(zip(EXPORT_COLUMNS, row))) + '\n'
+
+
+def _blocks(lines):
+    """Join text lines into encoded blocks of roughly BLOCK_SIZE bytes."""
+    block, size = [], 0
+    for line in lines:
+        block.append(line)
+        size += len(line)
+        if size >= BLOCK_SIZE:
+            yield ''.join(block).encode()
+            block, size = [], 0
+    if block:
+        yield ''.join(block).encode()
+
+
+def _gzip(blocks):
+    # wbits=31 writes a gzip header and trailer, so the output is a regular .gz file
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for block in blocks:
+        compressed = compressor.compress(block)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def stream_visit_export(gyms=None, export_format='csv', start=None, end=None, compress=False, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Yield the export as byte blocks, CSV with a header row or one JSON object per line, optionally gzipped."""
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format: {export_format}")
+    blocks = _blocks(_lines(visit_export_rows(gyms, start, end, chunk_size), export_format))
+    return _gzip(blocks) if compress else blocks
+
+
+def export_filename(name, export_format, compress=False):
+    return f"{name}-visits.{export_format}{'.gz' if compress else ''}"
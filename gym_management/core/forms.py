@@ -4,6 +4,7 @@ from django.contrib.auth.models import User
 from .models import VerificationToken
 from django.core.exceptions import ValidationError
 from django.utils.timezone import now
+from .quotas import check_quota
 
 
 # Gym Code Login Form
@@ -80,18 +81,20 @@ class MemberUpdateForm(forms.ModelForm):
 class GymUpdateForm(forms.ModelForm):
     class Meta:
         model = Gym
-        fields = ['name', 'address', 'contact_number', 'email']
+        fields = ['name', 'address', 'contact_number', 'email', 'max_capacity']
         widgets = {
             'name': forms.TextInput(attrs={'class': 'form-control'}),
             'address': forms.Textarea(attrs={'class': 'form-control', 'rows': 3}),
             'contact_number': forms.TextInput(attrs={'class': 'form-control'}),  
             'email': forms.EmailInput(attrs={'class': 'form-control'}),  
+            'max_capacity': forms.NumberInput(attrs={'class': 'form-control'}),
         }
         labels = {
             'name': 'Gym Name',
             'address': 'Gym Location',
             'contact_number': 'Gym Contact Number',  
             'email': 'Gym Email Address',  
+            'max_capacity': 'Maximum Capacity (leave empty for no limit)',
         }
 
 
@@ -147,8 +150,9 @@ class GymCreationForm(forms.ModelForm):
         model = Gym
         fields = ['name', 'address', 'contact_number', 'email', 'email_domain']  # Include fields to create a gym
 
-    def __init__(self, *args, **kwargs):
+    def __init__(self, *args, owner=None, **kwargs):
         super().__init__(*args, **kwargs)
+        self.owner = owner  # GymOwner creating the gym, checked against their gym limit
         
         # Optional: Add custom styling or validation to the form fields if needed
         self.fields['name'].widget.attrs.update({'placeholder': 'Enter Gym Name'})
@@ -156,8 +160,24 @@ class GymCreationForm(forms.ModelForm):
         self.fields['email'].widget.attrs.update({'placeholder': 'Enter Gym Email (optional)'})
         self.fields['email_domain'].widget.attrs.update({'placeholder': 'Enter Custom Email Domain (optional)'})
     
+    def clean(self):
+        cleaned_data = super().clean()
+        if self.owner is not None and not check_quota(self.owner, 'gyms'):
+            raise ValidationError("You have reached the maximum number of gyms for your subscription.")
+        return cleaned_data
+
     def save(self, *args, **kwargs):
         # When saving, don't commit the owner as it will be handled manually in the view
         gym = super().save(commit=False)
         gym.save()  # Save the gym without owners first
-        return gym
\ No newline at end of file
+        return gym
+
+
+
+# Form for uploading a CSV of members to import
+class MemberImportForm(forms.Form):
+    file = forms.FileField(
+        label="Members CSV",
+        help_text="Columns: username, contact_number (required), email, first_name, last_name, date_of_birth, address, active, password.",
+        widget=forms.ClearableFileInput(attrs={'class': 'form-control', 'accept': '.csv'}),
+    )
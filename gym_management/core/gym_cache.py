@@ -0,0 +1,107 @@
+from collections import OrderedDict
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+import threading
+import time
+
+# Gym columns kept in the cache. The live occupancy is left out on purpose: it changes on every
+# scan, so it is a deferred field on cached gyms and always read from the database.
+UNCACHED_FIELDS = {'current_occupancy'}
+
+
+class LocalLRU:
+    """A small thread safe least recently used cache with a per entry time to live, local to this process."""
+
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+# Other processes only see an invalidation once their local copy expires, so keep this short
+_local = LocalLRU(max_size=getattr(settings, 'GYM_SLUG_LOCAL_CACHE_SIZE', 256), ttl=getattr(settings, 'GYM_SLUG_LOCAL_CACHE_TTL', 5))
+
+
+def _cache_key(slug):
+    return f"gym-slug:{slug}"
+
+
+def _cached_field_names():
+    from .models import Gym
+
+    return [field.attname for field in Gym._meta.concrete_fields if field.attname not in UNCACHED_FIELDS]
+
+
+def _to_row(gym):
+    return tuple(getattr(gym, name) for name in _cached_field_names())
+
+
+def _from_row(row):
+    from .models import Gym
+
+    # A new instance per call, so a view changing its gym never changes the cached copy
+    return Gym.from_db(DEFAULT_DB_ALIAS, _cached_field_names(), row)
+
+
+def get_gym_by_slug(slug):
+    """
+    Return the Gym with this slug, or None.
+
+    Looked up in this process's LRU, then the default cache, then the database. The gym comes
+    back with current_occupancy deferred, reading it runs a fresh query.
+
+    Unless CACHES names a shared backend the default cache is per process too, so other
+    processes can serve a changed or deleted gym for up to GYM_SLUG_CACHE_TTL seconds. Only
+    use it where that is harmless: access is still checked against the roles in the database
+    (see core.access) and kiosk tokens are checked against the database row (see core.api).
+    """
+    from .models import Gym
+
+    key = _cache_key(slug)
+    row = _local.get(key)
+    if row is None:
+        row = cache.get(key)
+        if row is None:
+            gym = Gym.objects.filter(slug=slug).only(*_cached_field_names()).first()
+            if gym is None:
+                return None
+            row = _to_row(gym)
+            cache.set(key, row, getattr(settings, 'GYM_SLUG_CACHE_TTL', 300))
+        _local.set(key, row)
+    return _from_row(row)
+
+
+def invalidate_gym_slug(slug):
+    """Forget a cached gym, called whenever a gym is saved or deleted."""
+    key = _cache_key(slug)
+    _local.delete(key)
+    cache.delete(key)
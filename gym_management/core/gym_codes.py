@@ -0,0 +1,111 @@
+from django.db import transaction
+from django.db.models import F
+import hashlib
+import secrets
+
+# Gym codes are the 6 digit numbers 100000-999999
+CODE_MIN = 100000
+CODE_SPACE = 900000
+
+# The permutation works on 20 bit numbers (2^20 >= CODE_SPACE) split into two 10 bit halves
+HALF_BITS = 10
+HALF_MASK = (1 << HALF_BITS) - 1
+ROUNDS = 4
+
+
+class GymCodesExhausted(Exception):
+    """Raised when every 6 digit gym code has been handed out."""
+
+
+def _round(seed, round_number, value):
+    digest = hashlib.sha256(f"{seed}:{round_number}:{value}".encode()).digest()
+    return int.from_bytes(digest[:4], 'big') & HALF_MASK
+
+
+def _permute(seed, index):
+    """
+    Map a sequence index onto a gym code, every index in [0, CODE_SPACE) gets a different code.
+
+    A keyed Feistel network shuffles the 20 bit space and values outside the code space are
+    walked through the network again until they land inside it, so consecutive indices give
+    unrelated looking codes.
+    """
+    value = index
+    while True:
+        left, right = value >> HALF_BITS, value & HALF_MASK
+        for round_number in range(ROUNDS):
+            left, right = right, left ^ _round(seed, round_number, right)
+        value = (left << HALF_BITS) | right
+        if value < CODE_SPACE:
+            return CODE_MIN + value
+
+
+def _unpermute(seed, code):
+    """The sequence index _permute maps onto `code`, the same network run backwards."""
+    value = code - CODE_MIN
+    while True:
+        left, right = value >> HALF_BITS, value & HALF_MASK
+        for round_number in reversed(range(ROUNDS)):
+            left, right = right ^ _round(seed, round_number, left), left
+        value = (left << HALF_BITS) | right
+        if value < CODE_SPACE:
+            return value
+
+
+def _reserve(count):
+    """Move the shared sequence on by `count`, returns (seed, first reserved index)."""
+    from .models import GymCodeSequence
+
+    with transaction.atomic():
+        GymCodeSequence.objects.get_or_create(pk=1, defaults={'seed': secrets.token_hex(16)})
+        # Increment before reading so the row is write locked and no other process reserves the same range
+        GymCodeSequence.objects.filter(pk=1).update(next_index=F('next_index') + count)
+        sequence = GymCodeSequence.objects.get(pk=1)
+        if sequence.next_index > CODE_SPACE:
+            raise GymCodesExhausted("All gym codes have been allocated.")
+    return sequence.seed, sequence.next_index - count
+
+
+def allocate_gym_codes(count=1):
+    """
+    Hand out `count` unused gym codes.
+
+    Codes come from a shuffled sequence shared by every process, so allocating is a single
+    UPDATE whatever the batch size. Codes picked at random before the sequence existed are
+    skipped by one lookup per batch.
+    """
+    from .models import Member
+
+    codes = []
+    while len(codes) < count:
+        needed = count - len(codes)
+        seed, start = _reserve(needed)
+        candidates = [str(_permute(seed, index)) for index in range(start, start + needed)]
+        taken = set(Member.objects.filter(gym_code__in=candidates).values_list('gym_code', flat=True))
+        codes.extend(code for code in candidates if code not in taken)
+    return codes
+
+
+def gym_code_usage():
+    """
+    How much of the gym code space has been handed out.
+
+    Remaining codes are the ones the sequence hasn't reached yet, less the codes members
+    already hold further along it (picked at random before the sequence existed), which
+    allocate_gym_codes will skip.
+    """
+    from .models import GymCodeSequence, Member
+
+    sequence = GymCodeSequence.objects.filter(pk=1).first()
+    allocated = sequence.next_index if sequence else 0
+    ahead = 0
+    codes = Member.objects.filter(gym_code__regex=r'^[1-9][0-9]{5}$').values_list('gym_code', flat=True)
+    for code in codes.iterator(chunk_size=2000):
+        if sequence is None or _unpermute(sequence.seed, int(code)) >= allocated:
+            ahead += 1
+    return {
+        'total': CODE_SPACE,
+        'allocated': allocated,
+        'held_ahead': ahead,
+        'remaining': max(CODE_SPACE - allocated - ahead, 0),
+    }
@@ -0,0 +1,185 @@
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.db.models import FloatField, Func, Q
+from django.utils import timezone
+from datetime import date, datetime, time, timedelta
+
+try:
+    import numpy as np
+except ImportError:  # The heatmap is the only feature that needs NumPy
+    np = None
+
+DAYS = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+CELLS = 7 * 24
+DEFAULT_WEEKS = 52
+MAX_WEEKS = 260
+# 1970-01-01 was a Thursday
+LOCAL_EPOCH = date(1970, 1, 1)
+EPOCH_WEEKDAY = 3
+
+
+class EpochSeconds(Func):
+    """
+    Seconds since 1970-01-01 UTC of a datetime column, worked out by the database so thousands
+    of rows don't each go through Django's datetime conversion.
+    """
+    output_field = FloatField()
+    template = 'CAST(EXTRACT(EPOCH FROM %(expressions)s) AS double precision)'
+
+    def as_sqlite(self, compiler, connection, **extra_context):
+        return self.as_sql(compiler, connection, template='((julianday(%(expressions)s) - 2440587.5) * 86400.0)', **extra_context)
+
+    def as_mysql(self, compiler, connection, **extra_context):
+        return self.as_sql(compiler, connection, template='UNIX_TIMESTAMP(%(expressions)s)', **extra_context)
+
+
+def week_start(day):
+    """The Monday of the week containing `day`."""
+    return day - timedelta(days=day.weekday())
+
+
+def _cache_key(gym_id, monday):
+    return f"gym-heatmap:v2:{gym_id}:{monday.isoformat()}"
+
+
+def _empty_week():
+    # Seconds of member presence per (weekday, hour) cell, the visits still open when last folded
+    # and the week's watermark: all of its visits with an id up to last_id are folded in
+    return {'seconds': np.zeros(CELLS), 'open_ids': set(), 'last_id': 0}
+
+
+def _local_seconds(utc):
+    """
+    Turn UTC epoch seconds into seconds since the epoch on the local wall clock, so hours and
+    weekdays line up with the gym's. The UTC offset is looked up once per distinct hour.
+    """
+    hours, inverse = np.unique(utc // 3600, return_inverse=True)
+    zone = timezone.get_current_timezone()
+    offsets = np.array([datetime.fromtimestamp(hour * 3600, zone).utcoffset().total_seconds() for hour in hours.tolist()])
+    return utc + offsets[inverse.reshape(-1)]
+
+
+def bin_visits(entries, exits):
+    """
+    Spread visits over the 168 weekday-hour cells of a week.
+
+    `entries` and `exits` are arrays of local epoch seconds. Every visit is split into the
+    clock hours it touches and each hour's cell gets the seconds actually spent in it.
+    Returns (visit index, cell index, seconds) arrays for every visit-hour piece.
+    """
+    first_hour = entries // 3600
+    last_hour = np.maximum((exits - 1) // 3600, first_hour)
+    pieces = (last_hour - first_hour + 1).astype(np.int64)
+
+    visit = np.repeat(np.arange(len(entries)), pieces)
+    # Offset of each piece within its visit, 0, 1, 2 ... without a Python loop
+    offset = np.arange(pieces.sum()) - np.repeat(np.cumsum(pieces) - pieces, pieces)
+    hour = first_hour[visit] + offset
+
+    seconds = np.minimum(exits[visit], (hour + 1) * 3600) - np.maximum(entries[visit], hour * 3600)
+    weekday = (hour // 24 + EPOCH_WEEKDAY) % 7
+    cell = (weekday * 24 + hour % 24).astype(np.int64)
+    return visit, cell, np.clip(seconds, 0, None)
+
+
+def _week_bounds(first, last):
+    start = timezone.make_aware(datetime.combine(first, time.min))
+    return start, timezone.make_aware(datetime.combine(last + timedelta(weeks=1), time.min))
+
+
+def _fold(gym, weeks, mondays):
+    """
+    Add the visits not counted yet to their week's cells, returns the weeks to store again.
+
+    That is every visit above its own week's watermark (all of them for weeks seen for the first
+    time) and the visits that were open last time, read with one query. Every week's watermark
+    then moves up to the newest visit id, read beforehand so rows added meanwhile wait for the
+    next call.
+    """
+    from .models import Visit
+
+    top = Visit.objects.order_by('-id').values_list('id', flat=True).first()
+    if top is None:
+        return set()
+
+    # Neighbouring weeks with the same watermark share one condition
+    condition = Q(id__in=set().union(*(weeks[monday]['open_ids'] for monday in mondays)))
+    run_start = 0
+    for index in range(1, len(mondays) + 1):
+        if index == len(mondays) or weeks[mondays[index]]['last_id'] != weeks[mondays[run_start]]['last_id']:
+            start, end = _week_bounds(mondays[run_start], mondays[index - 1])
+            condition |= Q(entry_time__gte=start, entry_time__lt=end, id__gt=weeks[mondays[run_start]]['last_id'])
+            run_start = index
+
+    start, end = _week_bounds(mondays[0], mondays[-1])
+    rows = list(
+        Visit.objects.for_gym(gym).between(start, end).filter(condition, id__lte=top)
+        .values_list('id', EpochSeconds('entry_time'), EpochSeconds('exit_time'))
+    )
+    changed = {monday for monday in mondays if weeks[monday]['last_id'] != top}
+    for monday in changed:
+        weeks[monday]['last_id'] = top
+    if not rows:
+        return changed
+
+    # Missing exit times come back as NaN
+    ids, entry_utc, exit_utc = (np.array(column, dtype=float) for column in zip(*rows))
+    ids = ids.astype(np.int64)
+    is_open = np.isnan(exit_utc)
+    entries = _local_seconds(entry_utc)
+    # Open visits get their entry as exit, they are not binned until they close
+    exits = _local_seconds(np.where(is_open, entry_utc, exit_utc))
+    # Each visit belongs to the week it started in
+    first_day = (mondays[0] - LOCAL_EPOCH).days
+    week = ((entries // 86400 - first_day) // 7).astype(np.int64)
+
+    for index in np.unique(week).tolist():
+        in_week = week == index
+        state = weeks[mondays[index]]
+        state['open_ids'] = (state['open_ids'] - set(ids[in_week & ~is_open].tolist())) | set(ids[in_week & is_open].tolist())
+        changed.add(mondays[index])
+
+    closed = ~is_open
+    if closed.any():
+        visit, cell, seconds = bin_visits(entries[closed], exits[closed])
+        totals = np.bincount(week[closed][visit] * CELLS + cell, weights=seconds, minlength=len(mondays) * CELLS)
+        for index, week_seconds in enumerate(totals.reshape(len(mondays), CELLS)):
+            if week_seconds.any():
+                weeks[mondays[index]]['seconds'] = weeks[mondays[index]]['seconds'] + week_seconds
+    return changed
+
+
+def gym_heatmap(gym, weeks=DEFAULT_WEEKS):
+    """
+    Average number of members in the gym for each weekday and hour, over the last `weeks` weeks.
+
+    Each week's cells are cached forever with a watermark of the newest visit folded in, so a
+    call only reads the visits added (or closed) since, in one query whichever weeks they
+    belong to. Visits still open are left out until they close. Returns a 7x24 list of
+    lists, Monday first.
+    """
+    if np is None:
+        raise ImproperlyConfigured("The peak-hour heatmap needs NumPy, install it with pip install numpy.")
+
+    this_week = week_start(timezone.localdate())
+    mondays = [this_week - timedelta(weeks=offset) for offset in range(weeks - 1, -1, -1)]
+    keys = {monday: _cache_key(gym.gym_id, monday) for monday in mondays}
+    cached = cache.get_many(list(keys.values()))
+
+    states = {monday: cached.get(keys[monday]) for monday in mondays}
+    missing = [monday for monday in mondays if states[monday] is None]
+    for monday in missing:
+        states[monday] = _empty_week()
+
+    # Only one request folds new visits at a time, the others use the cached weeks as they are
+    lock_key = f"gym-heatmap:{gym.gym_id}:lock"
+    if cache.add(lock_key, True, 60):
+        try:
+            changed = _fold(gym, states, mondays)
+            # Weeks seen for the first time are stored even when empty so they aren't read again
+            cache.set_many({keys[monday]: states[monday] for monday in changed}, None)
+        finally:
+            cache.delete(lock_key)
+
+    total = sum(state['seconds'] for state in states.values())
+    return (total / (3600 * weeks)).reshape(7, 24).round(2).tolist()
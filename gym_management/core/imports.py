@@ -0,0 +1,147 @@
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
+from django.core.validators import validate_email
+from django.db import transaction
+from django.utils.dateparse import parse_date
+from .gym_codes import allocate_gym_codes
+from .metrics import invalidate_gym_metrics
+from .models import Member
+from .quotas import adjust_usage, primary_owner_id, remaining_quota
+import csv
+
+# Columns understood by the member import, only username and contact_number are required
+IMPORT_COLUMNS = ['username', 'email', 'first_name', 'last_name', 'contact_number', 'date_of_birth', 'address', 'active', 'password']
+REQUIRED_COLUMNS = ['username', 'contact_number']
+TRUE_VALUES = {'1', 'true', 'yes', 'y', 'active'}
+
+
+def _clean_row(row, seen_usernames):
+    """Validate one CSV row, returns (cleaned values, None) or (None, error message)."""
+    values = {column: (row.get(column) or '').strip() for column in IMPORT_COLUMNS}
+    missing = [column for column in REQUIRED_COLUMNS if not values[column]]
+    if missing:
+        return None, f"Missing {', '.join(missing)}."
+
+    username = values['username']
+    if len(username) > 150:
+        return None, "Username is longer than 150 characters."
+    if username.lower() in seen_usernames:
+        return None, f"Username '{username}' appears more than once in the file."
+    if len(values['contact_number']) > 15:
+        return None, "Contact number is longer than 15 characters."
+    if values['email']:
+        try:
+            validate_email(values['email'])
+        except ValidationError:
+            return None, f"Invalid email '{values['email']}'."
+    date_of_birth = None
+    if values['date_of_birth']:
+        try:
+            date_of_birth = parse_date(values['date_of_birth'])
+        except ValueError:
+            date_of_birth = None
+        if date_of_birth is None:
+            return None, "Date of birth must use the format YYYY-MM-DD."
+
+    values['date_of_birth'] = date_of_birth
+    values['email'] = values['email'].lower()
+    values['active'] = values['active'].lower() in TRUE_VALUES
+    return values, None
+
+
+class MemberImport:
+    """
+    Streams member rows from a CSV file into a gym, a chunk of rows at a time.
+
+    Each chunk checks the usernames against the database and the owner's member limit once,
+    then creates the users and members with two bulk inserts and one batch of gym codes.
+    """
+
+    def __init__(self, gym, chunk_size=1000):
+        self.gym = gym
+        self.chunk_size = chunk_size
+        self.created = 0
+        self.errors = []  # (row number, message) for every row that was not imported
+        self._seen_usernames = set()
+
+    def run(self, lines):
+        """Import rows from an iterable of CSV text lines with a header row, returns self."""
+        reader = csv.DictReader(lines)
+        missing = [column for column in REQUIRED_COLUMNS if column not in (reader.fieldnames or [])]
+        if missing:
+            self.errors.append((1, f"The header row is missing the column(s): {', '.join(missing)}."))
+            return self
+
+        chunk = []
+        # Row 1 is the header
+        for row_number, row in enumerate(reader, start=2):
+            values, error = _clean_row(row, self._seen_usernames)
+            if error:
+                self.errors.append((row_number, error))
+                continue
+            self._seen_usernames.add(values['username'].lower())
+            chunk.append((row_number, values))
+            if len(chunk) >= self.chunk_size:
+                self._import_chunk(chunk)
+                chunk = []
+        if chunk:
+            self._import_chunk(chunk)
+        return self
+
+    def _import_chunk(self, chunk):
+        existing = set(
+            User.objects.filter(username__in=[values['username'] for _, values in chunk])
+            .values_list('username', flat=True)
+        )
+        rows = []
+        for row_number, values in chunk:
+            if values['username'] in existing:
+                self.errors.append((row_number, f"Username '{values['username']}' is already taken."))
+            else:
+                rows.append((row_number, values))
+
+        # Check the subscription's member limit once for the whole chunk
+        owner_id = primary_owner_id(self.gym.gym_id)
+        slots = remaining_quota(owner_id, 'members') if owner_id else 0
+        for row_number, _ in rows[slots:]:
+            self.errors.append((row_number, "Your subscription's member limit has been reached."))
+        rows = rows[:slots]
+        if not rows:
+            return
+
+        with transaction.atomic():
+            users = User.objects.bulk_create([
+                User(
+                    username=values['username'],
+                    email=values['email'],
+                    first_name=values['first_name'],
+                    last_name=values['last_name'],
+                    # Hashing is the slow part of an import, rows without a password get an unusable one
+                    password=make_password(values['password'] or None),
+                )
+                for _, values in rows
+            ])
+            if any(user.pk is None for user in users):
+                # Backends that can't return ids from a bulk insert
+                user_ids = dict(User.objects.filter(username__in=[user.username for user in users]).values_list('username', 'id'))
+                for user in users:
+                    user.pk = user_ids[user.username]
+
+            codes = allocate_gym_codes(len(rows))
+            Member.objects.bulk_create([
+                Member(
+                    user=user,
+                    gym=self.gym,
+                    contact_number=values['contact_number'],
+                    date_of_birth=values['date_of_birth'],
+                    address=values['address'] or None,
+                    active=values['active'],
+                    gym_code=code,
+                )
+                for user, (_, values), code in zip(users, rows, codes)
+            ])
+            # bulk_create skips the post_save signals, so count the new members here
+            adjust_usage(owner_id, 'members', len(rows))
+            invalidate_gym_metrics(self.gym.gym_id)
+        self.created += len(rows)
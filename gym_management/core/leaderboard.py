@@ -0,0 +1,140 @@
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import Length, TruncDate
+from django.utils import timezone
+from datetime import timedelta
+
+# Every closed visit is counted in three tallies: all time, its month and its day
+ALL_TIME = 'all'
+WINDOWS = ('all', 'month', '30d')
+
+# Day tallies are only needed for the rolling 30 day window
+DAY_TALLY_RETENTION_DAYS = 35
+
+
+def _periods(day):
+    return [ALL_TIME, day.strftime('%Y-%m'), day.isoformat()]
+
+
+def _add_visits(gym_id, member_id, day, count):
+    """Add `count` visits to the member's three tallies with one UPDATE, inserting only the ones missing."""
+    from .models import MemberVisitTally
+
+    periods = _periods(day)
+    tallies = MemberVisitTally.objects.filter(gym_id=gym_id, member_id=member_id)
+    if tallies.filter(period__in=periods).update(visit_count=F('visit_count') + count) == len(periods):
+        return
+    existing = set(tallies.filter(period__in=periods).values_list('period', flat=True))
+    missing = [period for period in periods if period not in existing]
+    try:
+        with transaction.atomic():
+            MemberVisitTally.objects.bulk_create(
+                MemberVisitTally(gym_id=gym_id, member_id=member_id, period=period, visit_count=count)
+                for period in missing
+            )
+    except IntegrityError:
+        # Created by a concurrent visit since the update, add to them instead
+        tallies.filter(period__in=missing).update(visit_count=F('visit_count') + count)
+
+
+def record_visit(visit):
+    """Count one closed visit towards its member's tallies."""
+    if visit.gym_id is None:
+        return
+    with transaction.atomic():
+        _add_visits(visit.gym_id, visit.member_id, timezone.localdate(visit.entry_time), 1)
+
+
+def record_visits(visits):
+    """Count a batch of closed visits (a Visit queryset), grouped per member and day first."""
+    grouped = (
+        visits.filter(gym__isnull=False, exit_time__isnull=False)
+        .annotate(day=TruncDate('entry_time'))
+        .values_list('gym_id', 'member_id', 'day')
+        .annotate(visits=Count('id'))
+        .order_by()
+    )
+    with transaction.atomic():
+        for gym_id, member_id, day, count in grouped:
+            _add_visits(gym_id, member_id, day, count)
+
+
+def top_visitors(gym, window=ALL_TIME, limit=10):
+    """
+    The gym's most frequent visitors for a window: 'all' time, this calendar 'month' or the last '30d'.
+
+    All time and monthly boards are a top-N read of one indexed period, the rolling window sums at
+    most 30 day tallies per member.
+    """
+    from .models import MemberVisitTally
+
+    tallies = MemberVisitTally.objects.filter(gym=gym)
+    today = timezone.localdate()
+    if window == '30d':
+        days = [(today - timedelta(days=offset)).isoformat() for offset in range(30)]
+        rows = (
+            tallies.filter(period__in=days)
+            .values('member__user__username', 'member__gym_code')
+            .annotate(visit_count=Sum('visit_count'))
+            .order_by('-visit_count')
+        )
+    else:
+        period = today.strftime('%Y-%m') if window == 'month' else ALL_TIME
+        rows = (
+            tallies.filter(period=period)
+            .values('member__user__username', 'member__gym_code', 'visit_count')
+            .order_by('-visit_count')
+        )
+    return list(rows[:limit])
+
+
+def prune_day_tallies():
+    """Drop day tallies that have fallen out of the rolling window, returns the number removed."""
+    from .models import MemberVisitTally
+
+    cutoff = (timezone.localdate() - timedelta(days=DAY_TALLY_RETENTION_DAYS)).isoformat()
+    # Day periods are the only 10 character ones and ISO dates sort as strings
+    deleted, _ = (
+        MemberVisitTally.objects.annotate(period_length=Length('period'))
+        .filter(period_length=10, period__lt=cutoff)
+        .delete()
+    )
+    return deleted
+
+
+def rebuild_tallies(gyms=None):
+    """Throw away and recount the visit tallies from the raw visit history."""
+    from .models import MemberVisitTally, Visit
+
+    visits = Visit.objects.all()
+    tallies = MemberVisitTally.objects.all()
+    if gyms is not None:
+        visits = visits.filter(gym__in=gyms)
+        tallies = tallies.filter(gym__in=gyms)
+
+    day_cutoff = timezone.localdate() - timedelta(days=DAY_TALLY_RETENTION_DAYS)
+    counts = {}
+    grouped = (
+        visits.filter(gym__isnull=False, exit_time__isnull=False)
+        .annotate(day=TruncDate('entry_time'))
+        .values_list('gym_id', 'member_id', 'day')
+        .annotate(visits=Count('id'))
+        .order_by()
+    )
+    for gym_id, member_id, day, count in grouped.iterator(chunk_size=2000):
+        for period in _periods(day):
+            if len(period) == 10 and day < day_cutoff:
+                continue
+            key = (gym_id, member_id, period)
+            counts[key] = counts.get(key, 0) + count
+
+    with transaction.atomic():
+        tallies.delete()
+        MemberVisitTally.objects.bulk_create(
+            [
+                MemberVisitTally(gym_id=gym_id, member_id=member_id, period=period, visit_count=count)
+                for (gym_id, member_id, period), count in counts.items()
+            ],
+            batch_size=1000,
+        )
+    return len(counts)
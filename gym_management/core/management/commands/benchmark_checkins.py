@@ -0,0 +1,107 @@
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, close_old_connections, connections
+from core.checkin import CheckInError, toggle_visit
+from core.gym_codes import allocate_gym_codes
+from core.models import Gym, Member
+from gym_management.database import sqlite_database
+from pathlib import Path
+import random
+import shutil
+import tempfile
+import threading
+import time
+
+PROFILES = ('plain', 'tuned')
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure check-in throughput with concurrent scanners on a throwaway SQLite database, "
+        "with Django's plain SQLite settings and with the tuned ones from gym_management.database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=8, help="Scanners checking members in and out at the same time.")
+        parser.add_argument('--scans', type=int, default=100, help="Scans made by each scanner.")
+        parser.add_argument('--members', type=int, default=200, help="Members whose codes are scanned.")
+        parser.add_argument('--profile', choices=PROFILES + ('both',), default='both')
+
+    def handle(self, *args, **options):
+        workdir = Path(tempfile.mkdtemp(prefix='gym-checkin-bench-'))
+        original = connections.settings['default']
+        try:
+            # Migrate once and copy the file for each profile
+            template = workdir / 'template.sqlite3'
+            self._use_database(sqlite_database(template, tuned=False))
+            call_command('migrate', verbosity=0)
+            gym_codes = self._seed(options['members'])
+
+            profiles = PROFILES if options['profile'] == 'both' else (options['profile'],)
+            for profile in profiles:
+                path = workdir / f'{profile}.sqlite3'
+                connections.close_all()
+                shutil.copy(template, path)
+                self._use_database(sqlite_database(path, tuned=profile == 'tuned'))
+                result = self._run(gym_codes, options['threads'], options['scans'])
+                self.stdout.write(
+                    f"{profile:>6}: {result['ok']} check-ins/outs in {result['seconds']:.2f}s "
+                    f"({result['ok'] / result['seconds']:.0f}/s), {result['locked']} 'database is locked' errors, "
+                    f"{result['rejected']} rejected scans"
+                )
+        finally:
+            self._use_database(original)
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    def _use_database(self, database):
+        # Point the default alias at another database, every thread opens its next connection there
+        connections.close_all()
+        connections.settings['default'] = connections.configure_settings({'default': database})['default']
+        try:
+            del connections['default']
+        except AttributeError:
+            pass
+
+    def _seed(self, count):
+        gym = Gym.objects.create(name='Benchmark Gym')
+        users = User.objects.bulk_create(User(username=f'bench-{n}') for n in range(count))
+        members = Member.objects.bulk_create(
+            Member(user=user, gym=gym, contact_number='0', active=True, gym_code=code)
+            for user, code in zip(users, allocate_gym_codes(count))
+        )
+        return [member.gym_code for member in members]
+
+    def _run(self, gym_codes, threads, scans):
+        # Connecting once here applies the journal mode before the scanners start, as a deployed database already has it
+        gym = Gym.objects.get()
+        connections.close_all()
+        counts = {'ok': 0, 'locked': 0, 'rejected': 0}
+        lock = threading.Lock()
+
+        def scanner(seed):
+            rng = random.Random(seed)
+            for _ in range(scans):
+                # Each scan stands in for a request, connections are closed or kept as CONN_MAX_AGE says
+                close_old_connections()
+                try:
+                    toggle_visit(gym, rng.choice(gym_codes))
+                    outcome = 'ok'
+                except CheckInError:
+                    outcome = 'rejected'
+                except OperationalError:
+                    outcome = 'locked'
+                finally:
+                    close_old_connections()
+                with lock:
+                    counts[outcome] += 1
+            connections.close_all()
+
+        workers = [threading.Thread(target=scanner, args=(seed,)) for seed in range(threads)]
+        started = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        counts['seconds'] = time.perf_counter() - started
+        return counts
@@ -0,0 +1,55 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+from core.db_router import analytics_iterator
+from core.exports import stream_visit_export, EXPORT_FORMATS, DEFAULT_CHUNK_SIZE
+from core.models import Gym
+import sys
+
+
+class Command(BaseCommand):
+    help = "Export raw visits as CSV or JSON lines, streamed in chunks so memory use doesn't grow with the history."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--gym', dest='slugs', action='append', help="Slug of a gym to export (repeatable). Defaults to all gyms.")
+        parser.add_argument('--start', help="First day to export (YYYY-MM-DD).")
+        parser.add_argument('--end', help="Last day to export (YYYY-MM-DD), included.")
+        parser.add_argument('--format', choices=EXPORT_FORMATS, default='csv', help="Output format.")
+        parser.add_argument('--gzip', action='store_true', help="Compress the output with gzip.")
+        parser.add_argument('--output', default='-', help="File to write to, '-' for standard output.")
+        parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE, help="Number of visits read from the database at a time.")
+
+    def handle(self, *args, **options):
+        gyms = None
+        if options['slugs']:
+            gyms = list(Gym.objects.filter(slug__in=options['slugs']))
+            missing = set(options['slugs']) - {gym.slug for gym in gyms}
+            if missing:
+                raise CommandError(f"Unknown gym slug(s): {', '.join(sorted(missing))}")
+
+        days = {}
+        for name in ('start', 'end'):
+            days[name] = None
+            if options[name]:
+                try:
+                    days[name] = parse_date(options[name])
+                except ValueError:
+                    pass
+                if days[name] is None:
+                    raise CommandError(f"--{name} must use the format YYYY-MM-DD.")
+
+        blocks = analytics_iterator(stream_visit_export(
+            gyms, options['format'], start=days['start'], end=days['end'],
+            compress=options['gzip'], chunk_size=options['chunk_size'],
+        ))
+        try:
+            output = sys.stdout.buffer if options['output'] == '-' else open(options['output'], 'wb')
+        except OSError as error:
+            raise CommandError(f"Could not write {options['output']}: {error}")
+        try:
+            for block in blocks:
+                output.write(block)
+        finally:
+            if output is not sys.stdout.buffer:
+                output.close()
+        if output is not sys.stdout.buffer:
+            self.stderr.write(self.style.SUCCESS(f"Exported visits to {options['output']}."))
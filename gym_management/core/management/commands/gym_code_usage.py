@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from core.gym_codes import gym_code_usage
+
+
+class Command(BaseCommand):
+    help = "Report how much of the 6 digit gym code space has been allocated."
+
+    def handle(self, *args, **options):
+        usage = gym_code_usage()
+        used_percent = usage['allocated'] / usage['total'] * 100
+        self.stdout.write(
+            f"Allocated {usage['allocated']} of {usage['total']} gym codes ({used_percent:.2f}%), "
+            f"{usage['remaining']} remaining, {usage['held_ahead']} codes further along the sequence are already held by members."
+        )
@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand, CommandError
+from core.imports import MemberImport, IMPORT_COLUMNS
+from core.models import Gym
+import csv
+import time
+
+
+class Command(BaseCommand):
+    help = f"Import members into a gym from a CSV file with the columns: {', '.join(IMPORT_COLUMNS)}."
+
+    def add_arguments(self, parser):
+        parser.add_argument('gym', help="Slug of the gym to import the members into.")
+        parser.add_argument('csv_file', help="Path to the CSV file (UTF-8, with a header row).")
+        parser.add_argument('--chunk-size', type=int, default=1000, help="Number of members created per batch.")
+        parser.add_argument('--errors-file', help="Write the rows that failed to this CSV file instead of the console.")
+
+    def handle(self, *args, **options):
+        gym = Gym.objects.filter(slug=options['gym']).first()
+        if gym is None:
+            raise CommandError(f"Unknown gym slug: {options['gym']}")
+
+        started = time.monotonic()
+        try:
+            with open(options['csv_file'], newline='', encoding='utf-8-sig') as csv_file:
+                result = MemberImport(gym, chunk_size=options['chunk_size']).run(csv_file)
+        except OSError as error:
+            raise CommandError(f"Could not read {options['csv_file']}: {error}")
+
+        if options['errors_file']:
+            with open(options['errors_file'], 'w', newline='') as errors_file:
+                writer = csv.writer(errors_file)
+                writer.writerow(['row', 'error'])
+                writer.writerows(result.errors)
+        else:
+            for row_number, message in result.errors:
+                self.stderr.write(f"Row {row_number}: {message}")
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {result.created} members into {gym.name} in {time.monotonic() - started:.1f}s, "
+            f"{len(result.errors)} row(s) failed."
+        ))
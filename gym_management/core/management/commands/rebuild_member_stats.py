@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand, CommandError
+from core.models import Gym, Member
+from core.member_stats import rebuild_member_stats
+
+
+class Command(BaseCommand):
+    help = "Rebuild the per member visit stats rows (count, session time, last visit, streak) from the raw visit history."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--gym', dest='slugs', action='append', help="Slug of a gym whose members to rebuild (repeatable). Defaults to all members.")
+        parser.add_argument('--batch-size', type=int, default=1000, help="Number of stats rows to insert per batch.")
+
+    def handle(self, *args, **options):
+        members = None
+        if options['slugs']:
+            gyms = list(Gym.objects.filter(slug__in=options['slugs']))
+            missing = set(options['slugs']) - {gym.slug for gym in gyms}
+            if missing:
+                raise CommandError(f"Unknown gym slug(s): {', '.join(sorted(missing))}")
+            members = Member.objects.filter(gym__in=gyms)
+
+        rebuilt = rebuild_member_stats(members=members, batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt visit stats for {rebuilt} members."))
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand, CommandError
+from core.models import Gym
+from core.leaderboard import rebuild_tallies
+from core.rollups import rebuild_daily_stats
+from core.series import invalidate_visit_series
+
+
+class Command(BaseCommand):
+    help = "Rebuild the per gym daily visit rollups and member visit tallies from the raw visit history."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--gym', dest='slugs', action='append', help="Slug of a gym to rebuild (repeatable). Defaults to all gyms.")
+        parser.add_argument('--batch-size', type=int, default=1000, help="Number of rollup rows to insert per batch.")
+
+    def handle(self, *args, **options):
+        gyms = None
+        if options['slugs']:
+            gyms = list(Gym.objects.filter(slug__in=options['slugs']))
+            missing = set(options['slugs']) - {gym.slug for gym in gyms}
+            if missing:
+                raise CommandError(f"Unknown gym slug(s): {', '.join(sorted(missing))}")
+
+        created = rebuild_daily_stats(gyms=gyms, batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {created} daily visit rollup rows."))
+        tallies = rebuild_tallies(gyms=gyms)
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {tallies} member visit tallies."))
+
+        # The cached day and week series buckets were read from the old rollups
+        for gym in gyms if gyms is not None else Gym.objects.all():
+            invalidate_visit_series(gym.gym_id)
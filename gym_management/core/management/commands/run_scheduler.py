@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+from core.scheduler import Scheduler, get_jobs
+import signal
+
+
+class Command(BaseCommand):
+    help = "Run the periodic background jobs (auto exit sweep, ...). Only one instance holds the lease and runs jobs at a time."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lease-ttl', type=int, default=60, help="Seconds before another instance may take over the lease.")
+        parser.add_argument('--once', action='store_true', help="Run every registered job once and exit, without taking the lease.")
+        parser.add_argument('--list', action='store_true', help="List the registered jobs and exit.")
+
+    def handle(self, *args, **options):
+        jobs = get_jobs()
+
+        if options['list']:
+            for job in jobs.values():
+                self.stdout.write(repr(job))
+            return
+
+        scheduler = Scheduler(jobs=jobs, lease_ttl=options['lease_ttl'])
+
+        if options['once']:
+            ran = scheduler.run_pending()
+            self.stdout.write(self.style.SUCCESS(f"Ran {len(ran)} job(s): {', '.join(ran)}"))
+            return
+
+        # Stop cleanly (and hand over the lease) on Ctrl+C or a process manager's SIGTERM
+        signal.signal(signal.SIGTERM, lambda *_: scheduler.stop())
+        signal.signal(signal.SIGINT, lambda *_: scheduler.stop())
+        self.stdout.write(f"Scheduler {scheduler.holder} started with {len(jobs)} job(s).")
+        scheduler.run_forever()
@@ -0,0 +1,92 @@
+from django.db import transaction
+from django.db.models import Count, Max, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+from datetime import timedelta
+
+
+def _advance_streak(stats, day):
+    """Move the member's streak on for a visit on `day`."""
+    if stats.streak_last_day is None or day > stats.streak_last_day + timedelta(days=1):
+        stats.streak_days = 1
+        stats.streak_last_day = day
+    elif day == stats.streak_last_day + timedelta(days=1):
+        stats.streak_days += 1
+        stats.streak_last_day = day
+    # A visit on the last day or synced late for an earlier day leaves the streak as it is
+
+
+def _apply(member_id, visits, session_seconds, last_visit, days):
+    from .models import MemberVisitStats
+
+    # Lock the member's row so two visits closing together don't lose an update
+    MemberVisitStats.objects.get_or_create(member_id=member_id)
+    stats = MemberVisitStats.objects.select_for_update().get(member_id=member_id)
+    stats.visit_count += visits
+    stats.total_session_seconds += session_seconds
+    if stats.last_visit is None or last_visit > stats.last_visit:
+        stats.last_visit = last_visit
+    for day in sorted(days):
+        _advance_streak(stats, day)
+    stats.save()
+
+
+def record_visit(visit):
+    """Fold one closed visit into its member's stats row."""
+    session_seconds = max(int((visit.exit_time - visit.entry_time).total_seconds()), 0)
+    with transaction.atomic():
+        _apply(visit.member_id, 1, session_seconds, visit.entry_time, [timezone.localdate(visit.entry_time)])
+
+
+def record_visits(visits):
+    """Fold a batch of closed visits (a Visit queryset) into the stats rows, one update per member."""
+    from .rollups import session_duration
+
+    closed = visits.filter(exit_time__isnull=False)
+    days = {}
+    for member_id, day in closed.annotate(day=TruncDate('entry_time')).values_list('member_id', 'day').distinct().order_by():
+        days.setdefault(member_id, []).append(day)
+    totals = (
+        closed.values_list('member_id')
+        .annotate(visits=Count('id'), session=Sum(session_duration()), last_visit=Max('entry_time'))
+        .order_by()
+    )
+    with transaction.atomic():
+        for member_id, count, session, last_visit in totals:
+            session_seconds = max(int(session.total_seconds()), 0) if session else 0
+            _apply(member_id, count, session_seconds, last_visit, days.get(member_id, []))
+
+
+def rebuild_member_stats(members=None, batch_size=1000):
+    """Throw away and recount the member stats rows from the raw visit history."""
+    from .models import MemberVisitStats, Visit
+    from .rollups import session_duration
+
+    visits = Visit.objects.filter(exit_time__isnull=False)
+    stats = MemberVisitStats.objects.all()
+    if members is not None:
+        visits = visits.filter(member__in=members)
+        stats = stats.filter(member__in=members)
+
+    rows = {}
+    totals = (
+        visits.values_list('member_id')
+        .annotate(visits=Count('id'), session=Sum(session_duration()), last_visit=Max('entry_time'))
+        .order_by()
+    )
+    for member_id, count, session, last_visit in totals.iterator(chunk_size=batch_size):
+        rows[member_id] = MemberVisitStats(
+            member_id=member_id,
+            visit_count=count,
+            total_session_seconds=max(int(session.total_seconds()), 0) if session else 0,
+            last_visit=last_visit,
+        )
+    # Walk every member's visit days in order to find their latest streak
+    days = visits.annotate(day=TruncDate('entry_time')).values_list('member_id', 'day').distinct().order_by('member_id', 'day')
+    for member_id, day in days.iterator(chunk_size=batch_size):
+        _advance_streak(rows[member_id], day)
+
+    with transaction.atomic():
+        stats.delete()
+        MemberVisitStats.objects.bulk_create(rows.values(), batch_size=batch_size)
+    return len(rows)
@@ -0,0 +1,98 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Q, Sum
+from django.utils import timezone
+from . import leaderboard
+from .rollups import day_bounds
+import time
+
+
+def _version_key(gym_id):
+    return f"gym-metrics-version:{gym_id}"
+
+
+def _new_version():
+    # An integer, so every cache backend can incr it, and new enough that an evicted version
+    # never comes back to an older set of entries
+    return int(time.time() * 1000)
+
+
+def bump_cache_version(key):
+    """Move the version stored under `key` on, so entries keyed with the old one are no longer read."""
+    if cache.add(key, _new_version(), None):
+        return
+    try:
+        cache.incr(key)
+    except ValueError:
+        # Evicted between the add and the incr
+        cache.set(key, _new_version(), None)
+
+
+def invalidate_gym_metrics(gym_id):
+    """Make the next dashboard load for this gym recompute its metrics."""
+    bump_cache_version(_version_key(gym_id))
+
+
+def compute_gym_metrics(gym):
+    """Run the dashboard metric queries for a gym."""
+    from .models import GymDailyVisitStats, Member, Visit
+    from .occupancy import get_occupancy
+
+    member_counts = Member.objects.filter(gym=gym).aggregate(
+        total=Count('id'),
+        active=Count('id', filter=Q(active=True)),
+    )
+
+    # All time visit totals come from the daily rollups rather than the raw visit history
+    visit_totals = GymDailyVisitStats.objects.filter(gym=gym).aggregate(
+        visits=Sum('visit_count'),
+        session_seconds=Sum('total_session_seconds'),
+    )
+    total_visits = visit_totals['visits'] or 0
+    today_start, today_end = day_bounds(timezone.localdate())
+    today_stats = Visit.objects.for_gym(gym).between(today_start, today_end).session_stats()
+
+    top_visitors = leaderboard.top_visitors(gym, 'all')
+    top_visitors_month = leaderboard.top_visitors(gym, 'month')
+
+    recent_visits = list(
+        Visit.objects.filter(gym=gym, exit_time__isnull=False)
+        .select_related('member__user')
+        .order_by('-entry_time')[:10]
+    )
+    for visit in recent_visits:
+        session_duration = visit.exit_time - visit.entry_time
+        visit.session_duration = round(session_duration.total_seconds() / 60, 2)
+
+    occupancy = get_occupancy(gym.gym_id)
+
+    return {
+        'member_count': member_counts['total'],
+        'active_members': member_counts['active'],
+        'inactive_members': member_counts['total'] - member_counts['active'],
+        'total_visits': total_visits,
+        'avg_session_time': round(visit_totals['session_seconds'] / total_visits / 60, 2) if total_visits else 0,
+        'today_visits': today_stats['entries'],
+        'top_visitors': top_visitors,
+        'top_visitors_month': top_visitors_month,
+        'recent_visits': recent_visits,
+        'current_occupancy': occupancy['current_occupancy'],
+        'max_capacity': occupancy['max_capacity'],
+    }
+
+
+def get_gym_metrics(gym):
+    """
+    Dashboard metrics for a gym, served from the cache until a write touches the gym.
+
+    Entries are keyed by a per gym version that check-ins, member changes and the bulk visit
+    paths bump (see invalidate_gym_metrics), plus the date so "today" rolls over at midnight.
+    GYM_METRICS_CACHE_TTL caps how stale they can get from changes nothing reports.
+    """
+    version = cache.get(_version_key(gym.gym_id), 0)
+    key = f"gym-metrics:{gym.gym_id}:{version}:{timezone.localdate().isoformat()}"
+    metrics = cache.get(key)
+    if metrics is None:
+        metrics = compute_gym_metrics(gym)
+        cache.set(key, metrics, getattr(settings, 'GYM_METRICS_CACHE_TTL', 60))
+    return metrics
@@ -0,0 +1,51 @@
+from django.conf import settings
+from django.utils.functional import SimpleLazyObject
+from . import db_router
+from .profiles import get_session_profile, load_profile
+
+
+class GymProfileMiddleware:
+    """
+    Sets request.gym_role ('owner', 'member' or None) and request.profile_id from the session,
+    and request.profile, the user's GymOwner or Member row, loaded by primary key the first
+    time it is used.
+
+    request.gym_role and request.profile_id can still change when request.profile is loaded, if
+    the user's gym roles moved on (see core.profiles.load_profile), so check the profile first.
+
+    Must come after AuthenticationMiddleware.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        role, profile_id = get_session_profile(request)
+        request.gym_role = role
+        request.profile_id = profile_id
+        request.profile = SimpleLazyObject(lambda: load_profile(request, role, profile_id))
+        return self.get_response(request)
+
+
+class ReplicaPinningMiddleware:
+    """
+    Starts every request unpinned and outside analytics_reads, unless the browser wrote during the
+    last REPLICA_PIN_SECONDS (replicas lag behind). A request that writes sets that cookie again.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        analytics_token = db_router._analytics.set(False)
+        pinned_token = db_router._pinned.set(db_router.PIN_COOKIE in request.COOKIES)
+        wrote_token = db_router._wrote.set(False)
+        try:
+            response = self.get_response(request)
+            if db_router.has_written() and db_router.replica_configured():
+                response.set_cookie(db_router.PIN_COOKIE, '1', max_age=getattr(settings, 'REPLICA_PIN_SECONDS', 5), httponly=True, samesite='Lax')
+            return response
+        finally:
+            db_router._wrote.reset(wrote_token)
+            db_router._pinned.reset(pinned_token)
+            db_router._analytics.reset(analytics_token)
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:04
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0017_remove_subscriptiontier_max_members_per_gym'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GymDailyVisitStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('visit_count', models.PositiveIntegerField(default=0)),
+                ('total_session_seconds', models.PositiveBigIntegerField(default=0)),
+                ('unique_members', models.PositiveIntegerField(default=0)),
+                ('gym', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_visit_stats', to='core.gym')),
+            ],
+            options={
+                'unique_together': {('gym', 'date')},
+            },
+        ),
+    ]
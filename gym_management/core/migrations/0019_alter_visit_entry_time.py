@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0018_gymdailyvisitstats'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='visit',
+            name='entry_time',
+            field=models.DateTimeField(auto_now_add=True, db_index=True),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:06
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0020_schedulerlease'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='visit',
+            name='gym',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='visits', to='core.gym'),
+        ),
+        migrations.AddIndex(
+            model_name='visit',
+            index=models.Index(fields=['gym', 'entry_time'], name='core_visit_gym_id_658c78_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='visit',
+            index=models.Index(fields=['gym', 'exit_time'], name='core_visit_gym_id_bd65f0_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='visit',
+            index=models.Index(fields=['member', 'exit_time'], name='core_visit_member__1213b4_idx'),
+        ),
+    ]
@@ -0,0 +1,36 @@
+from django.db import migrations
+from django.db.models import OuterRef, Subquery
+
+BATCH_SIZE = 5000
+
+
+def backfill_visit_gym(apps, schema_editor):
+    """Copy member.gym onto existing visits, a bounded id range at a time."""
+    Visit = apps.get_model("core", "Visit")
+    Member = apps.get_model("core", "Member")
+
+    member_gym = Member.objects.filter(pk=OuterRef("member_id")).values("gym_id")[:1]
+    last_id = 0
+    while True:
+        batch_ids = list(
+            Visit.objects.filter(id__gt=last_id, gym__isnull=True)
+            .order_by("id")
+            .values_list("id", flat=True)[:BATCH_SIZE]
+        )
+        if not batch_ids:
+            break
+        Visit.objects.filter(id__in=batch_ids).update(gym_id=Subquery(member_gym))
+        last_id = batch_ids[-1]
+
+
+class Migration(migrations.Migration):
+    # Each batch commits on its own so the backfill never holds one huge write lock
+    atomic = False
+
+    dependencies = [
+        ("core", "0021_visit_gym"),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_visit_gym, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:07
+
+from datetime import timedelta
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def close_duplicate_open_visits(apps, schema_editor):
+    """Keep only the latest open visit per member so the new constraint can be created."""
+    Visit = apps.get_model("core", "Visit")
+    duplicated_members = (
+        Visit.objects.filter(exit_time__isnull=True)
+        .values("member_id")
+        .annotate(open_visits=Count("id"))
+        .filter(open_visits__gt=1)
+        .values_list("member_id", flat=True)
+    )
+    for member_id in duplicated_members:
+        stale_visits = Visit.objects.filter(member_id=member_id, exit_time__isnull=True).order_by("-entry_time")[1:]
+        for visit in stale_visits:
+            # Same default as the auto exit sweep (Visit.default_exit_duration)
+            visit.exit_time = visit.entry_time + timedelta(hours=1, minutes=12)
+            visit.has_exit = True
+            visit.save(update_fields=["exit_time", "has_exit"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0022_backfill_visit_gym'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='gym',
+            name='kiosk_token',
+            field=models.CharField(blank=True, max_length=64, null=True, unique=True),
+        ),
+        migrations.RunPython(close_duplicate_open_visits, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='visit',
+            constraint=models.UniqueConstraint(condition=models.Q(('exit_time__isnull', True)), fields=('member',), name='one_open_visit_per_member'),
+        ),
+    ]
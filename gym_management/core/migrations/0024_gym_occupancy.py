@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:08
+
+from django.db import migrations, models
+from django.db.models import Count, Q
+
+
+def seed_occupancy(apps, schema_editor):
+    """Start every gym's counter from its currently open visits."""
+    Gym = apps.get_model("core", "Gym")
+    open_visits = Gym.objects.annotate(open_visits=Count("visits", filter=Q(visits__exit_time__isnull=True)))
+    for gym_id, count in open_visits.filter(open_visits__gt=0).values_list("gym_id", "open_visits"):
+        Gym.objects.filter(gym_id=gym_id).update(current_occupancy=count)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0023_gym_kiosk_token_one_open_visit'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='gym',
+            name='current_occupancy',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='gym',
+            name='max_capacity',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.RunPython(seed_occupancy, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:09
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0024_gym_occupancy'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='visit',
+            name='entry_time',
+            field=models.DateTimeField(db_index=True, default=django.utils.timezone.now),
+        ),
+        migrations.CreateModel(
+            name='KioskEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('client_event_id', models.CharField(max_length=64)),
+                ('gym_code', models.CharField(max_length=6)),
+                ('action', models.CharField(choices=[('enter', 'Enter'), ('exit', 'Exit')], max_length=10)),
+                ('occurred_at', models.DateTimeField()),
+                ('result', models.CharField(max_length=20)),
+                ('processed_at', models.DateTimeField(auto_now_add=True)),
+                ('gym', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='kiosk_events', to='core.gym')),
+            ],
+            options={
+                'unique_together': {('gym', 'client_event_id')},
+            },
+        ),
+    ]
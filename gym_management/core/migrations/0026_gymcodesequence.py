@@ -0,0 +1,21 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0025_kioskevent_visit_entry_time_default'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GymCodeSequence',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('next_index', models.PositiveIntegerField(default=0)),
+                ('seed', models.CharField(max_length=64)),
+            ],
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:14
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0027_ownerusage'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MemberVisitTally',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.CharField(max_length=10)),
+                ('visit_count', models.PositiveIntegerField(default=0)),
+                ('gym', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='visit_tallies', to='core.gym')),
+                ('member', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='visit_tallies', to='core.member')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['gym', 'period', '-visit_count'], name='core_member_gym_id_c6a929_idx')],
+                'unique_together': {('gym', 'member', 'period')},
+            },
+        ),
+    ]
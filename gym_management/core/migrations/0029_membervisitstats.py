@@ -0,0 +1,26 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:21
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0028_membervisittally'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MemberVisitStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('visit_count', models.PositiveIntegerField(default=0)),
+                ('total_session_seconds', models.PositiveBigIntegerField(default=0)),
+                ('last_visit', models.DateTimeField(blank=True, null=True)),
+                ('streak_last_day', models.DateField(blank=True, null=True)),
+                ('streak_days', models.PositiveIntegerField(default=0)),
+                ('member', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='visit_stats', to='core.member')),
+            ],
+        ),
+    ]
@@ -0,0 +1,51 @@
+from django.db import migrations
+from django.db.models import Count, DurationField, ExpressionWrapper, F, Sum
+from django.db.models.functions import TruncDate
+
+BATCH_SIZE = 1000
+
+
+def backfill_daily_stats(apps, schema_editor):
+    """Count the visits closed before the rollups existed, the dashboards only read the rollups."""
+    GymDailyVisitStats = apps.get_model("core", "GymDailyVisitStats")
+    Visit = apps.get_model("core", "Visit")
+
+    # Rows already there mean the rollups are being kept (or rebuild_visit_rollups has run)
+    if GymDailyVisitStats.objects.exists():
+        return
+    rows = (
+        Visit.objects.filter(exit_time__isnull=False, gym__isnull=False)
+        .annotate(day=TruncDate("entry_time"))
+        .values("gym_id", "day")
+        .annotate(
+            visit_count=Count("id"),
+            total_session=Sum(ExpressionWrapper(F("exit_time") - F("entry_time"), output_field=DurationField())),
+            unique_members=Count("member", distinct=True),
+        )
+        .order_by()
+    )
+    batch = []
+    for row in rows.iterator(chunk_size=BATCH_SIZE):
+        total_session = row["total_session"]
+        batch.append(GymDailyVisitStats(
+            gym_id=row["gym_id"],
+            date=row["day"],
+            visit_count=row["visit_count"],
+            total_session_seconds=max(int(total_session.total_seconds()), 0) if total_session else 0,
+            unique_members=row["unique_members"],
+        ))
+        if len(batch) >= BATCH_SIZE:
+            GymDailyVisitStats.objects.bulk_create(batch)
+            batch = []
+    GymDailyVisitStats.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0030_gymrolesversion"),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_daily_stats, migrations.RunPython.noop),
+    ]
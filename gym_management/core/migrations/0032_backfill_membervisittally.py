@@ -0,0 +1,54 @@
+from datetime import timedelta
+from django.db import migrations
+from django.db.models import Count
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+BATCH_SIZE = 1000
+# Same as core.leaderboard.DAY_TALLY_RETENTION_DAYS
+DAY_TALLY_RETENTION_DAYS = 35
+
+
+def backfill_tallies(apps, schema_editor):
+    """Count the visits closed before the tallies existed towards the top visitors boards."""
+    MemberVisitTally = apps.get_model("core", "MemberVisitTally")
+    Visit = apps.get_model("core", "Visit")
+
+    if MemberVisitTally.objects.exists():
+        return
+    day_cutoff = timezone.localdate() - timedelta(days=DAY_TALLY_RETENTION_DAYS)
+    counts = {}
+    grouped = (
+        Visit.objects.filter(exit_time__isnull=False, gym__isnull=False)
+        .annotate(day=TruncDate("entry_time"))
+        .values_list("gym_id", "member_id", "day")
+        .annotate(visits=Count("id"))
+        .order_by()
+    )
+    for gym_id, member_id, day, count in grouped.iterator(chunk_size=BATCH_SIZE):
+        # All time, the month and, for recent days, the day itself
+        periods = ["all", day.strftime("%Y-%m")]
+        if day >= day_cutoff:
+            periods.append(day.isoformat())
+        for period in periods:
+            key = (gym_id, member_id, period)
+            counts[key] = counts.get(key, 0) + count
+
+    MemberVisitTally.objects.bulk_create(
+        [
+            MemberVisitTally(gym_id=gym_id, member_id=member_id, period=period, visit_count=count)
+            for (gym_id, member_id, period), count in counts.items()
+        ],
+        batch_size=BATCH_SIZE,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0031_backfill_gymdailyvisitstats"),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_tallies, migrations.RunPython.noop),
+    ]
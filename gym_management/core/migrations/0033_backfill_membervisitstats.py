@@ -0,0 +1,56 @@
+from datetime import timedelta
+from django.db import migrations
+from django.db.models import Count, DurationField, ExpressionWrapper, F, Max, Sum
+from django.db.models.functions import TruncDate
+
+BATCH_SIZE = 1000
+
+
+def backfill_member_stats(apps, schema_editor):
+    """Fill the member stats rows from the visits closed before they existed."""
+    MemberVisitStats = apps.get_model("core", "MemberVisitStats")
+    Visit = apps.get_model("core", "Visit")
+
+    if MemberVisitStats.objects.exists():
+        return
+    visits = Visit.objects.filter(exit_time__isnull=False)
+    rows = {}
+    totals = (
+        visits.values_list("member_id")
+        .annotate(
+            visits=Count("id"),
+            session=Sum(ExpressionWrapper(F("exit_time") - F("entry_time"), output_field=DurationField())),
+            last_visit=Max("entry_time"),
+        )
+        .order_by()
+    )
+    for member_id, count, session, last_visit in totals.iterator(chunk_size=BATCH_SIZE):
+        rows[member_id] = MemberVisitStats(
+            member_id=member_id,
+            visit_count=count,
+            total_session_seconds=max(int(session.total_seconds()), 0) if session else 0,
+            last_visit=last_visit,
+        )
+
+    # The latest run of consecutive visit days, as core.member_stats keeps it
+    days = visits.annotate(day=TruncDate("entry_time")).values_list("member_id", "day").distinct().order_by("member_id", "day")
+    for member_id, day in days.iterator(chunk_size=BATCH_SIZE):
+        stats = rows[member_id]
+        if stats.streak_last_day is not None and day == stats.streak_last_day + timedelta(days=1):
+            stats.streak_days += 1
+        else:
+            stats.streak_days = 1
+        stats.streak_last_day = day
+
+    MemberVisitStats.objects.bulk_create(rows.values(), batch_size=BATCH_SIZE)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0032_backfill_membervisittally"),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_member_stats, migrations.RunPython.noop),
+    ]
@@ -1,12 +1,19 @@
 from django.contrib.auth.models import User
 from django.db import models
+from django.db.models import Avg, Count, Max, Min, Q
 from datetime import timedelta
 from django.utils import timezone
-import random as rd
+import secrets
 from django.utils.text import slugify
 from django.utils.timezone import now
 from django.contrib.auth.forms import PasswordChangeForm
 from django.core.exceptions import ValidationError
+from .gym_codes import allocate_gym_codes
+from .metrics import invalidate_gym_metrics
+from .occupancy import leave
+from .quotas import check_quota, get_usage, primary_owner_id
+from .rollups import record_closed_visit, session_duration
+from .series import invalidate_visit_series
 
 
 class SubscriptionTier(models.Model):
@@ -34,25 +41,28 @@ class GymOwner(models.Model):
     subscription_tier = models.ForeignKey(SubscriptionTier, on_delete=models.SET_NULL, null=True)
     subscription_start_date = models.DateTimeField(null=True, blank=True)
 
-    def get_usage_and_limit(self, resource: str) -> dict:
+    def get_limit(self, resource: str) -> int:
         if not self.subscription_tier:
-            return {'current_usage': 0, 'max_limit': 0}  # No subscription means no access
-    
+            return 0  # No subscription means no access
+
         # Subscription-wide limits
         limits = {
             'gyms': self.subscription_tier.max_gyms,
             'members': self.subscription_tier.max_members,
+            'products': self.subscription_tier.max_regular_products,
         }
+        return limits.get(resource, 0)
+
+    def get_usage_and_limit(self, resource: str) -> dict:
+        if not self.subscription_tier:
+            return {'current_usage': 0, 'max_limit': 0}  # No subscription means no access
     
-        # Current usage
-        usage = {
-            'gyms': self.gyms.filter(ownerships__role='primary').count(),  # Count only primary gyms
-            'members': sum(gym.members.count() for gym in self.gyms.filter(ownerships__role='primary')),  # Count members in primary gyms only
-        }
+        # Current usage, maintained by core.quotas for primary gyms only
+        usage = get_usage(self)
     
         return {
-            'current_usage': usage.get(resource, 0),
-            'max_limit': limits.get(resource, 0)
+            'current_usage': getattr(usage, resource, 0),
+            'max_limit': self.get_limit(resource)
         }
 
 
@@ -60,6 +70,18 @@ class GymOwner(models.Model):
         return self.user.username
 
 
+# Running totals of what a GymOwner uses across their primary gyms, checked against their SubscriptionTier
+class OwnerUsage(models.Model):
+    owner = models.OneToOneField(GymOwner, on_delete=models.CASCADE, related_name='usage')
+    gyms = models.PositiveIntegerField(default=0)
+    members = models.PositiveIntegerField(default=0)
+    products = models.PositiveIntegerField(default=0)
+    reconciled_at = models.DateTimeField(null=True, blank=True)  # Last full recount
+
+    def __str__(self):
+        return f"{self.owner} usage: {self.gyms} gyms, {self.members} members, {self.products} products"
+
+
 # Intermediate model to link Gym and GymOwner with roles
 class GymOwnership(models.Model):
     GYM_ROLE_CHOICES = [
@@ -97,6 +119,16 @@ class GymOwnership(models.Model):
 
     def __str__(self):
         return f"{self.owner} - {self.gym} ({self.role})"
+
+
+# Bumped in the database whenever a user's gym ownerships change, so sessions in every process
+# holding an older copy of their gym roles reload them (see core.access)
+class GymRolesVersion(models.Model):
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='gym_roles_version')
+    version = models.PositiveBigIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.user} gym roles v{self.version}"
     
     
 
@@ -112,6 +144,13 @@ class Gym(models.Model):
     contact_number = models.CharField(max_length=15, null=True)
     email = models.EmailField(max_length=255, blank=True, null=True)
     email_domain = models.EmailField(blank=True, null=True) # Custom Email Domain to be added
+
+    # Live count of members checked in, kept up to date by check-in/out and the auto exit sweep
+    current_occupancy = models.PositiveIntegerField(default=0)
+    max_capacity = models.PositiveIntegerField(null=True, blank=True)  # No cap when empty
+
+    # Secret the front desk kiosk sends with every scan to the JSON check-in API
+    kiosk_token = models.CharField(max_length=64, unique=True, null=True, blank=True)
     
     # Link to the GymOwner who owns this gym
     # A GymOwner can own multiple gyms (one-to-many relationship)
@@ -127,6 +166,12 @@ class Gym(models.Model):
         # Display the name of the gym
         return self.name
     
+    def rotate_kiosk_token(self):
+        # Issue a new kiosk token, the old one stops working straight away
+        self.kiosk_token = secrets.token_urlsafe(32)
+        self.save(update_fields=['kiosk_token'])
+        return self.kiosk_token
+
     def get_primary_owner(self):
         # Return the primary owner of the gym
         return self.ownerships.filter(role='primary').first()
@@ -156,7 +201,17 @@ class Member(models.Model):
 
     # Unique Gym Code for Sign in
     gym_code = models.CharField(max_length=6, unique=True, blank=True)
+
+    def clean(self):
+        # New members count towards the gym's primary owner's member limit
+        if self._state.adding and self.gym_id:
+            owner_id = primary_owner_id(self.gym_id)
+            if owner_id and not check_quota(owner_id, 'members'):
+                raise ValidationError("This gym has reached its subscription's member limit.")
+
     def save(self, *args, **kwargs):
+        # Enforce the member limit for every new member, not only the ones added through forms
+        self.clean()
         # Check if code exists
         if not self.gym_code:
             self.gym_code = self.generate_unique_gym_code()
@@ -164,11 +219,8 @@ class Member(models.Model):
 
     @staticmethod
     def generate_unique_gym_code():
-        # Function to create code
-        while True:
-            code = f"{rd.randint(100000, 999999)}"
-            if not Member.objects.filter(gym_code=code).exists():
-                return code
+        # Take the next code from the shared gym code sequence
+        return allocate_gym_codes(1)[0]
 
     def __str__(self):
         # Display the username of the member
@@ -179,16 +231,100 @@ class Member(models.Model):
 
 
 
+# Position in the shuffled gym code sequence (see core.gym_codes), a single row
+class GymCodeSequence(models.Model):
+    next_index = models.PositiveIntegerField(default=0)  # Number of codes handed out so far
+    seed = models.CharField(max_length=64)  # Key for the shuffle, generated once
+
+    def __str__(self):
+        return f"Gym code sequence at {self.next_index}"
+
+
+# Database side filters and aggregates for visits so stats never load rows into Python
+class VisitQuerySet(models.QuerySet):
+    def completed(self):
+        return self.filter(exit_time__isnull=False)
+
+    def for_member(self, member):
+        return self.filter(member=member)
+
+    def for_gym(self, gym):
+        return self.filter(gym=gym)
+
+    def between(self, start=None, end=None):
+        """Visits entered in the [start, end) window, either bound is optional."""
+        visits = self
+        if start is not None:
+            visits = visits.filter(entry_time__gte=start)
+        if end is not None:
+            visits = visits.filter(entry_time__lt=end)
+        return visits
+
+    def session_stats(self, with_median=False):
+        """
+        Count, average, min, max session duration and last visit in a single aggregate query.
+
+        'entries' counts every visit including ones still open, 'visits' only completed ones.
+        Durations are timedeltas (None when there are no completed visits). The median needs
+        an ordered lookup of the middle row, so it costs one extra query and is opt in.
+        """
+        completed = Q(exit_time__isnull=False)
+        stats = self.aggregate(
+            entries=Count('id'),
+            visits=Count('id', filter=completed),
+            average_session=Avg(session_duration(), filter=completed),
+            min_session=Min(session_duration(), filter=completed),
+            max_session=Max(session_duration(), filter=completed),
+            last_visit=Max('entry_time'),
+        )
+        if with_median:
+            stats['median_session'] = self._median_session(stats['visits'])
+        return stats
+
+    def _median_session(self, count):
+        if not count:
+            return None
+        middle = (
+            self.completed()
+            .annotate(duration=session_duration())
+            .order_by('duration')
+            .values_list('duration', flat=True)[(count - 1) // 2:count // 2 + 1]
+        )
+        durations = list(middle)
+        return sum(durations, timedelta(0)) / len(durations)
+
+
 # Model to represent visiting database
 class Visit(models.Model):
     member = models.ForeignKey(Member, on_delete=models.CASCADE, related_name='visits')
+    # Copy of member.gym at check-in so gym level queries don't have to join through Member
+    gym = models.ForeignKey(Gym, on_delete=models.SET_NULL, related_name='visits', null=True, blank=True)
     gym_code = models.CharField(max_length=6) # Users gym code
-    entry_time = models.DateTimeField(auto_now_add=True) # Automatically set when the visit is created
+    entry_time = models.DateTimeField(default=timezone.now, db_index=True) # Set when the visit is created, or to the scan time for synced kiosk events
     exit_time = models.DateTimeField(null=True, blank=True)
 
     # A flag to check if a user has entered code for exit
     has_exit = models.BooleanField(default=False)
 
+    objects = VisitQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            # A member can only be checked in once at a time
+            models.UniqueConstraint(fields=['member'], condition=Q(exit_time__isnull=True), name='one_open_visit_per_member'),
+        ]
+        indexes = [
+            models.Index(fields=['gym', 'entry_time']),
+            models.Index(fields=['gym', 'exit_time']),
+            models.Index(fields=['member', 'exit_time']),
+        ]
+
+    def save(self, *args, **kwargs):
+        # Record the gym the visit happened at if the caller didn't
+        if self.gym_id is None and self.member_id is not None:
+            self.gym_id = self.member.gym_id
+        super().save(*args, **kwargs)
+
     # Default average visit duration (1.2 hours)
     default_exit_duration = timedelta(hours=1, minutes=12)
 
@@ -200,56 +336,73 @@ class Visit(models.Model):
         if not self.exit_time and not self.has_exit:
             elapsed_time = now() - self.entry_time
             if elapsed_time > self.default_exit_threshold:
-                self.exit_time = self.entry_time + self.default_exit_duration
-                self.has_exit = True
-                self.save()
+                self.close(exit_time=self.entry_time + self.default_exit_duration)
+
+    def close(self, exit_time=None):
+        """
+        Log the exit for this visit, fold it into the gym's daily rollup and free up its place.
+
+        Only closes the visit if it is still open in the database, so a sweep or scan closing it
+        at the same time can't count it twice. Returns whether this call closed it.
+        """
+        exit_time = exit_time or now()
+        if not Visit.objects.filter(pk=self.pk, exit_time__isnull=True).update(exit_time=exit_time, has_exit=True):
+            # Already closed elsewhere, pick up the exit it was given
+            self.refresh_from_db(fields=['exit_time', 'has_exit'])
+            return False
+        self.exit_time = exit_time
+        self.has_exit = True
+        record_closed_visit(self)
+        if self.gym_id:
+            leave(self.gym_id)
+            # A queryset update sends no post_save, so the dashboard metrics are retired here
+            invalidate_gym_metrics(self.gym_id)
+            invalidate_visit_series(self.gym_id, [self.entry_time])
+        return True
 
     @classmethod
     def get_number_of_visits(cls, member):
         """Calculate the number of visits a member has made (completed visits)."""
-        return cls.objects.filter(member=member, exit_time__isnull=False).count()
+        return cls.objects.for_member(member).completed().count()
     
     @classmethod
     def get_average_session_time(cls, member):
         """Calculate the average session time for a member."""
-        visits = cls.objects.filter(member=member, exit_time__isnull=False)
-        total_session_time = timedelta(seconds=0)
-        valid_visits_count = 0
-
-        for visit in visits:
-            exit_time = visit.exit_time or (visit.entry_time + visit.default_exit_duration)
-            total_session_time += (exit_time - visit.entry_time)
-            valid_visits_count += 1
-
-        if valid_visits_count > 0:
-            # Calculate average session time (in minutes)
-            average_session_time = total_session_time / valid_visits_count
-            return round((average_session_time.total_seconds() / 60))  # Convert to minutes
+        average_session = cls.objects.for_member(member).session_stats()['average_session']
+        if average_session:
+            return round(average_session.total_seconds() / 60)  # Convert to minutes
         return 0  # No visits, return 0 minute
     
 
     @classmethod
     def get_number_of_visits_per_gym(cls, gym):
-        """Calculate the number of visits a member has made (completed visits)."""
-        return cls.objects.filter(member__gym=gym, exit_time__isnull=False).count()
+        """Calculate the number of visits made at a gym (completed visits)."""
+        return cls.objects.for_gym(gym).completed().count()
     
     @classmethod
     def get_average_session_time_per_gym(cls, gym):
-        """Calculate the average session time for a member."""
-        visits = cls.objects.filter(member__gym=gym, exit_time__isnull=False)
-        total_session_time = timedelta(seconds=0)
-        valid_visits_count = 0
+        """Calculate the average session time for a gym."""
+        average_session = cls.objects.for_gym(gym).session_stats()['average_session']
+        if average_session:
+            return round((average_session.total_seconds() / 60), 2)  # Convert to minutes
+        return 0  # No visits, return 0 minute
 
-        for visit in visits:
-            exit_time = visit.exit_time or (visit.entry_time + visit.default_exit_duration)
-            total_session_time += (exit_time - visit.entry_time)
-            valid_visits_count += 1
 
-        if valid_visits_count > 0:
-            # Calculate average session time (in minutes)
-            average_session_time = total_session_time / valid_visits_count
-            return round((average_session_time.total_seconds() / 60),2)  # Convert to minutes
-        return 0  # No visits, return 0 minute]
+
+
+# Daily rollup of completed visits per gym so dashboards don't scan the whole Visit table
+class GymDailyVisitStats(models.Model):
+    gym = models.ForeignKey(Gym, on_delete=models.CASCADE, related_name='daily_visit_stats')
+    date = models.DateField()  # Day the visits were entered on
+    visit_count = models.PositiveIntegerField(default=0)  # Completed visits
+    total_session_seconds = models.PositiveBigIntegerField(default=0)
+    unique_members = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ('gym', 'date')  # One rollup row per gym per day
+
+    def __str__(self):
+        return f"{self.gym} - {self.date} ({self.visit_count} visits)"
 
 
 
@@ -265,6 +418,18 @@ class Product(models.Model):
     active = models.BooleanField(default=True)  # Indicates whether the product is available
     created_at = models.DateTimeField(auto_now_add=True)
 
+    def clean(self):
+        # New products count towards the gym's primary owner's product limit
+        if self._state.adding and self.gym_id:
+            owner_id = primary_owner_id(self.gym_id)
+            if owner_id and not check_quota(owner_id, 'products'):
+                raise ValidationError("This gym has reached its subscription's product limit.")
+
+    def save(self, *args, **kwargs):
+        # Enforce the product limit for every new product, not only the ones added through forms
+        self.clean()
+        super().save(*args, **kwargs)
+
     def __str__(self):
         return f"{self.name} ({self.gym.name})"
 
@@ -326,4 +491,79 @@ class VerificationToken(models.Model):
     token = models.CharField(max_length=8, unique=True)
     gym = models.ForeignKey(Gym, on_delete=models.CASCADE)
     expires_at = models.DateTimeField()
-    is_used = models.BooleanField(default=False)
\ No newline at end of file
+    is_used = models.BooleanField(default=False)
+
+
+
+# Number of completed visits per member for a period: 'all' time, a month 'YYYY-MM' or a day 'YYYY-MM-DD'
+class MemberVisitTally(models.Model):
+    gym = models.ForeignKey(Gym, on_delete=models.CASCADE, related_name='visit_tallies')
+    member = models.ForeignKey(Member, on_delete=models.CASCADE, related_name='visit_tallies')
+    period = models.CharField(max_length=10)
+    visit_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ('gym', 'member', 'period')
+        indexes = [
+            # Top-N leaderboard reads for one gym and period
+            models.Index(fields=['gym', 'period', '-visit_count']),
+        ]
+
+    def __str__(self):
+        return f"{self.member} - {self.period}: {self.visit_count}"
+
+
+# Running visit stats for one member, kept up to date as their visits close (see core.member_stats)
+class MemberVisitStats(models.Model):
+    member = models.OneToOneField(Member, on_delete=models.CASCADE, related_name='visit_stats')
+    visit_count = models.PositiveIntegerField(default=0)  # Completed visits
+    total_session_seconds = models.PositiveBigIntegerField(default=0)
+    last_visit = models.DateTimeField(null=True, blank=True)  # Entry time of the latest completed visit
+    streak_last_day = models.DateField(null=True, blank=True)  # Last day of the current run of consecutive visit days
+    streak_days = models.PositiveIntegerField(default=0)
+
+    @property
+    def average_session_seconds(self):
+        return self.total_session_seconds / self.visit_count if self.visit_count else 0
+
+    def current_streak(self, today=None):
+        """Consecutive days visited up to today, a streak survives until the end of the day after the last visit."""
+        today = today or timezone.localdate()
+        if self.streak_last_day is None or (today - self.streak_last_day).days > 1:
+            return 0
+        return self.streak_days
+
+    def __str__(self):
+        return f"{self.member} - {self.visit_count} visits"
+
+
+# Lease row used to elect a single scheduler instance (see core.scheduler)
+class SchedulerLease(models.Model):
+    name = models.CharField(max_length=100, unique=True)
+    holder = models.CharField(max_length=255)  # host:pid of the scheduler holding the lease
+    expires_at = models.DateTimeField()
+
+    def __str__(self):
+        return f"{self.name} held by {self.holder} until {self.expires_at}"
+
+
+
+# Events synced in batches from offline capable kiosks, kept so a resent batch is applied only once
+class KioskEvent(models.Model):
+    ACTION_CHOICES = [
+        ('enter', 'Enter'),
+        ('exit', 'Exit'),
+    ]
+    gym = models.ForeignKey(Gym, on_delete=models.CASCADE, related_name='kiosk_events')
+    client_event_id = models.CharField(max_length=64)  # ID generated on the kiosk
+    gym_code = models.CharField(max_length=6)
+    action = models.CharField(max_length=10, choices=ACTION_CHOICES)
+    occurred_at = models.DateTimeField()  # When the code was scanned on the kiosk
+    result = models.CharField(max_length=20)  # Outcome returned to the kiosk
+    processed_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ('gym', 'client_event_id')
+
+    def __str__(self):
+        return f"{self.gym} - {self.client_event_id} ({self.action}: {self.result})"
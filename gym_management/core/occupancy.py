@@ -0,0 +1,60 @@
+from django.db.models import Count, F, Q
+from django.db.models.functions import Greatest
+from .metrics import invalidate_gym_metrics
+
+
+def try_enter(gym_id):
+    """Add one person to the gym's occupancy, returns False if it is already at capacity."""
+    from .models import Gym
+
+    return Gym.objects.filter(
+        Q(max_capacity__isnull=True) | Q(current_occupancy__lt=F('max_capacity')),
+        gym_id=gym_id,
+    ).update(current_occupancy=F('current_occupancy') + 1) > 0
+
+
+def leave(gym_id, count=1):
+    """Remove people from the gym's occupancy, never going below zero."""
+    from .models import Gym
+
+    Gym.objects.filter(gym_id=gym_id).update(current_occupancy=Greatest(F('current_occupancy') - count, 0))
+
+
+def leave_visits(visit_ids):
+    """Remove the people behind a batch of visits closed with a bulk update."""
+    from .models import Visit
+
+    closed_per_gym = (
+        Visit.objects.filter(id__in=visit_ids, gym__isnull=False)
+        .values_list('gym_id')
+        .annotate(closed_visits=Count('id'))
+        .order_by()
+    )
+    for gym_id, closed_visits in closed_per_gym:
+        leave(gym_id, closed_visits)
+        invalidate_gym_metrics(gym_id)
+
+
+def get_occupancy(gym_id):
+    """Read the live counter straight from the database (cached Gym instances may be stale)."""
+    from .models import Gym
+
+    return Gym.objects.filter(gym_id=gym_id).values('current_occupancy', 'max_capacity').first()
+
+
+def reconcile_occupancy(gym_ids=None):
+    """Reset gyms' counters to their real number of open visits, returns the number of gyms fixed."""
+    from .models import Gym
+
+    gyms = Gym.objects.all() if gym_ids is None else Gym.objects.filter(gym_id__in=gym_ids)
+    drifted = (
+        gyms.annotate(open_visits=Count('visits', filter=Q(visits__exit_time__isnull=True)))
+        .exclude(current_occupancy=F('open_visits'))
+        .values_list('gym_id', 'open_visits')
+    )
+    fixed = 0
+    for gym_id, open_visits in drifted:
+        Gym.objects.filter(gym_id=gym_id).update(current_occupancy=open_visits)
+        invalidate_gym_metrics(gym_id)
+        fixed += 1
+    return fixed
@@ -0,0 +1,81 @@
+from django.db.models import Count, Q, Sum
+from django.utils import timezone
+from datetime import timedelta
+from decimal import Decimal
+from .rollups import day_bounds
+
+DEFAULT_DAYS = 30
+MAX_DAYS = 366
+CENTS = Decimal('0.01')
+
+
+def portfolio_metrics(owner, days=DEFAULT_DAYS):
+    """
+    Side by side metrics for every gym the owner (a GymOwner or its id) is the primary owner of,
+    over the last `days` days.
+
+    One grouped query per metric whatever the number of gyms: visits and session time come
+    from the daily rollups, members from the member table and revenue from succeeded orders.
+    Returns (rows, totals), rows sorted by gym name.
+    """
+    from .models import Gym, GymDailyVisitStats, Member, Order
+
+    today = timezone.localdate()
+    first_day = today - timedelta(days=days - 1)
+    start, end = day_bounds(first_day)[0], day_bounds(today)[1]
+
+    gyms = list(
+        Gym.objects.filter(ownerships__owner=owner, ownerships__role='primary')
+        .order_by('name')
+        .values('gym_id', 'name', 'slug')
+    )
+    gym_ids = [gym['gym_id'] for gym in gyms]
+
+    visits = {
+        row['gym_id']: row
+        for row in GymDailyVisitStats.objects.filter(gym_id__in=gym_ids, date__gte=first_day, date__lte=today)
+        .values('gym_id')
+        .annotate(visits=Sum('visit_count'), session_seconds=Sum('total_session_seconds'))
+        .order_by()
+    }
+    members = {
+        row['gym_id']: row
+        for row in Member.objects.filter(gym_id__in=gym_ids)
+        .values('gym_id')
+        .annotate(members=Count('id'), active_members=Count('id', filter=Q(active=True)))
+        .order_by()
+    }
+    revenue = dict(
+        Order.objects.filter(gym_id__in=gym_ids, status='succeeded', created_at__gte=start, created_at__lt=end)
+        .values_list('gym_id')
+        .annotate(total=Sum('total_price'))
+        .order_by()
+    )
+
+    rows = []
+    for gym in gyms:
+        gym_visits = visits.get(gym['gym_id'], {})
+        visit_count = gym_visits.get('visits') or 0
+        session_seconds = gym_visits.get('session_seconds') or 0
+        rows.append({
+            'gym_name': gym['name'],
+            'gym_slug': gym['slug'],
+            'visits': visit_count,
+            'avg_session_minutes': round(session_seconds / visit_count / 60, 1) if visit_count else 0,
+            'session_seconds': session_seconds,
+            'members': members.get(gym['gym_id'], {}).get('members', 0),
+            'active_members': members.get(gym['gym_id'], {}).get('active_members', 0),
+            'revenue': (revenue.get(gym['gym_id']) or Decimal('0')).quantize(CENTS),
+        })
+
+    total_visits = sum(row['visits'] for row in rows)
+    total_seconds = sum(row['session_seconds'] for row in rows)
+    totals = {
+        'gyms': len(rows),
+        'visits': total_visits,
+        'avg_session_minutes': round(total_seconds / total_visits / 60, 1) if total_visits else 0,
+        'members': sum(row['members'] for row in rows),
+        'active_members': sum(row['active_members'] for row in rows),
+        'revenue': sum((row['revenue'] for row in rows), Decimal('0')).quantize(CENTS),
+    }
+    return rows, totals
@@ -0,0 +1,107 @@
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db.models import F
+import time
+
+# Session key holding the logged-in user's role, profile id and gym roles version, and when they were resolved
+SESSION_KEY = 'gym_profile'
+OWNER = 'owner'
+MEMBER = 'member'
+
+
+def resolve_profile(user):
+    """
+    Return (role, profile id, gym roles version) for a user in one query, role is 'owner',
+    'member' or None.
+    """
+    owner_id, member_id, roles_version = (
+        User.objects.filter(pk=user.pk)
+        .values_list('gymowner__id', 'member__id', 'gym_roles_version__version')
+        .first()
+    ) or (None, None, None)
+    roles_version = roles_version or 0
+    # Someone who is both an owner and a member uses the owner side, as the login redirect always has
+    if owner_id:
+        return OWNER, owner_id, roles_version
+    if member_id:
+        return MEMBER, member_id, roles_version
+    return None, None, roles_version
+
+
+def store_profile(request, user=None):
+    """Resolve the user's role and profile and keep them in the session, returns the role."""
+    user = user or request.user
+    role, profile_id, roles_version = resolve_profile(user)
+    request.session[SESSION_KEY] = {
+        'user_id': user.pk,
+        'loaded_at': time.time(),
+        'role': role,
+        'profile_id': profile_id,
+        'roles_version': roles_version,
+    }
+    return role
+
+
+def get_session_profile(request):
+    """
+    Return (role, profile id) from the session, resolved again every GYM_ROLES_SESSION_TTL seconds.
+
+    A profile deleted in the meantime, or a change of gym roles such as a member being made a
+    manager, is noticed when the profile is loaded (see load_profile).
+    """
+    if not request.user.is_authenticated:
+        return None, None
+    stored = request.session.get(SESSION_KEY)
+    if (
+        not stored
+        or stored.get('user_id') != request.user.pk
+        or time.time() - stored.get('loaded_at', 0) >= getattr(settings, 'GYM_ROLES_SESSION_TTL', 60)
+    ):
+        store_profile(request)
+        stored = request.session[SESSION_KEY]
+    return stored['role'], stored['profile_id']
+
+
+def load_profile(request, role, profile_id):
+    """
+    Fetch the GymOwner or Member row by primary key, reusing the already loaded user.
+
+    Profiles come with `roles_version`, the user's current gym roles version (see core.access).
+    If it moved on since the session was stored, the user's role is resolved again and
+    request.gym_role and request.profile_id follow, so a member made a manager is treated as
+    an owner straight away.
+    """
+    from .models import GymOwner, Member
+
+    if role == OWNER:
+        profiles = GymOwner.objects.select_related('subscription_tier')
+    elif role == MEMBER:
+        profiles = Member.objects.select_related('gym')
+    else:
+        return None
+    profile = (
+        profiles.annotate(roles_version=F('user__gym_roles_version__version'))
+        .filter(pk=profile_id, user=request.user)
+        .first()
+    )
+    stored = request.session.get(SESSION_KEY) or {}
+    if profile is None or (profile.roles_version or 0) != stored.get('roles_version', 0):
+        # The profile was deleted or the user's roles changed since they were stored
+        request.gym_role = store_profile(request)
+        request.profile_id = request.session[SESSION_KEY]['profile_id']
+        if (request.gym_role, request.profile_id) != (role, profile_id):
+            return load_profile(request, request.gym_role, request.profile_id)
+    if profile is None:
+        return None
+    profile.user = request.user
+    return profile
+
+
+def require_profile(request, role):
+    """The user's profile (request.profile) if they have `role`, raises GymOwner/Member.DoesNotExist otherwise."""
+    from .models import GymOwner, Member
+
+    # Loading the profile first can still change the role
+    if not request.profile or request.gym_role != role:
+        raise (GymOwner if role == OWNER else Member).DoesNotExist(f"No {role} profile for this user.")
+    return request.profile
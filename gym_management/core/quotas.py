@@ -0,0 +1,95 @@
+from django.db import transaction
+from django.db.models import Count, F, Q
+from django.db.models.functions import Greatest
+from django.utils.timezone import now
+
+# Resources counted in OwnerUsage, all of them only across the owner's primary gyms
+RESOURCES = ('gyms', 'members', 'products')
+
+
+def _owner_id(owner):
+    return getattr(owner, 'pk', owner)
+
+
+def primary_owner_id(gym_id):
+    """Return the id of the GymOwner whose limits a gym counts towards, or None."""
+    from .models import GymOwnership
+
+    return GymOwnership.objects.filter(gym_id=gym_id, role='primary').values_list('owner_id', flat=True).first()
+
+
+def get_usage(owner):
+    """Return the owner's OwnerUsage row, counting everything from scratch the first time."""
+    from .models import OwnerUsage
+
+    usage = OwnerUsage.objects.filter(owner_id=_owner_id(owner)).first()
+    if usage is None:
+        reconcile_usage(owner_ids=[_owner_id(owner)])
+        usage = OwnerUsage.objects.get(owner_id=_owner_id(owner))
+    return usage
+
+
+def adjust_usage(owner, resource, delta):
+    """Add `delta` (may be negative) to one of the owner's usage counters."""
+    from .models import OwnerUsage
+
+    if resource not in RESOURCES:
+        raise ValueError(f"Unknown resource: {resource}")
+    owner_id = _owner_id(owner)
+    with transaction.atomic():
+        updated = OwnerUsage.objects.filter(owner_id=owner_id).update(**{resource: Greatest(F(resource) + delta, 0)})
+    if not updated:
+        # First change for this owner, count everything (including this change) from scratch
+        reconcile_usage(owner_ids=[owner_id])
+
+
+def remaining_quota(owner, resource):
+    """How many more of `resource` the owner's subscription allows."""
+    from .models import GymOwner
+
+    if not isinstance(owner, GymOwner):
+        owner = GymOwner.objects.select_related('subscription_tier').get(pk=owner)
+    return max(owner.get_limit(resource) - getattr(get_usage(owner), resource), 0)
+
+
+def check_quota(owner, resource, n=1):
+    """Return True if the owner (a GymOwner or its id) may add `n` more of `resource`."""
+    return remaining_quota(owner, resource) >= n
+
+
+def reconcile_usage(owner_ids=None):
+    """Recount usage from the real rows, for every owner or only the given ones."""
+    from .models import GymOwner, Member, OwnerUsage, Product
+
+    owners = GymOwner.objects.all() if owner_ids is None else GymOwner.objects.filter(pk__in=owner_ids)
+    primary = Q(gym__ownerships__role='primary')
+
+    # One grouped query per resource
+    gyms = dict(
+        owners.annotate(total=Count('gym_roles', filter=Q(gym_roles__role='primary'))).values_list('pk', 'total')
+    )
+    members = dict(
+        Member.objects.filter(primary, gym__ownerships__owner__in=owners)
+        .values_list('gym__ownerships__owner')
+        .annotate(total=Count('id'))
+        .order_by()
+    )
+    products = dict(
+        Product.objects.filter(primary, gym__ownerships__owner__in=owners)
+        .values_list('gym__ownerships__owner')
+        .annotate(total=Count('id'))
+        .order_by()
+    )
+
+    reconciled_at = now()
+    for owner_id, gym_count in gyms.items():
+        OwnerUsage.objects.update_or_create(
+            owner_id=owner_id,
+            defaults={
+                'gyms': gym_count,
+                'members': members.get(owner_id, 0),
+                'products': products.get(owner_id, 0),
+                'reconciled_at': reconciled_at,
+            },
+        )
+    return len(gyms)
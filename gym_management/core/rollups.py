@@ -0,0 +1,135 @@
+from datetime import datetime, time, timedelta
+from django.db import transaction
+from django.db.models import Count, DurationField, ExpressionWrapper, F, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+from . import leaderboard, member_stats
+
+
+def session_duration():
+    """Database expression for the length of a visit (exit_time - entry_time)."""
+    return ExpressionWrapper(F('exit_time') - F('entry_time'), output_field=DurationField())
+
+
+def day_bounds(day):
+    """Return the aware [start, end) datetimes covering a local calendar day."""
+    start = timezone.make_aware(datetime.combine(day, time.min))
+    return start, start + timedelta(days=1)
+
+
+def record_closed_visit(visit):
+    """Fold a single closed visit into its gym's daily rollup row, its member's visit tallies and stats row."""
+    from .models import GymDailyVisitStats, Visit
+
+    gym_id = visit.gym_id
+    if gym_id is None or visit.exit_time is None:
+        return
+
+    day = timezone.localdate(visit.entry_time)
+    start, end = day_bounds(day)
+    session_seconds = max(int((visit.exit_time - visit.entry_time).total_seconds()), 0)
+
+    # Only count the member once per day, however many times they come in
+    first_visit_of_day = not Visit.objects.filter(
+        member_id=visit.member_id,
+        exit_time__isnull=False,
+        entry_time__gte=start,
+        entry_time__lt=end,
+    ).exclude(pk=visit.pk).exists()
+
+    with transaction.atomic():
+        stats, _ = GymDailyVisitStats.objects.get_or_create(gym_id=gym_id, date=day)
+        GymDailyVisitStats.objects.filter(pk=stats.pk).update(
+            visit_count=F('visit_count') + 1,
+            total_session_seconds=F('total_session_seconds') + session_seconds,
+            unique_members=F('unique_members') + (1 if first_visit_of_day else 0),
+        )
+        leaderboard.record_visit(visit)
+        member_stats.record_visit(visit)
+
+
+def _daily_totals(visits):
+    """Group completed visits by gym and day in the database."""
+    return (
+        visits.filter(exit_time__isnull=False, gym__isnull=False)
+        .annotate(day=TruncDate('entry_time'))
+        .values('gym_id', 'day')
+        .annotate(
+            visit_count=Count('id'),
+            total_session=Sum(session_duration()),
+            unique_members=Count('member', distinct=True),
+        )
+        .order_by()
+    )
+
+
+def _stats_from_row(row):
+    from .models import GymDailyVisitStats
+
+    total_session = row['total_session'] or timedelta(0)
+    return GymDailyVisitStats(
+        gym_id=row['gym_id'],
+        date=row['day'],
+        visit_count=row['visit_count'],
+        total_session_seconds=max(int(total_session.total_seconds()), 0),
+        unique_members=row['unique_members'],
+    )
+
+
+def refresh_daily_stats(gym_id, days):
+    """Recompute the rollup rows for a handful of (gym, day) pairs from the raw visits."""
+    from .models import GymDailyVisitStats, Visit
+
+    for day in days:
+        start, end = day_bounds(day)
+        visits = Visit.objects.filter(gym_id=gym_id, entry_time__gte=start, entry_time__lt=end)
+        rows = list(_daily_totals(visits))
+        with transaction.atomic():
+            GymDailyVisitStats.objects.filter(gym_id=gym_id, date=day).delete()
+            GymDailyVisitStats.objects.bulk_create([_stats_from_row(row) for row in rows])
+
+
+def record_closed_visits(visit_ids):
+    """Refresh the rollup rows, member tallies and stats touched by a batch of visits closed with a bulk update."""
+    from .models import Visit
+
+    leaderboard.record_visits(Visit.objects.filter(id__in=visit_ids))
+    member_stats.record_visits(Visit.objects.filter(id__in=visit_ids))
+
+    touched = (
+        Visit.objects.filter(id__in=visit_ids, gym__isnull=False)
+        .annotate(day=TruncDate('entry_time'))
+        .values_list('gym_id', 'day')
+        .distinct()
+        .order_by()
+    )
+    days_by_gym = {}
+    for gym_id, day in touched:
+        days_by_gym.setdefault(gym_id, set()).add(day)
+    for gym_id, days in days_by_gym.items():
+        refresh_daily_stats(gym_id, sorted(days))
+
+
+def rebuild_daily_stats(gyms=None, batch_size=1000):
+    """Throw away and rebuild the daily rollups, optionally only for the given gyms."""
+    from .models import GymDailyVisitStats, Visit
+
+    visits = Visit.objects.all()
+    stats = GymDailyVisitStats.objects.all()
+    if gyms is not None:
+        visits = visits.filter(gym__in=gyms)
+        stats = stats.filter(gym__in=gyms)
+
+    created = 0
+    with transaction.atomic():
+        stats.delete()
+        batch = []
+        for row in _daily_totals(visits).iterator(chunk_size=batch_size):
+            batch.append(_stats_from_row(row))
+            if len(batch) >= batch_size:
+                GymDailyVisitStats.objects.bulk_create(batch)
+                created += len(batch)
+                batch = []
+        GymDailyVisitStats.objects.bulk_create(batch)
+        created += len(batch)
+    return created
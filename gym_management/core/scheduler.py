@@ -0,0 +1,154 @@
+from django.db import IntegrityError, close_old_connections, transaction
+from django.db.models import Q
+from django.utils.timezone import now
+from datetime import timedelta
+import importlib
+import logging
+import os
+import random
+import socket
+import time
+
+logger = logging.getLogger(__name__)
+
+# Modules that register periodic jobs when imported
+JOB_MODULES = ['core.crons']
+
+_jobs = {}
+
+
+class PeriodicJob:
+    """A function to run every `interval` seconds, delayed by up to `jitter` extra seconds."""
+
+    def __init__(self, name, func, interval, jitter=0):
+        self.name = name
+        self.func = func
+        self.interval = interval
+        self.jitter = jitter
+
+    def next_delay(self):
+        return self.interval + random.uniform(0, self.jitter)
+
+    def __repr__(self):
+        return f"<PeriodicJob {self.name} every {self.interval}s (+{self.jitter}s jitter)>"
+
+
+def periodic_job(interval, jitter=0, name=None):
+    """Decorator registering a function as a periodic job for the scheduler."""
+    def register(func):
+        job_name = name or f"{func.__module__}.{func.__name__}"
+        _jobs[job_name] = PeriodicJob(job_name, func, interval, jitter)
+        return func
+    return register
+
+
+def get_jobs():
+    """Return the registered jobs, importing the modules that declare them."""
+    for module in JOB_MODULES:
+        importlib.import_module(module)
+    return dict(_jobs)
+
+
+def acquire_leadership(holder, ttl, lease_name='scheduler'):
+    """
+    Take or renew the scheduler lease, returns True if `holder` is now the leader.
+
+    The lease is a single row: it can be taken over once the current holder stops renewing it.
+    """
+    from .models import SchedulerLease
+
+    current_time = now()
+    expires_at = current_time + timedelta(seconds=ttl)
+    with transaction.atomic():
+        renewed = SchedulerLease.objects.filter(
+            Q(holder=holder) | Q(expires_at__lt=current_time),
+            name=lease_name,
+        ).update(holder=holder, expires_at=expires_at)
+        if renewed:
+            return True
+        if SchedulerLease.objects.filter(name=lease_name).exists():
+            return False
+    try:
+        with transaction.atomic():
+            SchedulerLease.objects.create(name=lease_name, holder=holder, expires_at=expires_at)
+        return True
+    except IntegrityError:
+        # Another instance created the lease first
+        return False
+
+
+def release_leadership(holder, lease_name='scheduler'):
+    from .models import SchedulerLease
+
+    SchedulerLease.objects.filter(name=lease_name, holder=holder).delete()
+
+
+class Scheduler:
+    """Runs the registered periodic jobs in this process while it holds the scheduler lease."""
+
+    def __init__(self, jobs=None, lease_ttl=60, tick=1.0):
+        self.jobs = jobs if jobs is not None else get_jobs()
+        self.lease_ttl = lease_ttl
+        self.tick = tick
+        self.holder = f"{socket.gethostname()}:{os.getpid()}"
+        self.is_leader = False
+        self.last_renewal = None
+        self.next_runs = {}
+        self._stopped = False
+
+    def stop(self):
+        self._stopped = True
+
+    def renew_lease(self):
+        """Take or renew the lease, returns whether this instance is (still) the leader."""
+        was_leader = self.is_leader
+        self.is_leader = acquire_leadership(self.holder, self.lease_ttl)
+        self.last_renewal = time.monotonic()
+        if self.is_leader != was_leader:
+            logger.info("Scheduler %s %s leadership", self.holder, "acquired" if self.is_leader else "lost")
+            self.next_runs = {}
+        return self.is_leader
+
+    def run_pending(self, hold_lease=False):
+        """
+        Run every job that is due, returns the names of the jobs that ran.
+
+        With `hold_lease` the lease is renewed before each job, so a job always starts with a full
+        lease_ttl ahead of it however long the previous ones took, and the remaining jobs are
+        skipped if another instance has taken the lease over in the meantime.
+        """
+        ran = []
+        for name, job in self.jobs.items():
+            if time.monotonic() < self.next_runs.get(name, 0):
+                continue
+            if hold_lease and not self.renew_lease():
+                break
+            started = time.monotonic()
+            try:
+                job.func()
+            except Exception:
+                logger.exception("Scheduled job %s failed", name)
+            else:
+                logger.info("Scheduled job %s finished in %.3fs", name, time.monotonic() - started)
+            if hold_lease and time.monotonic() - started > self.lease_ttl:
+                logger.warning(
+                    "Scheduled job %s ran for %.0fs, longer than the %ss lease, another instance may have run jobs meanwhile",
+                    name, time.monotonic() - started, self.lease_ttl,
+                )
+            self.next_runs[name] = time.monotonic() + job.next_delay()
+            ran.append(name)
+        return ran
+
+    def run_forever(self):
+        try:
+            while not self._stopped:
+                close_old_connections()
+                # Renew the lease well before it expires
+                if self.last_renewal is None or time.monotonic() - self.last_renewal >= self.lease_ttl / 3:
+                    self.renew_lease()
+                if self.is_leader:
+                    self.run_pending(hold_lease=True)
+                time.sleep(self.tick)
+        finally:
+            if self.is_leader:
+                release_leadership(self.holder)
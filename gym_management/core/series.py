@@ -0,0 +1,213 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, F, Q, Sum
+from django.db.models.functions import Trunc, TruncWeek
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+from datetime import datetime, time, timedelta
+from .crons import AUTO_EXIT_INTERVAL, AUTO_EXIT_JITTER
+from .metrics import bump_cache_version
+from .rollups import day_bounds, session_duration
+import math
+
+BUCKET_SIZES = {
+    'hour': timedelta(hours=1),
+    'day': timedelta(days=1),
+    'week': timedelta(weeks=1),
+}
+BUCKETS = list(BUCKET_SIZES)
+DEFAULT_MAX_POINTS = 200
+MAX_POINTS = 1000
+# An overdue visit is closed by the next auto exit sweep, up to one interval (plus jitter) after it
+# passes the threshold, with a minute to spare for the sweep itself to run
+SWEEP_DELAY = timedelta(seconds=AUTO_EXIT_INTERVAL + AUTO_EXIT_JITTER + 60)
+
+
+class InvalidSeriesQuery(ValueError):
+    """Raised for a malformed series parameter."""
+
+
+def parse_series_params(params):
+    """Read bucket, start, end and max_points from request.GET, raises InvalidSeriesQuery for bad values."""
+    bucket = params.get('bucket') or 'day'
+    if bucket not in BUCKET_SIZES:
+        raise InvalidSeriesQuery(f"'bucket' must be one of {', '.join(BUCKETS)}.")
+    days = {}
+    for name in ('start', 'end'):
+        days[name] = None
+        if params.get(name):
+            try:
+                days[name] = parse_date(params[name])
+            except ValueError:
+                pass
+            if days[name] is None:
+                raise InvalidSeriesQuery(f"'{name}' must use the format YYYY-MM-DD.")
+    try:
+        max_points = min(max(int(params.get('max_points', DEFAULT_MAX_POINTS)), 1), MAX_POINTS)
+    except ValueError:
+        raise InvalidSeriesQuery("'max_points' must be a number.")
+
+    # Both days are included in the range
+    start = day_bounds(days['start'])[0] if days['start'] else None
+    end = day_bounds(days['end'])[1] if days['end'] else None
+    if start and end and start >= end:
+        raise InvalidSeriesQuery("'start' must be before 'end'.")
+    return {'bucket': bucket, 'start': start, 'end': end, 'max_points': max_points}
+
+
+def bucket_start(moment, bucket):
+    """The local start of the bucket containing `moment`."""
+    local = timezone.localtime(moment)
+    if bucket == 'hour':
+        return local.replace(minute=0, second=0, microsecond=0)
+    day = local.date()
+    if bucket == 'week':
+        day -= timedelta(days=day.weekday())  # Weeks start on Monday
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def _bucket_starts(bucket, start, end):
+    current = bucket_start(start, bucket)
+    starts = []
+    while current < end:
+        starts.append(current)
+        current = bucket_start(current + BUCKET_SIZES[bucket], bucket)
+    return starts
+
+
+def _is_final(bucket_begin, bucket, current_time):
+    """A bucket is final once it has ended and the sweep has auto exited every visit in it at the latest."""
+    from .models import Visit
+
+    return bucket_begin + BUCKET_SIZES[bucket] + Visit.default_exit_threshold + SWEEP_DELAY <= current_time
+
+
+def _version_key(gym_id):
+    return f"visit-series-version:{gym_id}"
+
+
+def _cache_key(gym, version, bucket, begin):
+    return f"visit-series:{gym.gym_id}:{version}:{bucket}:{begin.isoformat()}"
+
+
+def invalidate_visit_series(gym_id, entry_times=None):
+    """
+    Drop the gym's cached buckets after visits were added or closed in the past.
+
+    With the `entry_times` of those visits nothing is dropped unless one of them is in an hour
+    that may already be cached, the finest bucket and so the first to be.
+    """
+    if entry_times is not None:
+        current_time = timezone.now()
+        if not any(_is_final(bucket_start(moment, 'hour'), 'hour', current_time) for moment in entry_times):
+            return
+    bump_cache_version(_version_key(gym_id))
+
+
+def _raw_buckets(gym, bucket, begin, end):
+    """(visits, completed visits, session seconds) per bucket start for [begin, end), counted from the visits."""
+    from .models import Visit
+
+    rows = (
+        Visit.objects.for_gym(gym).between(begin, end)
+        .annotate(bucket=Trunc('entry_time', bucket))
+        .values('bucket')
+        .annotate(
+            visits=Count('id'),
+            completed=Count('id', filter=Q(exit_time__isnull=False)),
+            session=Sum(session_duration(), filter=Q(exit_time__isnull=False)),
+        )
+        .order_by()
+    )
+    return {
+        timezone.localtime(row['bucket']): (
+            row['visits'], row['completed'], int(row['session'].total_seconds()) if row['session'] else 0,
+        )
+        for row in rows
+    }
+
+
+def _compute_buckets(gym, bucket, begin, end):
+    """Same as _raw_buckets, but days and weeks are read from the daily rollups."""
+    from .models import GymDailyVisitStats
+
+    if bucket == 'hour':
+        return _raw_buckets(gym, bucket, begin, end)
+
+    rollups = GymDailyVisitStats.objects.filter(
+        gym=gym, date__gte=timezone.localdate(begin), date__lt=timezone.localdate(end),
+    )
+    if bucket == 'week':
+        rollups = rollups.annotate(bucket=TruncWeek('date'))
+    else:
+        rollups = rollups.annotate(bucket=F('date'))
+    rows = rollups.values('bucket').annotate(visits=Sum('visit_count'), session=Sum('total_session_seconds')).order_by()
+    return {
+        timezone.make_aware(datetime.combine(row['bucket'], time.min)): (row['visits'], row['visits'], row['session'])
+        for row in rows
+    }
+
+
+def _point(begin, values):
+    visits, completed, session_seconds = values
+    return {
+        'start': begin.isoformat(),
+        'visits': visits,
+        'avg_session_minutes': round(session_seconds / completed / 60, 2) if completed else 0,
+    }
+
+
+def visit_series(gym, bucket='day', start=None, end=None, max_points=DEFAULT_MAX_POINTS):
+    """
+    Visits per hour, day or week for a gym between `start` and `end` (aware datetimes).
+
+    If the range needs more than `max_points` buckets the next coarser bucket is used, and
+    beyond weeks consecutive weeks are merged. Buckets that can no longer change are cached
+    for GYM_SERIES_CACHE_TTL and only the missing ones are queried (one grouped query).
+    Buckets still open are recomputed on every call with a second grouped query. Returns
+    (bucket used, points).
+    """
+    current_time = timezone.now()
+    end = end or current_time
+    start = start or end - timedelta(days=30)
+
+    # Move to a coarser bucket until the range fits in max_points
+    while bucket != 'week' and len(_bucket_starts(bucket, start, end)) > max_points:
+        bucket = BUCKETS[BUCKETS.index(bucket) + 1]
+    starts = _bucket_starts(bucket, start, end)
+
+    values = {}
+    version = cache.get(_version_key(gym.gym_id), 0)
+    final = [begin for begin in starts if _is_final(begin, bucket, current_time)]
+    cached = cache.get_many([_cache_key(gym, version, bucket, begin) for begin in final])
+    missing = []
+    for begin in final:
+        key = _cache_key(gym, version, bucket, begin)
+        if key in cached:
+            values[begin] = cached[key]
+        else:
+            missing.append(begin)
+
+    if missing:
+        computed = _compute_buckets(gym, bucket, missing[0], missing[-1] + BUCKET_SIZES[bucket])
+        fresh = {begin: computed.get(begin, (0, 0, 0)) for begin in missing}
+        values.update(fresh)
+        cache.set_many(
+            {_cache_key(gym, version, bucket, begin): value for begin, value in fresh.items()},
+            getattr(settings, 'GYM_SERIES_CACHE_TTL', 3600),
+        )
+
+    # Buckets that can still change are always recomputed from the visits, future ones are empty
+    pending = [begin for begin in starts if begin not in values and begin <= current_time]
+    if pending:
+        recent = _raw_buckets(gym, bucket, pending[0], pending[-1] + BUCKET_SIZES[bucket])
+        values.update({begin: recent.get(begin, (0, 0, 0)) for begin in pending})
+
+    # Still too many weeks, merge them in equal groups
+    group_size = math.ceil(len(starts) / max_points) if len(starts) > max_points else 1
+    points = []
+    for index in range(0, len(starts), group_size):
+        group = starts[index:index + group_size]
+        merged = tuple(sum(values.get(begin, (0, 0, 0))[field] for begin in group) for field in range(3))
+        points.append(_point(group[0], merged))
+    return bucket, points
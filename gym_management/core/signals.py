@@ -0,0 +1,95 @@
+from django.contrib.auth.models import User
+from django.db.models import QuerySet
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from .models import Gym, GymOwner, GymOwnership, Member, Product, Visit
+from .access import invalidate_gym_roles
+from .gym_cache import invalidate_gym_slug
+from .metrics import invalidate_gym_metrics
+from .quotas import adjust_usage, primary_owner_id, reconcile_usage
+
+
+# Keep OwnerUsage in step with the rows it counts. Frequent changes (members, products) adjust
+# the counters, rare ones (a gym changing hands) recount the owner. Anything missed, such as a
+# member moving gym, is corrected by the periodic reconcile_usage_job.
+
+def _deleted_with(origin, *models):
+    """Whether a delete started from one of `models` (an instance or a queryset), whose dependent rows go with it."""
+    model = origin.model if isinstance(origin, QuerySet) else type(origin)
+    return issubclass(model, models)
+
+
+@receiver(post_save, sender=Member)
+def member_created(sender, instance, created, **kwargs):
+    if created and instance.gym_id:
+        owner_id = primary_owner_id(instance.gym_id)
+        if owner_id:
+            adjust_usage(owner_id, 'members', 1)
+
+
+@receiver(post_delete, sender=Member)
+def member_deleted(sender, instance, **kwargs):
+    if instance.gym_id:
+        owner_id = primary_owner_id(instance.gym_id)
+        if owner_id:
+            adjust_usage(owner_id, 'members', -1)
+
+
+@receiver(post_save, sender=Product)
+def product_created(sender, instance, created, **kwargs):
+    if created:
+        owner_id = primary_owner_id(instance.gym_id)
+        if owner_id:
+            adjust_usage(owner_id, 'products', 1)
+
+
+@receiver(post_delete, sender=Product)
+def product_deleted(sender, instance, **kwargs):
+    owner_id = primary_owner_id(instance.gym_id)
+    if owner_id:
+        adjust_usage(owner_id, 'products', -1)
+
+
+@receiver(post_save, sender=GymOwnership)
+@receiver(post_delete, sender=GymOwnership)
+def ownership_changed(sender, instance, origin=None, **kwargs):
+    # Deleting the owner removes their usage row as well, recounting would create it again
+    if origin is not None and _deleted_with(origin, GymOwner, User):
+        return
+    reconcile_usage(owner_ids=[instance.owner_id])
+
+
+# Retire the owner's gym role map kept in their sessions (see core.access) whenever one of their ownerships changes
+@receiver(post_save, sender=GymOwnership)
+@receiver(post_delete, sender=GymOwnership)
+def ownership_roles_changed(sender, instance, origin=None, **kwargs):
+    # Deleting the user removes their roles version and sessions as well
+    if origin is not None and _deleted_with(origin, User):
+        return
+    user_id = GymOwner.objects.filter(pk=instance.owner_id).values_list('user_id', flat=True).first()
+    if user_id:
+        invalidate_gym_roles(user_id)
+
+
+# Any write to a gym's visits or members retires its cached dashboard metrics. Bulk updates
+# don't send signals, those code paths call invalidate_gym_metrics themselves.
+
+@receiver(post_save, sender=Visit)
+@receiver(post_delete, sender=Visit)
+@receiver(post_save, sender=Member)
+@receiver(post_delete, sender=Member)
+def gym_activity_changed(sender, instance, **kwargs):
+    if instance.gym_id:
+        invalidate_gym_metrics(instance.gym_id)
+
+
+@receiver(post_save, sender=Gym)
+def gym_changed(sender, instance, **kwargs):
+    invalidate_gym_metrics(instance.gym_id)
+
+
+# Drop the cached slug lookup (see core.gym_cache) when a gym is saved or deleted
+@receiver(post_save, sender=Gym)
+@receiver(post_delete, sender=Gym)
+def gym_slug_changed(sender, instance, **kwargs):
+    invalidate_gym_slug(instance.slug)
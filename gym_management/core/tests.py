@@ -1,3 +1,476 @@
-from django.test import TestCase
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.urls import reverse
+from django.utils import timezone
+from datetime import datetime, time, timedelta
+from unittest import mock
+from . import db_router
+from .checkin import CheckInError, toggle_visit
+from .crons import auto_exit_sweep
+from .gym_codes import CODE_MIN, CODE_SPACE, GymCodesExhausted, _permute, allocate_gym_codes, gym_code_usage
+from .metrics import compute_gym_metrics, get_gym_metrics
+from .series import visit_series
+from .visit_history import InvalidHistoryQuery, visit_history_page
+from .middleware import ReplicaPinningMiddleware
+from .models import (
+    Gym, GymCodeSequence, GymDailyVisitStats, GymOwner, GymOwnership, KioskEvent, Member, MemberVisitStats,
+    MemberVisitTally, OwnerUsage, Product, SubscriptionTier, Visit,
+)
+from .quotas import check_quota, get_usage, reconcile_usage
+from .rollups import rebuild_daily_stats
+import json
 
-# Create your tests here.
+
+def create_gym(name, tier=None, username=None):
+    """A gym with a primary owner on `tier` (a generous one by default), returns (gym, owner)."""
+    tier = tier or SubscriptionTier.objects.create(name="Basic", price=10)
+    owner_user = User.objects.create_user(username=username or f"owner-{name}")
+    owner = GymOwner.objects.create(user=owner_user, contact_number="0700000000", subscription_tier=tier)
+    gym = Gym.objects.create(name=name)
+    GymOwnership.objects.create(gym=gym, owner=owner, role='primary')
+    return gym, owner
+
+
+def create_member(gym, username, active=True):
+    member_user = User.objects.create_user(username=username, first_name=username.title())
+    return Member.objects.create(user=member_user, gym=gym, contact_number="0700000000", active=active)
+
+
+class GymOwnerDashboardQueryBudgetTests(TestCase):
+    """The owner dashboard must cost the same number of queries however many gyms the owner has."""
+
+    # Session, user, gym owner profile (by the id stored in the session) and the annotated ownerships query
+    QUERY_BUDGET = 4
+
+    def setUp(self):
+        tier = SubscriptionTier.objects.create(name="Franchise", price=99, max_gyms=100, max_members=10000)
+        self.user = User.objects.create_user(username="owner", password="password")
+        self.owner = GymOwner.objects.create(user=self.user, contact_number="0700000000", subscription_tier=tier)
+        self.client.force_login(self.user)
+
+    def add_gyms(self, count, role):
+        for _ in range(count):
+            number = Gym.objects.count()
+            gym = Gym.objects.create(name=f"Gym {number}")
+            GymOwnership.objects.create(gym=gym, owner=self.owner, role=role)
+            for member_number in range(3):
+                member_user = User.objects.create_user(username=f"member-{number}-{member_number}")
+                Member.objects.create(user=member_user, gym=gym, contact_number="0700000000", active=member_number > 0)
+
+    def test_query_count_is_constant(self):
+        self.add_gyms(1, 'primary')
+        # Ownership changes make the next request resolve the user's role again, as after a login
+        self.client.get(reverse('gym_owner_dashboard'))
+        with self.assertNumQueries(self.QUERY_BUDGET):
+            response = self.client.get(reverse('gym_owner_dashboard'))
+        self.assertEqual(len(response.context['primary_gyms']), 1)
+
+        self.add_gyms(20, 'primary')
+        self.add_gyms(20, 'manager')
+        self.client.get(reverse('gym_owner_dashboard'))
+        with self.assertNumQueries(self.QUERY_BUDGET):
+            response = self.client.get(reverse('gym_owner_dashboard'))
+
+        self.assertEqual(len(response.context['primary_gyms']), 21)
+        self.assertEqual(len(response.context['managed_gyms']), 20)
+        self.assertEqual(response.context['gym_limit']['current_usage'], 21)
+        self.assertEqual(response.context['member_limit']['current_usage'], 63)
+        self.assertEqual(response.context['primary_gyms'][0]['member_count'], 3)
+        self.assertEqual(response.context['primary_gyms'][0]['active_members'], 2)
+
+
+class KioskBatchSyncTests(TestCase):
+    """Offline kiosks resend whole batches and can scan the same member several times in one."""
+
+    def setUp(self):
+        cache.clear()
+        tier = SubscriptionTier.objects.create(name="Basic", price=10)
+        owner_user = User.objects.create_user(username="owner")
+        owner = GymOwner.objects.create(user=owner_user, contact_number="0700000000", subscription_tier=tier)
+        self.gym = Gym.objects.create(name="Kiosk Gym")
+        GymOwnership.objects.create(gym=self.gym, owner=owner, role='primary')
+        self.token = self.gym.rotate_kiosk_token()
+        member_user = User.objects.create_user(username="member", first_name="Sam")
+        self.member = Member.objects.create(user=member_user, gym=self.gym, contact_number="0700000000", active=True)
+
+    def sync(self, events):
+        response = self.client.post(
+            reverse('api_check_in_batch', args=[self.gym.slug]),
+            data=json.dumps({'events': events}),
+            content_type='application/json',
+            headers={'X-Kiosk-Token': self.token},
+        )
+        self.assertEqual(response.status_code, 200)
+        return [event['result'] for event in response.json()['results']]
+
+    def event(self, event_id, action, minutes_ago):
+        timestamp = timezone.now() - timedelta(minutes=minutes_ago)
+        return {'event_id': event_id, 'gym_code': self.member.gym_code, 'action': action, 'timestamp': timestamp.isoformat()}
+
+    def test_resent_batch_is_applied_once(self):
+        events = [self.event('a', 'enter', 90), self.event('b', 'exit', 30)]
+        self.assertEqual(self.sync(events), ['entered', 'exited'])
+        self.assertEqual(self.sync(events), ['entered', 'exited'])
+
+        self.assertEqual(Visit.objects.filter(member=self.member).count(), 1)
+        self.assertEqual(KioskEvent.objects.filter(gym=self.gym).count(), 2)
+        self.assertEqual(self.member.visit_stats.visit_count, 1)
+
+    def test_enter_exit_enter_in_one_batch(self):
+        events = [self.event('a', 'enter', 90), self.event('b', 'exit', 60), self.event('c', 'enter', 30)]
+        self.assertEqual(self.sync(events), ['entered', 'exited', 'entered'])
+
+        visits = Visit.objects.filter(member=self.member).order_by('entry_time')
+        self.assertEqual(len(visits), 2)
+        self.assertIsNotNone(visits[0].exit_time)
+        self.assertIsNone(visits[1].exit_time)
+        self.gym.refresh_from_db()
+        self.assertEqual(self.gym.current_occupancy, 1)
+
+    def test_backdated_batch_reaches_cached_series(self):
+        end = timezone.now()
+        start = end - timedelta(days=3)
+        self.assertEqual(sum(point['visits'] for point in visit_series(self.gym, 'hour', start, end, 1000)[1]), 0)
+        self.sync([self.event('a', 'enter', 2 * 24 * 60), self.event('b', 'exit', 2 * 24 * 60 - 30)])
+        self.assertEqual(sum(point['visits'] for point in visit_series(self.gym, 'hour', start, end, 1000)[1]), 1)
+
+    def test_impossible_timestamp_only_rejects_its_event(self):
+        impossible = {'event_id': 'a', 'gym_code': self.member.gym_code, 'action': 'enter', 'timestamp': '2026-02-30T10:00:00'}
+        self.assertEqual(self.sync([impossible, self.event('b', 'enter', 30)]), ['invalid', 'entered'])
+        self.assertEqual(Visit.objects.filter(member=self.member).count(), 1)
+
+
+class CheckInTests(TestCase):
+    """Scans at the front desk, and what the gym dashboard shows after them."""
+
+    def setUp(self):
+        cache.clear()
+        self.gym, owner = create_gym("Desk Gym")
+        self.member = create_member(self.gym, "sam")
+        self.client.force_login(owner.user)
+
+    def dashboard(self):
+        response = self.client.get(reverse('gym_dashboard', args=[self.gym.slug]))
+        self.assertEqual(response.status_code, 200)
+        return response.context
+
+    def test_concurrent_duplicate_scans_leave_one_open_visit(self):
+        self.assertEqual(toggle_visit(self.gym, self.member.gym_code)[1], 'enter')
+        # The second scan looked for an open visit before the first one had committed
+        with mock.patch.object(Visit.objects, 'filter', return_value=Visit.objects.none()):
+            with self.assertRaises(CheckInError) as raised:
+                toggle_visit(self.gym, self.member.gym_code)
+
+        self.assertEqual(raised.exception.code, 'duplicate_scan')
+        self.assertEqual(Visit.objects.filter(member=self.member, exit_time__isnull=True).count(), 1)
+        self.gym.refresh_from_db()
+        self.assertEqual(self.gym.current_occupancy, 1)
+
+    def test_check_in_and_out_update_the_dashboard(self):
+        self.assertEqual(self.dashboard()['current_occupancy'], 0)
+        toggle_visit(self.gym, self.member.gym_code)
+        self.assertEqual(self.dashboard()['current_occupancy'], 1)
+
+        toggle_visit(self.gym, self.member.gym_code)
+        context = self.dashboard()
+        self.assertEqual(context['current_occupancy'], 0)
+        self.assertEqual(context['total_visits'], 1)
+        self.assertEqual(context['recent_visits'][0].member, self.member)
+
+
+class GymMetricsCacheTests(TestCase):
+    """Dashboard metrics are cached until a write touches the gym."""
+
+    def setUp(self):
+        cache.clear()
+        self.gym, _ = create_gym("Metrics Gym")
+        self.member = create_member(self.gym, "sam")
+
+    def assertFresh(self, **expected):
+        metrics = get_gym_metrics(self.gym)
+        fresh = compute_gym_metrics(self.gym)
+        for name, value in expected.items():
+            self.assertEqual(metrics[name], value, name)
+            self.assertEqual(fresh[name], value, name)
+
+    def test_repeated_load_runs_no_queries(self):
+        get_gym_metrics(self.gym)
+        with self.assertNumQueries(0):
+            get_gym_metrics(self.gym)
+
+    def test_check_in_and_out_change_the_metrics(self):
+        self.assertFresh(current_occupancy=0, today_visits=0, total_visits=0)
+        toggle_visit(self.gym, self.member.gym_code)
+        self.assertFresh(current_occupancy=1, today_visits=1, total_visits=0)
+        toggle_visit(self.gym, self.member.gym_code)
+        self.assertFresh(current_occupancy=0, today_visits=1, total_visits=1)
+
+    def test_member_changes_change_the_metrics(self):
+        self.assertFresh(member_count=1, active_members=1)
+        create_member(self.gym, "alex", active=False)
+        self.assertFresh(member_count=2, active_members=1, inactive_members=1)
+
+
+class SubscriptionQuotaTests(TestCase):
+    """Members and products count towards the primary owner's subscription limits, however they are created."""
+
+    def setUp(self):
+        tier = SubscriptionTier.objects.create(name="Starter", price=10, max_gyms=2, max_members=2, max_regular_products=1)
+        self.gym, self.owner = create_gym("Quota Gym", tier=tier)
+
+    def create_product(self, gym, number):
+        return Product.objects.create(
+            gym=gym, name=f"Product {number}", price=10,
+            stripe_product_id=f"prod_{number}", stripe_price_id=f"price_{number}",
+        )
+
+    def test_check_quota(self):
+        self.assertTrue(check_quota(self.owner, 'members', 2))
+        self.assertFalse(check_quota(self.owner, 'members', 3))
+        self.assertTrue(check_quota(self.owner.pk, 'gyms'))
+        create_member(self.gym, "sam")
+        self.assertTrue(check_quota(self.owner, 'members'))
+        self.assertFalse(check_quota(self.owner, 'members', 2))
+
+    def test_limits_are_enforced_on_create(self):
+        create_member(self.gym, "sam")
+        create_member(self.gym, "alex")
+        with self.assertRaises(ValidationError):
+            create_member(self.gym, "kim")
+        self.assertEqual(Member.objects.filter(gym=self.gym).count(), 2)
+
+        self.create_product(self.gym, 1)
+        with self.assertRaises(ValidationError):
+            self.create_product(self.gym, 2)
+        self.assertEqual(get_usage(self.owner).products, 1)
+
+    def test_counters_follow_creates_and_deletes(self):
+        member = create_member(self.gym, "sam")
+        product = self.create_product(self.gym, 1)
+        usage = get_usage(self.owner)
+        self.assertEqual((usage.gyms, usage.members, usage.products), (1, 1, 1))
+
+        member.delete()
+        product.delete()
+        usage = get_usage(self.owner)
+        self.assertEqual((usage.members, usage.products), (0, 0))
+
+        # A gym the owner only manages doesn't count towards their limits
+        other_gym, _ = create_gym("Other Gym")
+        GymOwnership.objects.create(gym=other_gym, owner=self.owner, role='manager')
+        create_member(other_gym, "lee")
+        usage = get_usage(self.owner)
+        self.assertEqual((usage.gyms, usage.members), (1, 0))
+
+    def test_reconcile_usage_corrects_drift(self):
+        create_member(self.gym, "sam")
+        OwnerUsage.objects.filter(owner=self.owner).update(gyms=5, members=7, products=3)
+        self.assertFalse(check_quota(self.owner, 'members'))
+
+        reconcile_usage(owner_ids=[self.owner.pk])
+        usage = get_usage(self.owner)
+        self.assertEqual((usage.gyms, usage.members, usage.products), (1, 1, 0))
+        self.assertIsNotNone(usage.reconciled_at)
+        self.assertTrue(check_quota(self.owner, 'members'))
+
+
+class SessionGymRolesTests(TestCase):
+    """Sessions pick up a change of gym roles on the user's next request."""
+
+    def setUp(self):
+        self.gym, owner = create_gym("Roles Gym")
+        self.member = create_member(self.gym, "sam")
+        self.member.user.email = "sam@example.com"
+        self.member.user.save()
+        self.client.force_login(owner.user)
+        self.member_client = self.client_class()
+        self.member_client.force_login(self.member.user)
+
+    def test_member_made_manager_gets_the_gym_straight_away(self):
+        self.assertEqual(self.member_client.get(reverse('member_dashboard')).status_code, 200)
+        self.assertRedirects(
+            self.member_client.get(reverse('gym_dashboard', args=[self.gym.slug])),
+            reverse('login'), fetch_redirect_response=False,
+        )
+
+        self.client.post(reverse('invite_or_assign_manager', args=[self.gym.slug]), {'email': 'sam@example.com'})
+        self.assertTrue(GymOwnership.objects.filter(gym=self.gym, owner__user=self.member.user, role='manager').exists())
+
+        response = self.member_client.get(reverse('gym_dashboard', args=[self.gym.slug]))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.wsgi_request.gym_role, 'owner')
+
+
+class GymCodeAllocationTests(TestCase):
+    """Gym codes come from a shuffled sequence shared by every process."""
+
+    def setUp(self):
+        GymCodeSequence.objects.create(pk=1, seed='seed')
+
+    def test_permute_is_a_bijection_on_a_sample(self):
+        indices = list(range(5000)) + list(range(CODE_SPACE - 5000, CODE_SPACE))
+        codes = [_permute('seed', index) for index in indices]
+        self.assertEqual(len(set(codes)), len(indices))
+        self.assertTrue(all(CODE_MIN <= code < CODE_MIN + CODE_SPACE for code in codes))
+
+    def test_batches_take_the_next_codes_of_the_sequence(self):
+        first = allocate_gym_codes(50)
+        second = allocate_gym_codes(50)
+        self.assertEqual(first + second, [str(_permute('seed', index)) for index in range(100)])
+        self.assertEqual(GymCodeSequence.objects.get().next_index, 100)
+
+    def test_codes_members_hold_are_skipped(self):
+        gym, _ = create_gym("Code Gym")
+        held = str(_permute('seed', 1))
+        member_user = User.objects.create_user(username="legacy")
+        Member.objects.create(user=member_user, gym=gym, contact_number="0700000000", gym_code=held)
+        self.assertEqual(gym_code_usage()['held_ahead'], 1)
+
+        codes = allocate_gym_codes(3)
+        self.assertEqual(codes, [str(_permute('seed', index)) for index in (0, 2, 3)])
+        self.assertEqual(gym_code_usage()['held_ahead'], 0)
+        self.assertEqual(gym_code_usage()['remaining'], CODE_SPACE - 4)
+
+    def test_running_out_of_codes(self):
+        GymCodeSequence.objects.update(next_index=CODE_SPACE - 1)
+        self.assertEqual(len(allocate_gym_codes(1)), 1)
+        with self.assertRaises(GymCodesExhausted):
+            allocate_gym_codes(1)
+
+
+class VisitRollupTests(TestCase):
+    """Closed visits are folded into the daily rollups, member tallies and stats as they close."""
+
+    def setUp(self):
+        cache.clear()
+        self.gym, _ = create_gym("Rollup Gym")
+        self.sam = create_member(self.gym, "sam")
+        self.alex = create_member(self.gym, "alex")
+        self.day = timezone.localdate() - timedelta(days=1)
+        self.noon = timezone.make_aware(datetime.combine(self.day, time(12)))
+
+    def visit(self, member, hours_after_noon, minutes):
+        entry_time = self.noon + timedelta(hours=hours_after_noon)
+        visit = Visit.objects.create(member=member, gym=self.gym, gym_code=member.gym_code, entry_time=entry_time)
+        visit.close(exit_time=entry_time + timedelta(minutes=minutes))
+        return visit
+
+    def rollup(self):
+        return GymDailyVisitStats.objects.filter(gym=self.gym).values_list('date', 'visit_count', 'total_session_seconds', 'unique_members').get()
+
+    def test_closed_visits_are_rolled_up_and_a_rebuild_agrees(self):
+        self.visit(self.sam, 0, 30)
+        self.visit(self.sam, 2, 60)
+        self.visit(self.alex, 1, 45)
+        self.assertEqual(self.rollup(), (self.day, 3, 135 * 60, 2))
+
+        GymDailyVisitStats.objects.filter(gym=self.gym).update(visit_count=99, unique_members=0)
+        rebuild_daily_stats(gyms=[self.gym])
+        self.assertEqual(self.rollup(), (self.day, 3, 135 * 60, 2))
+
+    def test_auto_exit_sweep_closes_overdue_visits(self):
+        for member in (self.sam, self.alex, create_member(self.gym, "kim")):
+            toggle_visit(self.gym, member.gym_code)
+        overdue = timezone.now() - Visit.default_exit_threshold - timedelta(minutes=5)
+        Visit.objects.filter(member__in=[self.sam, self.alex]).update(entry_time=overdue)
+
+        self.assertEqual(auto_exit_sweep()['closed'], 2)
+
+        for member in (self.sam, self.alex):
+            visit = Visit.objects.get(member=member)
+            self.assertEqual(visit.exit_time, overdue + Visit.default_exit_duration)
+            self.assertTrue(visit.has_exit)
+            self.assertEqual(MemberVisitTally.objects.get(member=member, period='all').visit_count, 1)
+            self.assertEqual(MemberVisitStats.objects.get(member=member).visit_count, 1)
+        self.assertEqual(Visit.objects.filter(gym=self.gym, exit_time__isnull=True).count(), 1)
+        self.gym.refresh_from_db()
+        self.assertEqual(self.gym.current_occupancy, 1)
+        self.assertEqual(
+            GymDailyVisitStats.objects.filter(gym=self.gym, date=timezone.localdate(overdue)).get().visit_count, 2
+        )
+        self.assertEqual(auto_exit_sweep()['closed'], 0)
+
+
+class VisitHistoryPageTests(TestCase):
+    """History pages seek past the previous page's last (entry_time, id)."""
+
+    def setUp(self):
+        self.gym, _ = create_gym("History Gym")
+        other_gym, _ = create_gym("Other Gym")
+        member = create_member(self.gym, "sam")
+        start = timezone.now() - timedelta(days=2)
+        # Pairs of visits share an entry time, so pages must break ties on the id
+        for number in range(7):
+            entry_time = start + timedelta(hours=number // 2)
+            Visit.objects.create(
+                member=member, gym=self.gym, gym_code=member.gym_code,
+                entry_time=entry_time, exit_time=entry_time + timedelta(minutes=30), has_exit=True,
+            )
+        Visit.objects.create(member=member, gym=other_gym, gym_code=member.gym_code, entry_time=start, exit_time=start, has_exit=True)
+
+    def test_pages_cover_every_visit_once_in_order(self):
+        expected = list(Visit.objects.filter(gym=self.gym).order_by('-entry_time', '-id').values_list('id', flat=True))
+        seen = []
+        cursor = None
+        for _ in range(4):
+            page, cursor = visit_history_page(self.gym, cursor=cursor, limit=3)
+            seen.extend(visit.pk for visit in page)
+            if cursor is None:
+                break
+        self.assertEqual(seen, expected)
+        self.assertEqual(len(seen), 7)
+
+    def test_invalid_cursor(self):
+        with self.assertRaises(InvalidHistoryQuery):
+            visit_history_page(self.gym, cursor='not-a-cursor')
+
+
+@mock.patch('core.db_router.replica_configured', return_value=True)
+class AnalyticsReplicaRouterTests(SimpleTestCase):
+    """Analytics reads go to the replica until the request writes or the browser wrote just before."""
+
+    def setUp(self):
+        self.router = db_router.AnalyticsReplicaRouter()
+        self.tokens = [
+            (db_router._analytics, db_router._analytics.set(False)),
+            (db_router._pinned, db_router._pinned.set(False)),
+            (db_router._wrote, db_router._wrote.set(False)),
+        ]
+
+    def tearDown(self):
+        for variable, token in reversed(self.tokens):
+            variable.reset(token)
+
+    def test_only_analytics_reads_of_core_models_use_the_replica(self, replica_configured):
+        self.assertIsNone(self.router.db_for_read(Visit))
+        with db_router.analytics_reads():
+            self.assertEqual(self.router.db_for_read(Visit), db_router.REPLICA_ALIAS)
+            self.assertIsNone(self.router.db_for_read(User))
+        self.assertIsNone(self.router.db_for_read(Visit))
+
+    def test_a_write_pins_the_rest_of_the_request_to_the_primary(self, replica_configured):
+        with db_router.analytics_reads():
+            self.assertEqual(self.router.db_for_write(Visit), 'default')
+            self.assertIsNone(self.router.db_for_read(Visit))
+        self.assertTrue(db_router.has_written())
+
+    def test_pin_cookie(self, replica_configured):
+        def write(request):
+            self.router.db_for_write(Visit)
+            return HttpResponse()
+
+        def read(request):
+            with db_router.analytics_reads():
+                return HttpResponse(self.router.db_for_read(Visit) or 'default')
+
+        response = ReplicaPinningMiddleware(write)(RequestFactory().post('/'))
+        self.assertIn(db_router.PIN_COOKIE, response.cookies)
+
+        pinned = RequestFactory().get('/')
+        pinned.COOKIES[db_router.PIN_COOKIE] = '1'
+        self.assertEqual(ReplicaPinningMiddleware(read)(pinned).content, b'default')
+        self.assertEqual(ReplicaPinningMiddleware(read)(RequestFactory().get('/')).content, db_router.REPLICA_ALIAS.encode())
+        self.assertFalse(db_router.is_pinned())
@@ -1,10 +1,12 @@
 from django.urls import path
-from . import views 
+from . import views, api
 from .views import *
 
 urlpatterns = [
     path('login/', views.login_view, name='login'),
     path('gym-owner-dashboard/', views.gym_owner_dashboard, name='gym_owner_dashboard'),
+    path('portfolio/', views.portfolio_view, name='portfolio'),
+    path('api/portfolio/', api.api_portfolio, name='api_portfolio'),
     path('member-dashboard/', views.member_dashboard, name='member_dashboard'),
     path('<slug:slug>/check-in/', views.gym_checkin_view, name='gym_checkin'),
     path('<slug:slug>/dashboard/', views.gym_dashboard, name='gym_dashboard'),
@@ -15,4 +17,14 @@ urlpatterns = [
     path('gym/<slug:slug>/invite-manager/', views.invite_or_assign_manager, name='invite_or_assign_manager'),
     path('register-manager/', views.register_manager, name='register_manager'),
     path('gym/<slug:slug>/delete/', views.delete_gym, name='delete_gym'),
+    path('gym/<slug:slug>/kiosk-token/', views.rotate_kiosk_token, name='rotate_kiosk_token'),
+    path('<slug:slug>/members/import/', views.import_members_view, name='import_members'),
+    path('<slug:slug>/api/check-in/', api.api_check_in, name='api_check_in'),
+    path('<slug:slug>/api/check-in/batch/', api.api_check_in_batch, name='api_check_in_batch'),
+    path('<slug:slug>/api/occupancy/', api.api_occupancy, name='api_occupancy'),
+    path('<slug:slug>/visits/', views.gym_visit_history, name='gym_visit_history'),
+    path('<slug:slug>/api/visits/', api.api_visit_history, name='api_visit_history'),
+    path('<slug:slug>/visits/export/', views.export_visits_view, name='export_visits'),
+    path('<slug:slug>/peak-hours/', views.gym_heatmap_view, name='gym_heatmap'),
+    path('<slug:slug>/api/visits/series/', api.api_visit_series, name='api_visit_series'),
     ]
\ No newline at end of file
@@ -3,17 +3,28 @@ from django.contrib.auth import login, authenticate
 from django.contrib.auth.forms import AuthenticationForm, UserCreationForm, PasswordChangeForm
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
-from .models import GymOwner, Member, Visit, Gym, GymOwnership, VerificationToken
-from .forms import GymCodeForm, MemberUpdateForm, GymUpdateForm, ManagerRegistrationForm, GymCreationForm
+from .models import GymOwner, Member, MemberVisitStats, Visit, Gym, GymOwnership, VerificationToken
+from .forms import GymCodeForm, MemberUpdateForm, GymUpdateForm, ManagerRegistrationForm, GymCreationForm, MemberImportForm
 from django.utils.timezone import now
 from django.utils import timezone
-from django.http import JsonResponse
+from django.http import JsonResponse, StreamingHttpResponse
 from django.utils.http import urlsafe_base64_encode
 from django.utils.encoding import force_bytes
 from django.contrib.auth.models import User
-from django.db.models import Count
+from django.db.models import Count, Q
 from django.contrib.auth import update_session_auth_hash
 from core.emails import send_email
+from core.checkin import toggle_visit, CheckInError
+from core.metrics import get_gym_metrics
+from core.visit_history import visit_history_page, parse_history_filters, InvalidHistoryQuery
+from core.imports import MemberImport
+from core.access import gym_role_required, invalidate_gym_roles
+from core.db_router import analytics_reads, analytics_iterator
+from core.profiles import store_profile, require_profile, OWNER, MEMBER
+from core.exports import stream_visit_export, export_filename, CONTENT_TYPES, EXPORT_FORMATS
+from core.portfolio import portfolio_metrics, DEFAULT_DAYS as PORTFOLIO_DEFAULT_DAYS, MAX_DAYS as PORTFOLIO_MAX_DAYS
+from core.heatmap import gym_heatmap, DAYS, DEFAULT_WEEKS, MAX_WEEKS
+import io
 from django.conf import settings
 import random
 from django.urls import reverse
@@ -28,20 +39,14 @@ def login_view(request):
             user = form.get_user()
             login(request, user)
             
-            # Check if the user is a Gym Owner or Member and redirect accordingly
-            try:
-                gym_owner = GymOwner.objects.get(user=user)
+            # Work out once whether the user is a Gym Owner or Member, kept in the session for later requests
+            role = store_profile(request, user)
+            if role == OWNER:
                 # Redirect to gym owner's dashboard if user is a gym owner
                 return redirect('gym_owner_dashboard')
-            except GymOwner.DoesNotExist:
-                pass
-            
-            try:
-                member = Member.objects.get(user=user)
+            if role == MEMBER:
                 # Redirect to member's dashboard if user is a member
                 return redirect('member_dashboard')
-            except Member.DoesNotExist:
-                pass
 
             messages.error(request, "User role not found.")
             return redirect('login')
@@ -57,44 +62,48 @@ def login_view(request):
 
 # Login and render request for Gym Ownrs
 @login_required
+@analytics_reads()
 def gym_owner_dashboard(request):
     user = request.user
     try:
-        # Fetch the GymOwner profile for the logged-in user
-        gym_owner = GymOwner.objects.get(user=user)
-
-        # Query for gyms where the user is the primary owner
-        primary_gyms = GymOwnership.objects.filter(owner=gym_owner, role='primary').select_related('gym')
-
-        # Query for gyms where the user is a manager
-        managed_gyms = GymOwnership.objects.filter(owner=gym_owner, role='manager').select_related('gym')
+        # The GymOwner profile for the logged-in user, found at login
+        gym_owner = require_profile(request, OWNER)
+
+        # One query for every gym the user owns or manages, with its member counts
+        ownerships = (
+            GymOwnership.objects.filter(owner=gym_owner)
+            .select_related('gym')
+            .annotate(
+                member_count=Count('gym__members'),
+                active_members=Count('gym__members', filter=Q(gym__members__active=True)),
+            )
+            .order_by('gym__name')
+        )
 
-        # Prepare data for primary gyms
+        # Split into gyms where the user is the primary owner and gyms they manage
         primary_gym_data = []
-        for ownership in primary_gyms:
-            gym = ownership.gym
-            primary_gym_data.append({
-                'gym_name': gym.name,
-                'member_count': gym.members.count(),
-                'active_members': gym.members.filter(active=True).count(),
-                'gym_slug': gym.slug,
-            })
-
-        # Prepare data for managed gyms
         managed_gym_data = []
-        for ownership in managed_gyms:
-            gym = ownership.gym
-            managed_gym_data.append({
-                'gym_name': gym.name,
-                'member_count': gym.members.count(),
-                'active_members': gym.members.filter(active=True).count(),
-                'gym_slug': gym.slug,
-            })
-
-
-        # Get the limits and usage for gyms, members, etc.
-        gym_limit = gym_owner.get_usage_and_limit("gyms")
-        member_limit = gym_owner.get_usage_and_limit("members")
+        for ownership in ownerships:
+            gym_data = {
+                'gym_name': ownership.gym.name,
+                'member_count': ownership.member_count,
+                'active_members': ownership.active_members,
+                'gym_slug': ownership.gym.slug,
+            }
+            if ownership.role == 'primary':
+                primary_gym_data.append(gym_data)
+            else:
+                managed_gym_data.append(gym_data)
+
+        # Get the limits and usage for gyms and members from the rows above
+        gym_limit = {
+            'current_usage': len(primary_gym_data) if gym_owner.subscription_tier else 0,
+            'max_limit': gym_owner.get_limit('gyms'),
+        }
+        member_limit = {
+            'current_usage': sum(gym['member_count'] for gym in primary_gym_data) if gym_owner.subscription_tier else 0,
+            'max_limit': gym_owner.get_limit('members'),
+        }
         gyms_to_add = gym_limit['max_limit'] - gym_limit['current_usage']
 
         context = {
@@ -114,17 +123,41 @@ def gym_owner_dashboard(request):
         return redirect('login')
 
 
+# Compare every gym the owner is the primary owner of, side by side
+@login_required
+@analytics_reads()
+def portfolio_view(request):
+    if not request.profile or request.gym_role != OWNER:
+        messages.error(request, "No gym owner profile found.")
+        return redirect('login')
+
+    try:
+        days = min(max(int(request.GET.get('days', PORTFOLIO_DEFAULT_DAYS)), 1), PORTFOLIO_MAX_DAYS)
+    except ValueError:
+        days = PORTFOLIO_DEFAULT_DAYS
+    rows, totals = portfolio_metrics(request.profile_id, days=days)
+
+    return render(request, 'portfolio.html', {
+        'gym_owner_name': request.user.get_full_name(),
+        'days': days,
+        'gyms': rows,
+        'totals': totals,
+    })
+
+
 
 # Login and render request for Members
 @login_required
+@analytics_reads()
 def member_dashboard(request):
     user = request.user
     try:
-        member = Member.objects.get(user=user)        
+        member = require_profile(request, MEMBER)
 
-        # Get number of visits and average session time
-        number_of_visits = Visit.get_number_of_visits(member)
-        average_session_time = Visit.get_average_session_time(member)
+        # Visit count, average session and streak come from the member's precomputed stats row
+        stats = MemberVisitStats.objects.filter(member=member).first() or MemberVisitStats(member=member)
+        number_of_visits = stats.visit_count
+        average_session_time = round(stats.average_session_seconds / 60)
         recent_visits = Visit.objects.filter(member=member).order_by('-entry_time')[:5]
 
         for visit in recent_visits:
@@ -141,6 +174,8 @@ def member_dashboard(request):
             'member_name': user.get_full_name().capitalize() or user.username.capitalize(),
             'number_of_visits': number_of_visits,
             'average_session_time': average_session_time,
+            'last_visit': stats.last_visit,
+            'current_streak': stats.current_streak(),
             'recent_visits': recent_visits,
         }
         return render(request, 'member_dashboard.html', context)
@@ -150,41 +185,22 @@ def member_dashboard(request):
 
 
 # Gym checkin View (the render for the check-in page for each gym)
-def gym_checkin_view(request, slug):
-    # Fetch gym by its slug
-    gym = get_object_or_404(Gym, slug=slug)
-
-    # Check if logged in user is not the gym owner
-    if not gym.owners.filter(user=request.user).exists():
-        messages.error(request, "You are not authorized to access the check in page to this gym.")
-        return redirect('login')
-
+@gym_role_required(message="You are not authorized to access the check in page to this gym.")
+def gym_checkin_view(request, slug, gym, role):
     if request.method == 'POST':
         form = GymCodeForm(request.POST)
         if form.is_valid():
             gym_code = form.cleaned_data['gym_code']
             try:
-                member = Member.objects.get(gym_code=gym_code, gym=gym)
-
-                # Check if the member's subscription is active
-                if not member.active:  
-                    messages.error(request, f"Your subscription is inactive {member.user.first_name}, you cant Check-in right now.")
-                    return redirect('gym_checkin', slug=slug)
-
-                # Check if the member already has an active visit
-                active_visit = Visit.objects.filter(member=member, exit_time__isnull=True).first()
-                if active_visit:
-                    # Log the exit for the active visit
-                    active_visit.exit_time = now()
-                    active_visit.has_exit = True
-                    active_visit.save()
+                member, action, visit = toggle_visit(gym, gym_code)
+                if action == 'exit':
                     messages.success(request, f"Goodbye {member.user.first_name}, you are signed out!")
                 else:
-                    # Create a new visit entry
-                    Visit.objects.create(member=member, gym_code=gym_code)
                     messages.success(request, f"Welcome {member.user.first_name}, you are signed in!")
-            except Member.DoesNotExist:
-                messages.error(request, "Invalid gym code or you are not associated with this gym.")
+            except CheckInError as error:
+                messages.error(request, error.message)
+                if error.code == 'inactive':
+                    return redirect('gym_checkin', slug=slug)
         else:
             messages.error(request, "Form submission error.")
     else:
@@ -194,70 +210,29 @@ def gym_checkin_view(request, slug):
 
 
 
-# Gym Dashboard Page
+# Issue a new kiosk token for the JSON check-in API
 @login_required
-def gym_dashboard(request, slug):
-    # Fetch gym by its slug
-    user = request.user
-    gym = get_object_or_404(Gym, slug=slug)
-    # Check if logged in user is not the gym owner
-    # Check if the logged-in user is a gym owner or manager for this gym
-    try:
-        gym_ownership = GymOwnership.objects.filter(
-            gym=gym,
-            owner__user=user,
-            role__in=['primary', 'manager']
-        ).first()
-
-        if not gym_ownership:
-            messages.error(request, "You are not authorized to access this gym's dashboard.")
-            return redirect('login')
-    except GymOwnership.DoesNotExist:
-        messages.error(request, "You are not authorized to access this gym's dashboard.")
-        return redirect('login')
+@gym_role_required('primary', message="You must be the primary owner to manage the kiosk token.")
+def rotate_kiosk_token(request, slug, gym, role):
+    if request.method == "POST":
+        gym.rotate_kiosk_token()
+        messages.success(request, "A new kiosk token has been issued, update it on your check-in devices.")
+
+    return redirect('gym_settings', slug=slug)
 
-    # Metrics for Gym Dashboard
 
-    is_admin = gym.ownerships.filter(owner__user=user, role='primary').exists()
-    member_count = gym.members.count()
-    active_members_count = Member.objects.filter(gym=gym, active=True).count()
-    inactive_members_count = Member.objects.filter(gym=gym, active=False).count()
-
-    total_visits = Visit.get_number_of_visits_per_gym(gym)
-    today_visits = Visit.objects.filter(member__gym=gym, entry_time__date=timezone.now().date()).count()
-    avg_session_time = Visit.get_average_session_time_per_gym(gym) 
-
-    top_visitors = (
-        Visit.objects.filter(member__gym=gym, exit_time__isnull=False)
-        .values('member__user__username', 'member__gym_code') 
-        .annotate(visit_count=Count('id'))  
-        .order_by('-visit_count')  
-        )[:10]  
-    
-    recent_visits = (
-        Visit.objects.filter(member__gym=gym, exit_time__isnull=False)  
-        .order_by('-entry_time')  
-        )[:10]  
-
-    for visit in recent_visits:
-        if visit.exit_time:
-            session_duration = visit.exit_time - visit.entry_time
-            visit.session_duration = round(session_duration.total_seconds() / 60, 2) 
-        else:
-            visit.session_duration = 0 
 
+# Gym Dashboard Page
+@login_required
+@gym_role_required(message="You are not authorized to access this gym's dashboard.")
+@analytics_reads()
+def gym_dashboard(request, slug, gym, role):
+    # Metrics for Gym Dashboard
     context = {
         'gym_name': gym.name,
-        'member_count': member_count,
-        'total_visits': total_visits,
-        'today_visits': today_visits,
-        'avg_session_time': avg_session_time,
-        'top_visitors': top_visitors,
         'gym_slug': slug,
-        'recent_visits': recent_visits,
-        'active_members': active_members_count,
-        'inactive_members': inactive_members_count,
-        'is_admin': is_admin,
+        'is_admin': role == 'primary',
+        **get_gym_metrics(gym),
     }
     
     return render(request, 'gym_dashboard.html', context)  
@@ -268,7 +243,7 @@ def gym_dashboard(request, slug):
 def member_update_view(request):
     user = request.user
     try:
-        member = Member.objects.get(user=user)
+        member = require_profile(request, MEMBER)
     except Member.DoesNotExist:
         messages.error(request, "No member profile found.")
         return redirect('member_dashboard')
@@ -310,7 +285,7 @@ def member_update_view(request):
 def gym_owner_update_view(request):
     user = request.user
     try:
-        gym_owner = GymOwner.objects.get(user=user)
+        gym_owner = require_profile(request, OWNER)
     except GymOwner.DoesNotExist:
         messages.error(request, "No Gym Owner profile found.")
         return redirect('gym_owner_dashboard')
@@ -352,16 +327,8 @@ from .models import Gym, GymOwnership
 from .forms import GymUpdateForm
 
 @login_required
-def gym_settings(request, slug):
-    # Ensure the gym exists and the logged-in user is the primary owner
-    gym = get_object_or_404(Gym, slug=slug)
-    primary_owner = gym.ownerships.filter(role='primary', owner__user=request.user).first()
-
-    # If the user is not the primary owner, redirect them or show an error
-    if not primary_owner:
-        messages.error(request, "You must be the primary owner to access the settings.")
-        return redirect('gym_dashboard', slug=gym.slug)
-
+@gym_role_required('primary', message="You must be the primary owner to access the settings.")
+def gym_settings(request, slug, gym, role):
     # Get all gym ownership relationships for this gym
     gym_ownerships = gym.ownerships.select_related('owner').all()
 
@@ -399,15 +366,8 @@ def gym_settings(request, slug):
 
 
 @login_required
-def remove_manager(request, slug, manager_id):
-    gym = get_object_or_404(Gym, slug=slug)
-    primary_owner = gym.ownerships.filter(role='primary', owner__user=request.user).first()
-
-    # Ensure the logged-in user is the primary owner
-    if not primary_owner:
-        messages.error(request, "You must be the primary owner to remove a manager.")
-        return redirect('gym_dashboard', slug=gym.slug)
-
+@gym_role_required('primary', message="You must be the primary owner to remove a manager.")
+def remove_manager(request, slug, manager_id, gym, role):
     # Get the manager object and remove the ownership relation
     manager_ownership = gym.ownerships.filter(owner__id=manager_id, role='manager').first()
 
@@ -423,20 +383,14 @@ def remove_manager(request, slug, manager_id):
 
 
 @login_required
-def invite_or_assign_manager(request, slug):
-    gym = get_object_or_404(Gym, slug=slug)
-    primary_owner = gym.ownerships.filter(role='primary', owner__user=request.user).first()
+@gym_role_required('primary', message="You must be the primary owner to invite or assign a manager.")
+def invite_or_assign_manager(request, slug, gym, role):
     # Initialize 
     subject = ''
     body = ''
     max_managers = 20  # Maximum number of managers allowed
     current_manager_count = gym.ownerships.filter(role='manager').count()
 
-    # Ensure the logged-in user is the primary owner
-    if not primary_owner:
-        messages.error(request, "You must be the primary owner to invite or assign a manager.")
-        return redirect('gym_dashboard', slug=gym.slug)
-
     if request.method == 'POST':
         email = request.POST.get('email')
 
@@ -463,6 +417,8 @@ def invite_or_assign_manager(request, slug):
 
                 # Assign as manager and notify
                 GymOwnership.objects.create(gym=gym, owner=gym_owner, role='manager')
+                # Their sessions pick up the new role and gym on the next request
+                invalidate_gym_roles(user.pk)
                 messages.success(request, f"{user.get_full_name()} has been added as a manager.")
 
                 subject = "Added as a Manager for: {gym.name}"
@@ -550,6 +506,7 @@ def register_manager(request):
 
                 # Assign the user as a manager to the gym
                 GymOwnership.objects.create(gym=gym, owner=gym_owner, role='manager')
+                invalidate_gym_roles(user.pk)
 
                 # Mark the token as used
                 verification_token.is_used = True
@@ -571,16 +528,8 @@ def register_manager(request):
 
 # Button for a gym owner to delete a gym
 @login_required
-def delete_gym(request, slug):
-    # Fetch the gym
-    gym = get_object_or_404(Gym, slug=slug)
-
-    # Ensure the logged-in user is the primary owner
-    primary_owner = gym.ownerships.filter(role='primary', owner__user=request.user).first()
-    if not primary_owner:
-        messages.error(request, "You must be the primary owner to delete this gym.")
-        return redirect('gym_dashboard', slug=gym.slug)
-
+@gym_role_required('primary', message="You must be the primary owner to delete this gym.")
+def delete_gym(request, slug, gym, role):
     if request.method == "POST":
         # Delete the gym and related ownerships
         gym.delete()
@@ -591,3 +540,119 @@ def delete_gym(request, slug):
     return redirect('gym_settings', slug=slug)
 
 
+
+# Bulk import of members from a CSV upload, for gyms moving over from another system
+@login_required
+@gym_role_required('primary', message="You must be the primary owner to import members.")
+def import_members_view(request, slug, gym, role):
+    result = None
+    if request.method == "POST":
+        form = MemberImportForm(request.POST, request.FILES)
+        if form.is_valid():
+            # Read the upload line by line rather than loading it all into memory
+            lines = io.TextIOWrapper(form.cleaned_data['file'].file, encoding='utf-8-sig', newline='')
+            result = MemberImport(gym).run(lines)
+            if result.created:
+                messages.success(request, f"Imported {result.created} members.")
+            if result.errors:
+                messages.error(request, f"{len(result.errors)} row(s) could not be imported, see the report below.")
+        else:
+            messages.error(request, "Please upload a CSV file.")
+    else:
+        form = MemberImportForm()
+
+    return render(request, 'member_import.html', {
+        'form': form,
+        'gym': gym,
+        'gym_slug': slug,
+        'is_admin': True,
+        'result': result,
+        'errors': result.errors[:500] if result else [],
+    })
+
+
+
+# Browse a gym's full visit history, a page at a time
+@login_required
+@gym_role_required(message="You are not authorized to access this gym's visit history.")
+@analytics_reads()
+def gym_visit_history(request, slug, gym, role):
+    visits, next_cursor = [], None
+    try:
+        filters = parse_history_filters(request.GET)
+        visits, next_cursor = visit_history_page(
+            gym,
+            member=filters['member'],
+            status=filters['status'],
+            start=filters['start'],
+            end=filters['end'],
+            cursor=filters['cursor'],
+            limit=filters['limit'],
+        )
+    except InvalidHistoryQuery as error:
+        messages.error(request, str(error))
+
+    # Keep the current filters on the "next page" link
+    next_params = request.GET.copy()
+    next_params['cursor'] = next_cursor or ''
+
+    return render(request, 'gym_visit_history.html', {
+        'gym_name': gym.name,
+        'gym_slug': slug,
+        'is_admin': role == 'primary',
+        'visits': visits,
+        'next_page_query': next_params.urlencode() if next_cursor else None,
+        'filters': request.GET,
+    })
+
+
+
+# Download a gym's raw visits as CSV or JSON lines, streamed so any size of history uses the same memory
+@login_required
+@gym_role_required(message="You are not authorized to export this gym's visits.")
+@analytics_reads()
+def export_visits_view(request, slug, gym, role):
+    export_format = request.GET.get('format') or 'csv'
+    compress = request.GET.get('gzip') in ('1', 'true', 'yes')
+    try:
+        filters = parse_history_filters(request.GET)
+        if export_format not in EXPORT_FORMATS:
+            raise InvalidHistoryQuery(f"Format must be one of {', '.join(EXPORT_FORMATS)}.")
+    except InvalidHistoryQuery as error:
+        messages.error(request, str(error))
+        return redirect('gym_visit_history', slug=slug)
+
+    response = StreamingHttpResponse(
+        # The rows are read while the response streams, after this view has returned
+        analytics_iterator(stream_visit_export([gym], export_format, start=filters['start'], end=filters['end'], compress=compress)),
+        content_type='application/gzip' if compress else CONTENT_TYPES[export_format],
+    )
+    response['Content-Disposition'] = f'attachment; filename="{export_filename(gym.slug, export_format, compress)}"'
+    return response
+
+# Peak hours heatmap, the average number of members in the gym per weekday and hour
+@login_required
+@gym_role_required(message="You are not authorized to access this gym's peak hours.")
+@analytics_reads()
+def gym_heatmap_view(request, slug, gym, role):
+    try:
+        weeks = min(max(int(request.GET.get('weeks', DEFAULT_WEEKS)), 1), MAX_WEEKS)
+    except ValueError:
+        weeks = DEFAULT_WEEKS
+
+    matrix = gym_heatmap(gym, weeks=weeks)
+    busiest = max(max(row) for row in matrix) or 1
+    # Each cell is shaded relative to the busiest hour
+    rows = [
+        (day, [(value, round(value / busiest, 2)) for value in row])
+        for day, row in zip(DAYS, matrix)
+    ]
+
+    return render(request, 'gym_heatmap.html', {
+        'gym_name': gym.name,
+        'gym_slug': slug,
+        'is_admin': role == 'primary',
+        'weeks': weeks,
+        'hours': range(24),
+        'rows': rows,
+    })
@@ -0,0 +1,103 @@
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from .rollups import day_bounds
+import base64
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+
+class InvalidHistoryQuery(ValueError):
+    """Raised for a malformed cursor or filter value."""
+
+
+def encode_cursor(visit):
+    """Opaque cursor pointing just after `visit` in (entry_time, id) descending order."""
+    raw = f"{visit.entry_time.isoformat()}|{visit.pk}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        entry_time, visit_id = raw.rsplit('|', 1)
+        entry_time = parse_datetime(entry_time)
+        if entry_time is None:
+            raise ValueError(cursor)
+        return entry_time, int(visit_id)
+    except ValueError:
+        raise InvalidHistoryQuery("Invalid cursor.")
+
+
+def parse_history_filters(params):
+    """Read the history filters from request.GET, raises InvalidHistoryQuery for bad values."""
+    filters = {
+        'member': (params.get('member') or '').strip() or None,
+        'status': params.get('status') or None,
+        'start': None,
+        'end': None,
+        'cursor': params.get('cursor') or None,
+    }
+    if filters['status'] not in (None, 'open', 'closed'):
+        raise InvalidHistoryQuery("Status must be 'open' or 'closed'.")
+    for name in ('start', 'end'):
+        if params.get(name):
+            try:
+                filters[name] = parse_date(params[name])
+            except ValueError:
+                filters[name] = None
+            if filters[name] is None:
+                raise InvalidHistoryQuery(f"'{name}' must use the format YYYY-MM-DD.")
+    try:
+        filters['limit'] = min(max(int(params.get('limit', DEFAULT_PAGE_SIZE)), 1), MAX_PAGE_SIZE)
+    except ValueError:
+        raise InvalidHistoryQuery("'limit' must be a number.")
+    return filters
+
+
+def visit_history_page(gym, member=None, status=None, start=None, end=None, cursor=None, limit=DEFAULT_PAGE_SIZE):
+    """
+    One page of a gym's visits, newest first, returns (visits, next cursor or None).
+
+    Pages are found by seeking past the (entry_time, id) of the previous page's last row on the
+    (gym, entry_time) index, so a deep page costs the same as the first one and no COUNT is run.
+    `member` matches a gym code or a username, `start`/`end` are inclusive dates.
+    """
+    from .models import Visit
+
+    visits = Visit.objects.filter(gym=gym).select_related('member__user')
+    if member:
+        visits = visits.filter(Q(member__gym_code=member) | Q(member__user__username=member))
+    if status == 'open':
+        visits = visits.filter(exit_time__isnull=True)
+    elif status == 'closed':
+        visits = visits.filter(exit_time__isnull=False)
+    if start:
+        visits = visits.filter(entry_time__gte=day_bounds(start)[0])
+    if end:
+        visits = visits.filter(entry_time__lt=day_bounds(end)[1])
+    if cursor:
+        entry_time, visit_id = decode_cursor(cursor)
+        visits = visits.filter(Q(entry_time__lt=entry_time) | Q(entry_time=entry_time, id__lt=visit_id))
+
+    page = list(visits.order_by('-entry_time', '-id')[:limit + 1])
+    next_cursor = encode_cursor(page[limit - 1]) if len(page) > limit else None
+    page = page[:limit]
+    for visit in page:
+        if visit.exit_time:
+            visit.session_duration = round((visit.exit_time - visit.entry_time).total_seconds() / 60, 2)
+        else:
+            visit.session_duration = None
+    return page, next_cursor
+
+
+def serialize_visit(visit):
+    return {
+        'id': visit.pk,
+        'member': visit.member.user.username,
+        'gym_code': visit.member.gym_code,
+        'entry_time': timezone.localtime(visit.entry_time).isoformat(),
+        'exit_time': timezone.localtime(visit.exit_time).isoformat() if visit.exit_time else None,
+        'session_minutes': visit.session_duration,
+    }
@@ -0,0 +1,44 @@
+"""
+CACHES for settings.py, built from environment variables.
+
+GYM_CACHE_BACKEND           'locmem' (default), 'redis', 'memcached', 'database' or 'file'
+GYM_CACHE_LOCATION          Redis URL, memcached address, cache table or directory for the backend
+GYM_CACHE_KEY_PREFIX        Prefix for every key, to share one cache server between sites
+
+Cached dashboard metrics, visit series and slug lookups are invalidated by writes from web
+workers, kiosk syncs, management commands and run_scheduler. Those only reach each other through
+a shared cache, so any deployment running more than one process needs a backend other than
+'locmem', which keeps a separate cache in every process (manage.py check --deploy warns about it).
+"""
+
+import os
+
+BACKENDS = {
+    "locmem": "django.core.cache.backends.locmem.LocMemCache",
+    "redis": "django.core.cache.backends.redis.RedisCache",
+    "memcached": "django.core.cache.backends.memcached.PyMemcacheCache",
+    "database": "django.core.cache.backends.db.DatabaseCache",
+    "file": "django.core.cache.backends.filebased.FileBasedCache",
+}
+DEFAULT_LOCATIONS = {
+    "locmem": "gym-management",
+    "redis": "redis://127.0.0.1:6379/1",
+    "memcached": "127.0.0.1:11211",
+    # Created with manage.py createcachetable
+    "database": "gym_cache",
+}
+SHARED_BACKENDS = {BACKENDS[name] for name in ("redis", "memcached", "database", "file")}
+
+
+def caches_from_env(base_dir):
+    backend = os.environ.get("GYM_CACHE_BACKEND", "locmem").strip().lower()
+    if backend not in BACKENDS:
+        raise ValueError(f"GYM_CACHE_BACKEND must be one of {', '.join(BACKENDS)}, not {backend!r}.")
+    location = os.environ.get("GYM_CACHE_LOCATION") or DEFAULT_LOCATIONS.get(backend) or str(base_dir / "cache")
+    default = {
+        "BACKEND": BACKENDS[backend],
+        "LOCATION": location,
+    }
+    if os.environ.get("GYM_CACHE_KEY_PREFIX"):
+        default["KEY_PREFIX"] = os.environ["GYM_CACHE_KEY_PREFIX"]
+    return {"default": default}
@@ -0,0 +1,143 @@
+"""
+DATABASES for settings.py, built from environment variables.
+
+GYM_DB_ENGINE               'sqlite' (default) or 'postgresql'
+GYM_DB_NAME                 SQLite file or Postgres database, defaults to db.sqlite3 next to manage.py
+GYM_DB_HOST, GYM_DB_PORT, GYM_DB_USER, GYM_DB_PASSWORD   Postgres connection
+GYM_DB_CONN_MAX_AGE         Seconds a connection is kept between requests, 0 closes it after each one.
+                            Defaults to 60 on Postgres and 0 on SQLite, where opening one is only a file open
+GYM_DB_HEALTH_CHECKS        Check a kept connection still works before a request reuses it
+GYM_DB_POOL                 Postgres only, share a psycopg pool per process instead of keeping connections
+GYM_DB_POOL_MIN_SIZE, GYM_DB_POOL_MAX_SIZE, GYM_DB_POOL_TIMEOUT
+GYM_SQLITE_TUNING           Set to 0 for Django's plain SQLite settings
+GYM_SQLITE_BUSY_TIMEOUT     Milliseconds a SQLite writer waits for the lock before "database is locked"
+GYM_REPLICA_DB_NAME         Optional read replica (see core.db_router), with GYM_REPLICA_DB_HOST,
+                            _PORT, _USER and _PASSWORD defaulting to the primary's
+"""
+
+import os
+
+SQLITE_ENGINE = "django.db.backends.sqlite3"
+POSTGRES_ENGINE = "django.db.backends.postgresql"
+ENGINES = {"sqlite": SQLITE_ENGINE, "postgresql": POSTGRES_ENGINE}
+
+DEFAULT_CONN_MAX_AGE = 60
+DEFAULT_SQLITE_CONN_MAX_AGE = 0
+DEFAULT_BUSY_TIMEOUT = 5000
+DEFAULT_POOL_MIN_SIZE = 2
+DEFAULT_POOL_MAX_SIZE = 10
+DEFAULT_POOL_TIMEOUT = 10
+
+
+def env_bool(name, default=False):
+    value = os.environ.get(name)
+    if value is None or value == "":
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+def env_int(name, default):
+    value = os.environ.get(name)
+    return int(value) if value not in (None, "") else default
+
+
+def sqlite_options(busy_timeout=DEFAULT_BUSY_TIMEOUT):
+    """
+    Connection options that let check-ins write while dashboards read.
+
+    WAL lets readers carry on during a write, the busy timeout makes a writer wait for the lock
+    instead of failing, and synchronous=NORMAL is safe with WAL. Transactions take the write lock
+    when they begin, so two of them can't both read and then deadlock upgrading to a write.
+    """
+    return {
+        "init_command": (
+            f"PRAGMA busy_timeout={int(busy_timeout)};"
+            "PRAGMA journal_mode=WAL;"
+            "PRAGMA synchronous=NORMAL"
+        ),
+        "transaction_mode": "IMMEDIATE",
+    }
+
+
+def sqlite_database(name, tuned=True, conn_max_age=DEFAULT_SQLITE_CONN_MAX_AGE, health_checks=True, busy_timeout=DEFAULT_BUSY_TIMEOUT):
+    if not tuned:
+        # Django's defaults, a new connection per request and rollback journal locking
+        return {"ENGINE": SQLITE_ENGINE, "NAME": name}
+    return {
+        "ENGINE": SQLITE_ENGINE,
+        "NAME": name,
+        "CONN_MAX_AGE": conn_max_age,
+        "CONN_HEALTH_CHECKS": health_checks,
+        "OPTIONS": sqlite_options(busy_timeout),
+    }
+
+
+def postgres_database(name, host="", port="", user="", password="", conn_max_age=DEFAULT_CONN_MAX_AGE, health_checks=True, pool=None):
+    """`pool` is a dict of psycopg ConnectionPool arguments, it needs the psycopg[pool] extra."""
+    database = {
+        "ENGINE": POSTGRES_ENGINE,
+        "NAME": name,
+        "HOST": host,
+        "PORT": port,
+        "USER": user,
+        "PASSWORD": password,
+        "CONN_MAX_AGE": conn_max_age,
+        "CONN_HEALTH_CHECKS": health_checks,
+    }
+    if pool:
+        # The pool hands connections back after each request, Django refuses to also keep them open
+        database["CONN_MAX_AGE"] = 0
+        database["OPTIONS"] = {"pool": pool}
+    return database
+
+
+def database_from_env(base_dir):
+    engine = os.environ.get("GYM_DB_ENGINE", "sqlite").strip().lower()
+    if engine not in ENGINES:
+        raise ValueError(f"GYM_DB_ENGINE must be one of {', '.join(ENGINES)}, not {engine!r}.")
+    health_checks = env_bool("GYM_DB_HEALTH_CHECKS", True)
+
+    if engine == "sqlite":
+        return sqlite_database(
+            os.environ.get("GYM_DB_NAME") or base_dir / "db.sqlite3",
+            tuned=env_bool("GYM_SQLITE_TUNING", True),
+            conn_max_age=env_int("GYM_DB_CONN_MAX_AGE", DEFAULT_SQLITE_CONN_MAX_AGE),
+            health_checks=health_checks,
+            busy_timeout=env_int("GYM_SQLITE_BUSY_TIMEOUT", DEFAULT_BUSY_TIMEOUT),
+        )
+
+    pool = None
+    if env_bool("GYM_DB_POOL"):
+        pool = {
+            "min_size": env_int("GYM_DB_POOL_MIN_SIZE", DEFAULT_POOL_MIN_SIZE),
+            "max_size": env_int("GYM_DB_POOL_MAX_SIZE", DEFAULT_POOL_MAX_SIZE),
+            "timeout": env_int("GYM_DB_POOL_TIMEOUT", DEFAULT_POOL_TIMEOUT),
+        }
+    return postgres_database(
+        os.environ.get("GYM_DB_NAME", "gym_management"),
+        host=os.environ.get("GYM_DB_HOST", ""),
+        port=os.environ.get("GYM_DB_PORT", ""),
+        user=os.environ.get("GYM_DB_USER", ""),
+        password=os.environ.get("GYM_DB_PASSWORD", ""),
+        conn_max_age=env_int("GYM_DB_CONN_MAX_AGE", DEFAULT_CONN_MAX_AGE),
+        health_checks=health_checks,
+        pool=pool,
+    )
+
+
+def databases(base_dir):
+    """The DATABASES setting: the primary, plus the read replica when GYM_REPLICA_DB_NAME is set."""
+    default = database_from_env(base_dir)
+    result = {"default": default}
+    if os.environ.get("GYM_REPLICA_DB_NAME"):
+        result["replica"] = {
+            **default,
+            "NAME": os.environ["GYM_REPLICA_DB_NAME"],
+            "HOST": os.environ.get("GYM_REPLICA_DB_HOST", default.get("HOST", "")),
+            "PORT": os.environ.get("GYM_REPLICA_DB_PORT", default.get("PORT", "")),
+            "USER": os.environ.get("GYM_REPLICA_DB_USER", default.get("USER", "")),
+            "PASSWORD": os.environ.get("GYM_REPLICA_DB_PASSWORD", default.get("PASSWORD", "")),
+            # Tests read the primary through this alias instead of creating a second test database
+            "TEST": {"MIRROR": "default"},
+        }
+    return result
@@ -11,6 +11,8 @@ https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 
 from pathlib import Path
+from .caches import caches_from_env
+from .database import databases
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -30,6 +32,22 @@ SITE_NAME = 'FitTrack'
 
 ALLOWED_HOSTS = []
 
+# Seconds a gym's dashboard metrics may be served from the cache (writes invalidate them sooner)
+GYM_METRICS_CACHE_TTL = 60
+
+# Seconds a finished visit series bucket is cached. Backdated writes drop them sooner, this caps how long
+# a process can serve one that such a write didn't reach (see CACHES)
+GYM_SERIES_CACHE_TTL = 3600
+
+# Seconds a slug to gym lookup is cached in the default cache and in each process (saves and deletes invalidate
+# them in this process and the default cache)
+GYM_SLUG_CACHE_TTL = 300
+GYM_SLUG_LOCAL_CACHE_TTL = 5
+
+# Seconds a session keeps the user's role, profile and gym roles before checking them again
+# (ownership changes are picked up on the next request through GymRolesVersion)
+GYM_ROLES_SESSION_TTL = 60
+
 EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
 
 # Application definition
@@ -46,10 +64,12 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     "django.middleware.security.SecurityMiddleware",
+    "core.middleware.ReplicaPinningMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
     "django.contrib.auth.middleware.AuthenticationMiddleware",
+    "core.middleware.GymProfileMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
 ]
@@ -78,12 +98,18 @@ WSGI_APPLICATION = "gym_management.wsgi.application"
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
 
-DATABASES = {
-    "default": {
-        "ENGINE": "django.db.backends.sqlite3",
-        "NAME": BASE_DIR / "db.sqlite3",
-    }
-}
+# Configured from the environment, see gym_management/database.py. With nothing set this is
+# db.sqlite3 next to manage.py in WAL mode, or Postgres with persistent or pooled connections.
+DATABASES = databases(BASE_DIR)
+
+DATABASE_ROUTERS = ["core.db_router.AnalyticsReplicaRouter"]
+
+# Configured from the environment, see gym_management/caches.py. The default per-process memory
+# cache only suits a single process, deployments with several workers or run_scheduler must set
+# GYM_CACHE_BACKEND to a shared cache so invalidations reach every process.
+CACHES = caches_from_env(BASE_DIR)
+# Seconds a browser keeps reading from the primary after it wrote, to cover replication lag
+REPLICA_PIN_SECONDS = 5
 
 
 # Password validation